@@ -0,0 +1,119 @@
+"""
+benchCopy.py - Measures the cost of copying Graphs and changing the copies.
+
+Builds random graphs with 4 edges per vertex, from 10K up to 1M vertices, and
+for each one reports the time taken by copy(), by the first small change to
+the copy (adding a vertex and an edge, and deleting an edge), by the same
+change to the original while the copy is still alive, and by a one-edge
+commit to a ConcurrentGraph of the graph with a column store. With
+copy-on-write at the level of single vertices, edge lists and column pages,
+these times stay flat as the graph grows.
+
+Usage (the repo directory must be named YapyGraph):
+    python YapyGraph/benchmarks/benchCopy.py [--max-vertices N]
+"""
+
+import argparse
+import gc
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
+
+from YapyGraph.src.ConcurrentGraph import ConcurrentGraph
+from YapyGraph.src.Graph import Graph
+from YapyGraph.src.Vertex import Vertex
+
+# Labels given to the vertices, at random.
+LABELS = [ 'A', 'B', 'C', 'D', 'E', 'F', 'G', 'H' ]
+
+# Edges per vertex.
+EDGES_PER_VERTEX = 4
+
+# Graph sizes, in vertices.
+SIZES = [ 10**4, 10**5, 10**6 ]
+
+# One-edge commits timed per graph.
+COMMITS = 5
+
+# =============================================================================
+def populate(numVertices:int) -> Graph:
+    """
+    Returns a random graph with the given number of vertices.
+    """
+    rng = random.Random(numVertices)
+    g = Graph()
+    for i in range(numVertices):
+        g.addVertex( Vertex('v%d' % i, rng.choice(LABELS), i) )
+    for i in range(numVertices * EDGES_PER_VERTEX):
+        g.addEdge( 'v%d' % rng.randrange(numVertices), 'v%d' % rng.randrange(numVertices) )
+    return g
+
+# =============================================================================
+def edit(g:Graph, name:str) -> float:
+    """
+    Makes a small change to Graph g and returns the seconds it took. The
+    garbage collector is kept from running in the middle, since a full
+    collection walks every object of a large graph.
+    """
+    gc.collect()
+    gc.disable()
+    start = time.perf_counter()
+    g.addEdge( 'v1', Vertex(name, 'A') )
+    endVertex = g._edges['v2'][0] if len(g._edges['v2']) > 0 else None
+    if endVertex is not None:
+        g.deleteEdge( 'v2', endVertex.id )
+    seconds = time.perf_counter() - start
+    gc.enable()
+    return seconds
+
+# =============================================================================
+def commits(g:Graph) -> float:
+    """
+    Makes one-edge commits to a ConcurrentGraph of Graph g, with a column
+    store, and returns the average seconds per commit.
+    """
+    g.enableColumns()
+    cg = ConcurrentGraph(g)
+    gc.collect()
+    gc.disable()
+    start = time.perf_counter()
+    for i in range(COMMITS):
+        cg.addEdge( 'v%d' % i, Vertex('commit%d' % i, 'A') )
+        cg.commit()
+    seconds = time.perf_counter() - start
+    gc.enable()
+    return seconds / COMMITS
+
+# =============================================================================
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Measure Graph copy costs.")
+    parser.add_argument('--max-vertices', type=int, default=SIZES[-1],
+                        help="largest graph to build, in vertices")
+    args = parser.parse_args()
+
+    print( "%10s %12s %12s %12s %12s %12s" % ( 'vertices', 'copy ms', 'edit copy ms',
+           'edit orig ms', 'plain edit ms', 'commit ms' ) )
+    for numVertices in [ n for n in SIZES if n <= args.max_vertices ]:
+        g = populate(numVertices)
+        plain = edit(g, 'plain')
+
+        gc.collect()
+        gc.disable()
+        start = time.perf_counter()
+        c = g.copy()
+        copySeconds = time.perf_counter() - start
+        gc.enable()
+        editCopy = edit(c, 'inCopy')
+        editOriginal = edit(g, 'inOriginal')
+        del c
+        commit = commits(g)
+
+        print( "%10d %12.3f %12.3f %12.3f %12.3f %12.3f" % ( numVertices, copySeconds * 1000,
+               editCopy * 1000, editOriginal * 1000, plain * 1000, commit * 1000 ) )
+        del g
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,126 @@
+"""
+benchMemory.py - Measures the memory taken by Graphs of growing size.
+
+Builds random graphs with 4 edges per vertex, from 10K up to 10M edges, for
+each storage representation. Every graph is built in a fresh Python process
+so that peak RSS measures that graph alone. For each graph it reports the
+build time, the peak RSS above what the process used before building, the
+RSS bytes per edge, and the total of Graph.memoryUsage() per edge (the
+estimate, to compare with what the process really used).
+
+Usage (the repo directory must be named YapyGraph):
+    python YapyGraph/benchmarks/benchMemory.py [--max-edges N] [--representations plain columns]
+"""
+
+import argparse
+import json
+import os
+import random
+import resource
+import subprocess
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
+
+from YapyGraph.src.Graph import Graph
+from YapyGraph.src.Vertex import Vertex
+
+# Labels given to the vertices, at random.
+LABELS = [ 'A', 'B', 'C', 'D', 'E', 'F', 'G', 'H' ]
+
+# Edges per vertex.
+EDGES_PER_VERTEX = 4
+
+# Graph sizes, in edges.
+SIZES = [ 10**4, 10**5, 10**6, 10**7 ]
+
+# =============================================================================
+def populate(g:Graph, numEdges:int) -> Graph:
+    """
+    Adds random vertices and the given number of random edges to Graph g.
+    """
+    rng = random.Random(numEdges)
+    numVertices = max(2, numEdges // EDGES_PER_VERTEX)
+    for i in range(numVertices):
+        g.addVertex( Vertex('v%d' % i, rng.choice(LABELS), i) )
+    ids = list(g._vertices)
+    for i in range(numEdges):
+        g.addEdge( ids[rng.randrange(numVertices)], ids[rng.randrange(numVertices)] )
+    return g
+
+# =============================================================================
+def columnGraph() -> Graph:
+    """
+    Returns an empty graph that keeps a column store.
+    """
+    g = Graph()
+    g.enableColumns()
+    return g
+
+# The storage representations to measure: name -> function returning an
+# empty graph.
+REPRESENTATIONS = { 'plain' : Graph, 'columns' : columnGraph }
+
+# =============================================================================
+def maxRSS() -> int:
+    """
+    Returns the peak resident set size of this process, in bytes.
+    """
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss if sys.platform == 'darwin' else rss * 1024   # KB on Linux
+
+# =============================================================================
+def measure(representation:str, numEdges:int) -> dict:
+    """
+    Builds one graph in this process and returns its measurements.
+    """
+    baseline = maxRSS()
+    start = time.perf_counter()
+    g = populate(REPRESENTATIONS[representation](), numEdges)
+    seconds = time.perf_counter() - start
+    peak = maxRSS() - baseline
+
+    edges = g._numEdges()
+    usage = g.memoryUsage()
+    return { 'representation' : representation,
+             'vertices'       : g.numVertices(),
+             'edges'          : edges,
+             'seconds'        : seconds,
+             'peakRSS'        : peak,
+             'rssPerEdge'     : peak / edges,
+             'usagePerEdge'   : usage['total'] / edges,
+             'usage'          : usage }
+
+# =============================================================================
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Measure Graph memory use.")
+    parser.add_argument('--max-edges', type=int, default=SIZES[-1],
+                        help="largest graph to build, in edges")
+    parser.add_argument('--representations', nargs='+', default=list(REPRESENTATIONS),
+                        choices=list(REPRESENTATIONS))
+    parser.add_argument('--child', nargs=2, metavar=('REPRESENTATION', 'EDGES'),
+                        help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child is not None:
+        # Measure one graph and hand the results back to the parent.
+        print( json.dumps(measure(args.child[0], int(args.child[1]))) )
+        return
+
+    print( "%-8s %10s %10s %9s %12s %10s %12s" % ( 'repr', 'vertices', 'edges',
+           'seconds', 'peak RSS MB', 'RSS/edge', 'usage/edge' ) )
+    for numEdges in [ n for n in SIZES if n <= args.max_edges ]:
+        for representation in args.representations:
+            child = subprocess.run( [ sys.executable, os.path.abspath(__file__),
+                                      '--child', representation, str(numEdges) ],
+                                    stdout=subprocess.PIPE, check=True,
+                                    universal_newlines=True )
+            result = json.loads(child.stdout.splitlines()[-1])
+            print( "%-8s %10d %10d %9.1f %12.1f %10.1f %12.1f" % (
+                   representation, result['vertices'], result['edges'],
+                   result['seconds'], result['peakRSS'] / 2**20,
+                   result['rssPerEdge'], result['usagePerEdge'] ) )
+
+if __name__ == '__main__':
+    main()
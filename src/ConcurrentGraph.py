@@ -0,0 +1,190 @@
+"""
+ConcurrentGraph.py - A Graph shared between searching and writing threads.
+"""
+
+import contextlib
+import threading
+
+from YapyGraph.src.Graph import Graph
+from YapyGraph.src.SearchCache import SearchCache
+from YapyGraph.src.Vertex import Vertex
+
+class ConcurrentGraph(object):
+    """
+    Lets many threads search a graph while other threads change it.
+
+    Searches never wait: they run against the latest committed snapshot, a
+    Graph that is never changed again, so a search sees one consistent
+    version of the graph from start to finish. Writers take turns (one at a
+    time) changing a private working copy of the snapshot, made with
+    Graph.copy(). commit() publishes the working copy as the new snapshot,
+    so the changes are seen by searches started after the commit, while
+    searches already running carry on with the snapshot they started with.
+
+    The working copy shares the snapshot's vertices, edges and column store,
+    and copies only what the changes touch (see Graph.copy()), so a commit
+    costs about as much as the changes it publishes, however large the
+    graph.
+    """
+
+    # =========================================================================
+    def __init__(self, graph:Graph=None):
+        """
+        Builds a concurrent graph whose first snapshot is `graph`, or an empty
+        graph. `graph` must not be changed directly after this.
+
+        Inputs: graph - optional Graph to start with
+        """
+        # The latest committed snapshot. Replaced (never changed) by commit().
+        self._snapshot = graph if graph is not None else Graph()
+
+        # The writers' working copy of the snapshot, or None if there are no
+        # uncommitted changes.
+        self._working = None
+
+        # Held while writing to or committing the working copy.
+        self._writeLock = threading.RLock()
+
+        # Search cache handed on from snapshot to snapshot, or None.
+        self._searchCache = None
+
+    # =========================================================================
+    def abort(self) -> None:
+        """
+        Throws away the changes made since the last commit.
+        """
+        with self._writeLock:
+            self._working = None
+
+    # =========================================================================
+    def addEdge(self, u:str or Vertex, v:str or Vertex, bi:bool=False, label=None) -> None:
+        """
+        Graph.addEdge() on the working copy.
+        """
+        with self._writeLock:
+            self._workingCopy().addEdge(u, v, bi, label)
+
+    # =========================================================================
+    def addVertex(self, v:Vertex) -> Vertex:
+        """
+        Graph.addVertex() on the working copy.
+        """
+        with self._writeLock:
+            return self._workingCopy().addVertex(v)
+
+    # =========================================================================
+    def commit(self) -> Graph:
+        """
+        Makes the changes made since the last commit visible to searches
+        started from now on.
+
+        Output: the new snapshot
+        """
+        with self._writeLock:
+            if self._working is not None:
+                self._working._searchCache = self._searchCache
+                self._snapshot = self._working
+                self._working = None
+            return self._snapshot
+
+    # =========================================================================
+    def deleteEdge(self, sid:str, eid:str) -> bool:
+        """
+        Graph.deleteEdge() on the working copy.
+        """
+        with self._writeLock:
+            return self._workingCopy().deleteEdge(sid, eid)
+
+    # =========================================================================
+    def deleteVertex(self, vid:str) -> Vertex:
+        """
+        Graph.deleteVertex() on the working copy.
+        """
+        with self._writeLock:
+            return self._workingCopy().deleteVertex(vid)
+
+    # =========================================================================
+    def enableSearchCache(self, maxBytes:int=64*1024*1024) -> None:
+        """
+        Caches search results (see Graph.enableSearchCache()). The cache is
+        passed on to each new snapshot, so results stay cached across commits
+        until a change could affect them.
+
+        Inputs: maxBytes - the most memory the cached results may use
+        """
+        with self._writeLock:
+            if self._searchCache is None:
+                self._searchCache = SearchCache(maxBytes)
+            else:
+                self._searchCache.maxBytes = maxBytes
+            self._snapshot._searchCache = self._searchCache
+
+    # =========================================================================
+    def search(self, q:Graph) -> list:
+        """
+        Graph.search() on the latest snapshot.
+        """
+        return self._snapshot.search(q)
+
+    # =========================================================================
+    def searchCacheStats(self) -> dict:
+        """
+        Graph.searchCacheStats() of the latest snapshot.
+        """
+        return self._snapshot.searchCacheStats()
+
+    # =========================================================================
+    def searchMany(self, queries:list) -> list:
+        """
+        Graph.searchMany() on the latest snapshot.
+        """
+        return self._snapshot.searchMany(queries)
+
+    # =========================================================================
+    def snapshot(self) -> Graph:
+        """
+        Returns the latest committed snapshot. It can be read and searched
+        for as long as needed, from any thread, but must not be changed.
+        Its version (like that of any Graph) only grows from commit to commit.
+
+        Output: Graph
+        """
+        return self._snapshot
+
+    # =========================================================================
+    @contextlib.contextmanager
+    def writer(self):
+        """
+        Context manager that makes changes as one batch. Other writers wait
+        until the block ends. The block is given the working copy to change;
+        the changes are committed when the block ends, or thrown away if it
+        raises an exception.
+
+            with cg.writer() as g:
+                g.addEdge(...)
+                g.deleteVertex(...)
+        """
+        with self._writeLock:
+            try:
+                yield self._workingCopy()
+            except:
+                self.abort()
+                raise
+            self.commit()
+
+    # =========================================================================
+    def _workingCopy(self) -> Graph:
+        """
+        Returns the working copy, starting a new one from the snapshot if
+        there isn't one. The caller holds the write lock.
+        """
+        if self._working is None:
+            snapshot = self._snapshot
+            working = snapshot.copy()
+
+            # Keep the label versions so results cached on older snapshots
+            # can still be checked against this one.
+            working._labelVersions = dict(snapshot._labelVersions)
+            working._labelVersionsFloor = snapshot._labelVersionsFloor
+            self._working = working
+        return self._working
@@ -1,9 +1,20 @@
+import contextlib
 import copy
+from array import array
+import hashlib
+import itertools
 import logging
 import pickle
+import random
 import sys
+import tracemalloc
+import weakref
 
+from YapyGraph.src.GraphLog import GraphLog
+from YapyGraph.src.Overlay import Overlay
+from YapyGraph.src.SearchCache import SearchCache
 from YapyGraph.src.Vertex import Vertex
+from YapyGraph.src.VertexColumns import VertexColumns
 
 logging.basicConfig(stream=sys.stderr, level=logging.DEBUG)
 
@@ -14,6 +25,17 @@ class Graph(object):
     out-degree.
     """
 
+    # The (empty) set of edge ends for a (vid, label) not in the index.
+    _NO_TARGETS = frozenset()
+
+    # Most labels _labelVersions keeps the last change of. Older ones are
+    # dropped, and their latest version becomes _labelVersionsFloor.
+    _LABEL_VERSIONS = 4096
+
+    # Bytes taken by a Vertex object and its attributes (not counting what
+    # they point to), measured the first time memoryUsage() needs it.
+    _vertexBytes = None
+
     # =========================================================================
     def __init__(self):
         """
@@ -29,6 +51,17 @@ class Graph(object):
         # running from key id to value id.
         self._edges = {}
 
+        # The in-edges of each vertex: vid -> list of the ids of the vertices
+        # with an edge to it. Kept up to date along with _edges.
+        self._inEdges = {}
+
+        # Edge labels, keyed by (start vid, end vid). Unlabelled edges aren't
+        # stored.
+        self._edgeLabels = {}
+
+        # Index of labelled edges: (start vid, edge label) -> set of end vids.
+        self._outEdgeIndex = {}
+
         # All the neighbors in this graph, regardless of direction. key and value
         # are both vertex id. If v1 -> v2, then this dictionary stores two entries:
         # v1 -> v2 and v2 -> v1.
@@ -37,19 +70,84 @@ class Graph(object):
         # A stack of match dictionaries as used by _updateState().
         # self._matchHistory = []
 
+        # The undo log of the current transaction, or None if there is no
+        # transaction in progress. Each entry is a (method, args) pair that
+        # reverses one primitive change to the graph. See transaction().
+        self._undoLog = None
+
+        # Named savepoints in the current transaction. Maps the savepoint name
+        # to the length of the undo log when the savepoint was made.
+        self._savepoints = {}
+
+        # Weak references to every graph sharing storage with this one
+        # (including this one), in the order they were copied. The list
+        # object itself is shared by the whole group. See copy().
+        self._sharers = [ weakref.ref(self) ]
+
+        # Whether the storage dictionaries (see _storage()) are shared with a
+        # copy, so that they must be overlaid before they are changed.
+        self._sharedStorage = False
+
+        # While this graph shares storage with copies, the keys of the
+        # vertices, edge lists, in-edge lists and edge label index sets that
+        # belong to this graph alone and can be changed in place; any other
+        # one is copied before it is changed. None while everything belongs
+        # to this graph.
+        self._ownedVertices = None
+        self._ownedEdges = None
+        self._ownedInEdges = None
+        self._ownedTargets = None
+
+        # Mutation version. Bumped by every change to the graph, including
+        # changes undone by a rollback.
+        self._version = 0
+
+        # The version of the last change to a vertex with each label. Keyed
+        # by _labelKey() of the vertex label, oldest change first. Holds at
+        # most _LABEL_VERSIONS labels; the floor is the latest version of
+        # those dropped, before which changes can no longer be told apart.
+        self._labelVersions = {}
+        self._labelVersionsFloor = 0
+
+        # Cache of search() results, or None. See enableSearchCache().
+        self._searchCache = None
+
+        # (version, hash) of the last _structureHash() computed.
+        self._structureHashCache = None
+
+        # Column store of vertex attributes, or None. See enableColumns().
+        self._columns = None
+
+        # Write-ahead log every change is appended to, or None. See open().
+        self._log = None
+
+        # Union-find over the vertex ids, giving the weakly connected
+        # components: vid -> parent vid, and root vid -> number of vertices in
+        # its component. Kept up to date as vertices and edges are added, and
+        # dropped (None) when an edge removal may have split a component. See
+        # _pruneByComponent().
+        self._componentParent = {}
+        self._componentSize = {}
+
     # =========================================================================
-    def addEdge(self, u:str or Vertex, v:str or Vertex, bi:bool=False) -> None:
+    def addEdge(self, u:str or Vertex, v:str or Vertex, bi:bool=False, label=None) -> None:
         """
         Adds a directed edge from u to v. If u or v are strings, they are vertex
         id's of existing vertices. If either doesn't exist, this method raises
         an exception. u and v can also be Vertex objects, in which case they
-        are added as new vertices to the graph.
+        are added as new vertices to the graph. An edge that already exists is
+        left as it is, label included; delete it first to relabel it.
 
         Inputs: 
             u,v - endpoints of the edge; can be either new Vertex objects or 
                   the ids of existing vertices.
             bi - is this edge bidirectional? If so, two edges will be added
+            label - optional edge label (a string, or any hashable value).
+                    In a query graph, an unlabelled edge matches edges with
+                    any label, and a labelled one only edges with that label.
         """
+        self._prepareWrite()
+
         if isinstance(u, str): # u is string vertex id, find it
             u = self._vertices[u]
             if u is None:
@@ -65,19 +163,13 @@ class Graph(object):
         else: # v is a new Vertex, add it
             self.addVertex(v)
 
-        # Update edges if they don't already exist.
-        if v not in self._edges[u.id]:
-            self._edges[u.id].append(v)     # add an edge from u to v
-            u.degree += 1
-            v.degree += 1
-            # Update neighbors
-            # self._neighbors[u.id].append(v)     # m is a neighbor of n
-            # self._neighbors[v.id].append(u)     # n is a neighbor or m
+        # Update edges if they don't already exist. Check by id: linking may
+        # replace u and v with copies of their own (see copy()).
+        if not self.hasEdge(u.id, v.id):
+            self._linkEdge(u, v, None, label)   # add an edge from u to v
 
-        if bi and u not in self._edges[v.id]:
-            self._edges[v.id].append(u)     # add an edge from v to u 
-            u.degree += 1
-            v.degree += 1     
+        if bi and not self.hasEdge(v.id, u.id):
+            self._linkEdge(v, u, None, label)   # add an edge from v to u
 
     # =========================================================================
     def addVertex(self, v:Vertex) -> Vertex:
@@ -91,14 +183,142 @@ class Graph(object):
         one already exists with the same id.
         """
         if v.id not in self._vertices:
-            self._vertices[v.id] = v
-            self._edges[v.id] = []  # no edges yet
-           # self._neighbors[v.id] = []
+            self._prepareWrite()
+            self._insertVertex(v)
         else:
             v = self._vertices[v.id]
 
         return v
 
+    # =========================================================================
+    def bfs(self, vid:str, direction:str='out', maxDepth:int=None):
+        """
+        Iterator that returns the vertices reachable from the vertex with the
+        given id in breadth-first order, starting with that vertex. The
+        search goes one level at a time, keeping a visited set and a list of
+        the vertices on the current level.
+
+        Inputs:
+            vid - id of the vertex to start from
+            direction - follow edges 'out' of vertices, 'in' to them, or 'both'
+            maxDepth - stop this many edges away from the start, or None
+        """
+        neighbors = self._neighborIds(direction)
+        start = self._getExisting(vid)
+        yield start
+
+        visited = { vid }
+        frontier = [ vid ]
+        depth = 0
+        while len(frontier) > 0 and (maxDepth is None or depth < maxDepth):
+            depth += 1
+            nextFrontier = []
+            for x in frontier:
+                for w in neighbors(x):
+                    if w not in visited:
+                        visited.add(w)
+                        nextFrontier.append(w)
+                        yield self._vertices[w]
+            frontier = nextFrontier
+
+    # =========================================================================
+    def canonicalForm(self) -> tuple:
+        """
+        Returns the canonical form of this graph: a hashable value that is
+        the same for two graphs exactly when they are isomorphic, i.e. equal
+        up to vertex ids, taking vertex labels, edge labels and edge
+        directions into account. Vertex numbers are ignored, and a list of
+        labels counts as a set of labels.
+
+        The vertices are put in canonical order by colour refinement and
+        individualization, as in nauty: vertices are coloured by their labels
+        and degrees, colours are split by the colours of in- and
+        out-neighbours until nothing changes, and ties are broken by trying
+        each vertex of the first non-singleton colour in turn, keeping the
+        smallest result. The automorphisms found along the way keep it from
+        trying vertices that are equivalent to ones already tried (see
+        _individualize()), so symmetric graphs such as hypercubes and cycles
+        stay fast, but some large, highly regular graphs can still take
+        exponential time.
+
+        Output: (labels, edges) tuple, where labels[i] is the sorted tuple of
+        labels of the i'th vertex in canonical order, and edges is the sorted
+        tuple of (i, j) pairs for the unlabelled edges and (i, j, label)
+        triples for the labelled ones.
+        """
+        order = self._canonicalOrder()
+        position = { vid : i for i, vid in enumerate(order) }
+        labels = tuple( Graph._labelSignature(self._vertices[vid].label) for vid in order )
+        edges = []
+        for vid in order:
+            for w in self._edges[vid]:
+                label = self.edgeLabel(vid, w.id)
+                edge = ( position[vid], position[w.id] )
+                edges.append( edge if label is None else edge + (label,) )
+        edges.sort( key=lambda edge: edge[:2] )
+        return ( labels, tuple(edges) )
+
+    # =========================================================================
+    def checkpoint(self) -> None:
+        """
+        Writes the whole graph to the checkpoint file of the write-ahead log
+        and empties the log, so recovery only has to replay the changes made
+        after this (see open()).
+        """
+        if self._log is None:
+            raise Exception("The graph has no write-ahead log.")
+        if self._undoLog is not None:
+            raise Exception("Cannot checkpoint during a transaction.")
+        self._log.checkpoint( self._checkpointRecords() )
+
+    # =========================================================================
+    def closeLog(self) -> None:
+        """
+        Syncs and closes the write-ahead log. Changes made after this are not
+        logged.
+        """
+        if self._log is not None:
+            self._log.close()
+            self._log = None
+
+    # =========================================================================
+    def copy(self):
+        """
+        Returns a copy of this graph. The copy is copy-on-write, at the level
+        of single vertices and edge lists: the two graphs share all of their
+        storage, and a change to either one copies only the vertices and
+        edge lists it touches, keeping them in an Overlay of the shared
+        dictionaries (see _prepareWrite()). Making a copy and changing it a
+        little costs about as much as the change, however large the graph.
+
+        Since vertices are shared, a Vertex object held by the caller may
+        stop belonging to a graph (the original as well as the copy) once
+        that graph changes the vertex; look vertices up again by id after
+        changing a graph that has been copied. The copy has no write-ahead
+        log, and no component index until weaklyConnectedComponents() is
+        called on it (see _pruneByComponent()).
+
+        Output: new Graph
+        """
+        if self._undoLog is not None:
+            raise Exception("Cannot copy a graph during a transaction.")
+
+        clone = Graph()
+        clone._setStorage( self._storage() )
+        if self._columns is not None:
+            clone._columns = self._columns.copy()
+        clone._version = self._version
+        clone._componentParent = clone._componentSize = None
+        clone._sharers = self._sharers
+        clone._sharers.append( weakref.ref(clone) )
+        for g in ( self, clone ):
+            g._sharedStorage = True
+            g._ownedVertices = set()
+            g._ownedEdges = set()
+            g._ownedInEdges = set()
+            g._ownedTargets = set()
+        return clone
+
     # =========================================================================
     def deleteEdge(self, sid:str, eid:str) -> bool:
         """
@@ -113,6 +333,8 @@ class Graph(object):
             eid not in self._vertices:
             return False
 
+        self._prepareWrite()
+
         # Get the vertices.
         startVertex = self._vertices[sid]
         endVertex = self._vertices[eid]
@@ -121,18 +343,8 @@ class Graph(object):
         if endVertex not in self._edges[sid]:
             return False
 
-        # Remove the edge.
-        self._edges[sid].remove(endVertex)
-
-        # Update neighbors if we've just removed the only edge
-        # between u1 and u2.
-        # if startVID not in self._edges[endVID]:
-        #     self._neighbors[startVID].remove(endVertex)
-        #     self._neighbors[endVID].remove(startVertex)
-
-        # Update vertex degrees.
-        startVertex.degree -= 1
-        endVertex.degree   -= 1
+        # Remove the edge and update vertex degrees.
+        self._unlinkEdge(startVertex, endVertex)
 
         return True
 
@@ -148,24 +360,68 @@ class Graph(object):
         if vid not in self._vertices:
             return None
 
-        # Remove any edges leading out of vid.
-        for endVertex in self._edges[vid]:
+        self._prepareWrite()
+
+        # Remove any edges leading out of vid. Iterate over a copy, since
+        # deleteEdge() removes from the list.
+        for endVertex in list(self._edges[vid]):
             self.deleteEdge(vid, endVertex.id)
 
         # Remove any edges leading to vid.
-        for startVID in self._vertices:
+        for startVID in list(self._inEdges[vid]):
             self.deleteEdge(startVID, vid)
 
-        # Remove vid as a key in the list of edges.
-        self._edges.pop(vid)
+        # Delete the vertex itself, and vid as a key in the list of edges.
+        return self._removeVertex(vid)
 
-        # Remove vid from any neighbor lists, and from the list itself.
-        # for id in self._neighbors:
-        #     if id in self._neighbors[id]: self._neighbors[id].remove(vid)
-        # self._neighbors.pop(vid)
+    # =========================================================================
+    def disableColumns(self) -> None:
+        """
+        Stops keeping the column store and drops it.
+        """
+        self._columns = None
 
-        # Delete the vertex itself.
-        return self._vertices.pop(vid)
+    # =========================================================================
+    def disableSearchCache(self) -> None:
+        """
+        Stops caching search() results and drops the cache.
+        """
+        self._searchCache = None
+
+    # =========================================================================
+    def dfs(self, vid:str, direction:str='out'):
+        """
+        Iterator that returns the vertices reachable from the vertex with the
+        given id in depth-first (preorder) order, starting with that vertex.
+        The order is the same as a recursive search's, but the search keeps
+        its own stack, so it works on paths of any length.
+
+        Inputs:
+            vid - id of the vertex to start from
+            direction - follow edges 'out' of vertices, 'in' to them, or 'both'
+        """
+        neighbors = self._neighborIds(direction)
+        yield self._getExisting(vid)
+
+        visited = { vid }
+        stack = [ iter(neighbors(vid)) ]
+        while len(stack) > 0:
+            for w in stack[-1]:
+                if w not in visited:
+                    visited.add(w)
+                    yield self._vertices[w]
+                    stack.append( iter(neighbors(w)) )
+                    break
+            else:
+                stack.pop()
+
+    # =========================================================================
+    def edgeLabel(self, startVID:str, endVID:str):
+        """
+        Returns the label of the edge from startVID to endVID, or None if the
+        edge is unlabelled or doesn't exist.
+        """
+        return self._edgeLabels.get( (startVID, endVID) )
 
     # =========================================================================
     def edges(self):
@@ -177,6 +433,37 @@ class Graph(object):
                 startVertex = self._vertices[startVID]
                 yield ( startVertex, endVertex )
 
+    # =========================================================================
+    def enableColumns(self) -> None:
+        """
+        Starts keeping a column store of the vertices' degrees, in-degrees,
+        out-degrees, labels and numbers (see VertexColumns.py), kept up to
+        date by every change to the graph. Candidate filtering in search()
+        and selectVertices() then test all the vertices at once with NumPy
+        (if installed) instead of one Vertex at a time. Copies made with
+        copy() share the column store, copy-on-write (see
+        VertexColumns.copy()).
+        """
+        columns = VertexColumns()
+        inn = self._inNeighbors()
+        for vid, v in self._vertices.items():
+            columns.add(v, len(inn[vid]), len(self._edges[vid]))
+        self._columns = columns
+
+    # =========================================================================
+    def enableSearchCache(self, maxBytes:int=64*1024*1024) -> None:
+        """
+        Starts caching search() results, keeping the most recently used
+        results that fit in about `maxBytes` of memory. Results are cached
+        per query structure (ids, labels, degrees and edge directions), and
+        are reused as long as no vertex whose label the query could match has
+        been added, deleted, or had an edge added or removed since. Searches
+        return copies of the cached results, so callers may change them.
+
+        Inputs: maxBytes - memory limit for the cached results
+        """
+        self._searchCache = SearchCache(maxBytes)
+
     # =========================================================================
     def hasEdge(self, startVID:str, endVID:str) -> bool:
         """
@@ -200,6 +487,84 @@ class Graph(object):
                 return v
         return None
     
+    # =========================================================================
+    def kHopNeighborhood(self, vid:str, k:int, direction:str='both') -> list:
+        """
+        Returns the vertices at most k edges away from the vertex with the
+        given id (including that vertex), nearest first.
+
+        Inputs:
+            vid - id of the vertex at the centre
+            k - number of hops
+            direction - follow edges 'out' of vertices, 'in' to them, or 'both'
+        Output: list of Vertex objects
+        """
+        return list( self.bfs(vid, direction, k) )
+
+    # =========================================================================
+    def memoryUsage(self) -> dict:
+        """
+        Returns an estimate of the memory used by this graph, in bytes, as a
+        dictionary with keys:
+            'vertices' - Vertex objects with their ids and numbers, and the
+                         vid->Vertex dictionary
+            'labels' - vertex labels (lists and their strings) and edge labels
+            'adjacency' - the edge dictionary, the edge lists and the edge
+                          label dictionary
+            'indexes' - in-edge lists, label versions, edge label index,
+                        component union-find, column store and search cache
+            'total' - the sum of the above
+        Objects shared by several vertices, such as equal interned strings,
+        are counted once. Graphs sharing storage through copy() each count
+        all of it, and the changes they keep on top of it.
+        """
+        size = sys.getsizeof
+        seen = set()
+
+        def once(obj) -> int:
+            if obj is None or id(obj) in seen:
+                return 0
+            seen.add(id(obj))
+            return size(obj)
+
+        def table(d) -> int:
+            return d.memoryUsage() if isinstance(d, Overlay) else size(d)
+
+        vertexBytes = Graph._measureVertex()
+        vertices = table(self._vertices)
+        labels = 0
+        for v in self._vertices.values():
+            vertices += vertexBytes + once(v.id) + once(v.number)
+            labels += once(v.label)
+            if isinstance(v.label, list):
+                labels += sum( once(l) for l in v.label )
+
+        adjacency = table(self._edges) + table(self._edgeLabels)
+        for endVertices in self._edges.values():
+            adjacency += size(endVertices)
+        for key, label in self._edgeLabels.items():
+            adjacency += size(key)
+            labels += once(label)
+
+        indexes = table(self._inEdges) + size(self._labelVersions) + \
+            table(self._outEdgeIndex)
+        for startVIDs in self._inEdges.values():
+            indexes += size(startVIDs)
+        for key, targets in self._outEdgeIndex.items():
+            indexes += size(key) + size(targets)
+        if self._componentParent is not None:
+            indexes += size(self._componentParent) + size(self._componentSize)
+        if self._columns is not None:
+            indexes += self._columns.memoryUsage()
+        if self._searchCache is not None:
+            indexes += size(self._searchCache._entries) + self._searchCache.bytes
+
+        return { 'vertices'  : vertices,
+                 'labels'    : labels,
+                 'adjacency' : adjacency,
+                 'indexes'   : indexes,
+                 'total'     : vertices + labels + adjacency + indexes }
+
     # =========================================================================
     def numVertices(self):
         """
@@ -207,6 +572,46 @@ class Graph(object):
         """
         return len(self._vertices)
     
+    # =========================================================================
+    @staticmethod
+    def open(path:str, syncEvery:int=64):
+        """
+        Returns the graph held by the write-ahead log at `path` (see
+        GraphLog.py), creating the log if it doesn't exist. The graph is
+        rebuilt from the latest checkpoint plus the changes logged after it,
+        skipping the checks and bookkeeping of the public methods, so
+        recovery takes time in proportion to the size of the graph and the
+        log tail. From then on, every change to the graph is appended to the
+        log. Records are fsynced in batches of `syncEvery`, so a crash can
+        lose the last few changes; call syncLog() to make them durable.
+
+        Inputs:
+            path - path of the log file
+            syncEvery - number of changes to buffer between fsyncs
+        Output: new Graph
+        """
+        log = GraphLog(path, syncEvery)
+        g = Graph()
+        g._replay( log.recover() )
+        g._log = log
+        return g
+
+    # =========================================================================
+    def partition(self, numShards:int=2, by:str='hash'):
+        """
+        Returns a copy of this graph split into shards, each held and searched
+        by its own worker process (see PartitionedGraph.py). Later changes to
+        this graph are not seen by the partitioned copy.
+
+        Inputs:
+            numShards - number of shards
+            by - 'hash' (by vertex id) or 'label' (vertices with the same
+                 label together)
+        Output: PartitionedGraph
+        """
+        from YapyGraph.src.PartitionedGraph import PartitionedGraph
+        return PartitionedGraph(self, numShards, by)
+
     # =========================================================================
     def __repr__(self):
         """Outputs this graph in dot notation. See 
@@ -214,7 +619,7 @@ class Graph(object):
 
             digraph {
               A->B->C;
-              B->D;
+              B->D [label="x"];
             }
 
         """
@@ -227,18 +632,155 @@ class Graph(object):
         else:
             for vertexID,neighbors in self._edges.items():
                 for neighbor in neighbors:
-                    s += "%s->%s;\n" % ( str(self._vertices[vertexID]), str(neighbor) )
+                    label = self.edgeLabel(vertexID, neighbor.id)
+                    if label is None:
+                        s += "%s->%s;\n" % ( str(self._vertices[vertexID]), str(neighbor) )
+                    else:
+                        s += "%s->%s [label=\"%s\"];\n" % ( str(self._vertices[vertexID]),
+                                                            str(neighbor), label )
 
         s += "\n}"
         return s
 
+    # =========================================================================
+    def rollback(self, name:str=None) -> None:
+        """
+        Undoes every change made since the savepoint with the given name, or
+        since the start of the transaction if no name is given. The
+        transaction stays open, and savepoints made after the one rolled back
+        to are forgotten.
+
+        Inputs: name - savepoint name, or None
+        """
+        if self._undoLog is None:
+            raise Exception("No transaction in progress.")
+        if name is not None and name not in self._savepoints:
+            raise Exception("Savepoint %s does not exist." % name)
+
+        mark = 0 if name is None else self._savepoints[name]
+
+        # Undo the changes, newest first. The log is detached while undoing
+        # so the primitives don't log the undo operations themselves.
+        log = self._undoLog
+        self._undoLog = None
+        while len(log) > mark:
+            method, args = log.pop()
+            method(*args)
+        self._undoLog = log
+
+        self._savepoints = { n : m for n, m in self._savepoints.items() if m <= mark }
+
+    # =========================================================================
+    def savepoint(self, name:str) -> None:
+        """
+        Marks the current state of the graph inside a transaction, so it can
+        be returned to later with rollback(name). Reusing a name moves the
+        savepoint.
+
+        Inputs: name - savepoint name
+        """
+        if self._undoLog is None:
+            raise Exception("No transaction in progress.")
+        self._savepoints[name] = len(self._undoLog)
+
+    # -------------------------------------------------------------------------
+    def sampleMatch(self, q, rng:random.Random=None, tries:int=64,
+                    fallback:bool=False) -> dict:
+        """
+        Returns one random instance of Graph q in self without enumerating
+        every instance the way search() does.
+
+        Each try walks a single path down the search tree, picking uniformly
+        among the joinable candidates at every level. The joinable
+        candidates are looked for among the neighbours of the matches of the
+        query neighbours matched already, so a level costs about the degrees
+        of those matches, however large the graph. A walk reaches a given
+        instance with probability 1/prod(joinable), so it is weighted by
+        prod(joinable), which makes the weights an unbiased estimate of the
+        number of instances; one of the walks that completed is then picked
+        in proportion to its weight. The more tries, the closer the
+        instances returned are to uniformly distributed.
+
+        If none of the `tries` walks completes, an Exception is raised,
+        unless `fallback` is True and q does appear in self. Then a
+        backtracking search with shuffled candidates returns the first match
+        it finds instead, which is further from uniformly distributed, and a
+        warning is logged.
+
+        Inputs:
+            q - query Graph
+            rng - random number generator; a new one is made if None
+            tries - number of random walks to make
+            fallback - return a backtracking match rather than raise when no
+                       walk completes
+        Output: a vid->vid mapping from q to self, or None if q does not
+        appear in self.
+        """
+        matches = self.sampleMatches(q, 1, rng, tries, fallback)
+        return matches[0] if len(matches) > 0 else None
+
+    # -------------------------------------------------------------------------
+    def sampleMatches(self, q, k:int, rng:random.Random=None, tries:int=64,
+                      fallback:bool=False) -> list:
+        """
+        Returns `k` random instances of Graph q in self, drawn independently
+        (so the same instance may appear more than once), each from its own
+        `tries` random walks. See sampleMatch(), including for what happens
+        when no walk completes.
+
+        Inputs:
+            q - query Graph
+            k - number of instances to return
+            rng - random number generator; a new one is made if None
+            tries - number of random walks to make per instance
+            fallback - return backtracking matches rather than raise when no
+                       walk completes
+        Output: list of k vid->vid mappings, or an empty list if q does not
+        appear in self.
+        """
+        if rng is None:
+            rng = random.Random()
+
+        C = self._findCandidates(q)
+        if len(C) != q.numVertices() or len(C) == 0:
+            return []
+
+        plan = self._samplePlan(q, C)
+        matches = []
+        while len(matches) < k:
+            walks = []
+            weights = []
+            for i in range(tries):
+                M, weight = self._sampleWalk(q, C, plan, rng)
+                if M is not None:
+                    walks.append(M)
+                    weights.append(weight)
+            if len(walks) > 0:
+                matches.append( rng.choices(walks, weights)[0] )
+                continue
+
+            M = self._sampleSearch(q, dict(), C, rng)
+            if M is None:
+                # There are no instances at all.
+                return []
+            if not fallback:
+                raise Exception("No random walk completed after %d tries." % tries)
+            logging.warning("No random walk completed after %d tries; returning "
+                            "the first match of a backtracking search." % tries)
+            matches.append(M)
+
+        return matches
+
     # -------------------------------------------------------------------------
     def search(self, q) -> list:
         """
         Search for every instance of Graph q in self. Based on Ullman's
         search algorithm as described in _An In-depth Comparison of Subgraph 
         Isomorphism Algorithms in Graph Databases_, Lee et al., 2013.
-        NB: Only the vertex labels are used to find matches.
+        NB: A query vertex matches data vertices that have its label (see
+        Vertex.hasLabel()). A labelled query edge only matches a data edge
+        with the same label; an unlabelled one matches any data edge in the
+        same direction, labelled or not.
 
         https://dl.acm.org/doi/pdf/10.14778/2535568.2448946
         https://dl-acm-org.ezproxy.gvsu.edu/doi/pdf/10.14778/2535568.2448946
@@ -248,6 +790,13 @@ class Graph(object):
         Output: all subgraph isomorphisms of q in g, in the form of vid->vid
         mappings from q to g.
         """
+        # Answer from the cache if it has a fresh result for q.
+        if self._searchCache is not None:
+            key = q._cacheKey()
+            cached = self._searchCache.lookup(key, self._isFresh, self._version)
+            if cached is not None:
+                return [ dict(M) for M in cached ]
+
         # A list of all isomorphism solutions.
         solutions = []
 
@@ -256,35 +805,519 @@ class Graph(object):
         # one is found, it will be appended to `solutions`.
         M = dict()
 
-        # C is a list of candidates for each query vertex u.
-        C = self._findCandidates(q) 
+        # C is a list of candidates for each query vertex u. A query with as
+        # many vertices and edges as self can only match all of self, which
+        # means the two are isomorphic; they can't be if their structures
+        # hash differently.
+        if q.numVertices() == self.numVertices() and \
+                q._numEdges() == self._numEdges() and \
+                q._structureHash() != self._structureHash():
+            C = dict()
+        else:
+            C = self._findCandidates(q) 
+            C = self._pruneByComponent(q, C)
         if len(C) != q.numVertices() or len(C) == 0:
-            # If we didn't find candidates for all u's, return no solutions.
-            return solutions
-        
-        # 8: SubgraphSearch (q, g, M, ...);
-        self._subgraphSearch(q, M, C, solutions)
+            # If we didn't find candidates for all u's, there are no solutions.
+            pass
+        else:
+            # 8: SubgraphSearch (q, g, M, ...);
+            self._subgraphSearch(q, M, C, solutions)
+
+        if self._searchCache is not None:
+            labels = set( Graph._labelKey(u.label) for u in q.vertices() )
+            self._searchCache.store(key, self._version, labels,
+                                    [ dict(M) for M in solutions ])
 
         return solutions
 
+    # -------------------------------------------------------------------------
+    def searchCacheStats(self) -> dict:
+        """
+        Returns statistics about the search cache as a dictionary with keys
+        'hits', 'misses', 'entries' and 'bytes', or None if caching is off.
+        """
+        if self._searchCache is None:
+            return None
+        return { 'hits'    : self._searchCache.hits,
+                 'misses'  : self._searchCache.misses,
+                 'entries' : len(self._searchCache),
+                 'bytes'   : self._searchCache.bytes }
+
+    # -------------------------------------------------------------------------
+    def searchMany(self, queries:list) -> list:
+        """
+        Searches for every instance of each query Graph in `queries`. The
+        results are the same as calling search() once per query, but the work
+        is shared: candidate data vertices are found in a single pass over
+        self, once per distinct (label, degree) requirement, and queries whose
+        leading query vertices look alike (same label, degree, and edges to
+        and from the vertices before them) share the matching of that prefix.
+
+        Inputs: queries - list of query Graphs
+        Outputs: list with one entry per query, in the same order as
+        `queries`. Each entry is the list of vid->vid mappings that search()
+        would return for that query.
+        """
+        results = [ [] for q in queries ]
+
+        # The shared plan is a trie. Each node is a (children, ends) pair,
+        # where `children` maps a step signature to a child node and `ends`
+        # lists the (query index, query vids) of every query whose last
+        # vertex is matched at that node. A step signature is the candidate
+        # key (label, degree, labelled out-edge counts) of the query vertex
+        # plus the (position, edge label) of the earlier query vertices it
+        # has an edge to, and of those with an edge to it.
+        plan = ( dict(), [] )
+
+        # A representative query vertex for each candidate key.
+        wanted = dict()
+
+        for i, q in enumerate(queries):
+            # Query vertices are matched in the same order search() uses.
+            order = list(q.vertices())
+            if len(order) == 0:
+                continue
+            position = { u.id : p for p, u in enumerate(order) }
+
+            node = plan
+            for p, u in enumerate(order):
+                key = ( Graph._labelKey(u.label), q._degree(u), q._edgeLabelCounts(u) )
+                wanted.setdefault(key, u)
+                back = tuple(sorted( ( (position[n.id], q.edgeLabel(u.id, n.id))
+                                       for n in q._edges[u.id] if position[n.id] < p ),
+                                     key=lambda step: step[0] ))
+                fore = tuple( (r, q.edgeLabel(order[r].id, u.id)) for r in range(p)
+                              if q.hasEdge(order[r].id, u.id) )
+                node = node[0].setdefault( (key, back, fore), (dict(), []) )
+            node[1].append( (i, [ u.id for u in order ]) )
+
+        # Find the candidates for every key in one pass over the data graph,
+        # or with one vectorized filter per key if there's a column store.
+        if self._columns is not None:
+            C = { key : [ v for v in self._filterCandidates(u, key[1])
+                          if self._hasEdgeLabels(v, key[2]) ]
+                  for key, u in wanted.items() }
+        else:
+            # The keys by their query label, and the query labels by the
+            # names in them, so each data vertex only tests the keys its own
+            # label can match. Which those are is worked out once per data
+            # label. Keys without a label are tested against every vertex.
+            byLabel = dict()
+            for key in wanted:
+                byLabel.setdefault(key[0], []).append(key)
+            always = byLabel.pop(None, [])
+            byName = dict()
+            for label in byLabel:
+                for name in ( [ label ] if isinstance(label, str) else label ):
+                    byName.setdefault(name, set()).add(label)
+            keysOf = dict()
+
+            C = { key : [] for key in wanted }
+            for v in self.vertices():
+                labelKey = Graph._labelKey(v.label)
+                keys = keysOf.get(labelKey)
+                if keys is None:
+                    keys = keysOf[labelKey] = [ key for label in
+                        Graph._labelMatches(labelKey, byName) for key in byLabel[label] ]
+                degree = self._degree(v)
+                for key in keys:
+                    if degree >= key[1] and self._hasEdgeLabels(v, key[2]):
+                        C[key].append(v)
+                for key in always:
+                    if v.hasLabel(wanted[key].label) and degree >= key[1] and \
+                            self._hasEdgeLabels(v, key[2]):
+                        C[key].append(v)
+
+        self._searchPlan(plan, C, [], set(), results)
+
+        return results
+
+    # =========================================================================
+    def selectVertices(self, label:str or list=None, minDegree:int=0,
+                       minInDegree:int=0, minOutDegree:int=0, number:int=None) -> list:
+        """
+        Returns the vertices that pass every given test, e.g. all vertices
+        with label B and out-degree >= 3:
+
+            g.selectVertices('B', minOutDegree=3)
+
+        Uses the column store if there is one (see enableColumns()).
+
+        Inputs:
+            label - label (or list of labels) the vertex must have, as tested
+                    by Vertex.hasLabel(), or None
+            minDegree, minInDegree, minOutDegree - lower bounds on degrees
+            number - number the vertex must have, or None (with a column
+                     store, only int numbers are indexed)
+        Output: list of Vertex objects
+        """
+        if self._columns is not None:
+            vertices = [ self._vertices[vid] for vid in
+                         self._columns.select(label, minDegree, minInDegree,
+                                              minOutDegree, number) ]
+            if label is not None and not self._columns.exact():
+                vertices = [ v for v in vertices if v.hasLabel(label) ]
+            return vertices
+
+        inDegree = { vid : len(inn) for vid, inn in self._inNeighbors().items() } \
+            if minInDegree > 0 else None
+        return [ v for v in self.vertices()
+                 if (label is None or v.hasLabel(label))
+                 and self._degree(v) >= minDegree
+                 and (inDegree is None or inDegree[v.id] >= minInDegree)
+                 and len(self._edges[v.id]) >= minOutDegree
+                 and (number is None or v.number == number) ]
+
+    # =========================================================================
+    def shortestPath(self, sid:str, eid:str, direction:str='out') -> list:
+        """
+        Returns a path with the fewest edges between two vertices, found by
+        breadth-first search.
+
+        Inputs:
+            sid, eid - ids of the start and end vertices
+            direction - follow edges 'out' of vertices, 'in' to them, or 'both'
+        Output: list of the vertex ids on the path, from sid to eid, or None
+        if eid can't be reached from sid
+        """
+        neighbors = self._neighborIds(direction)
+        self._getExisting(sid)
+        self._getExisting(eid)
+
+        parent = { sid : None }
+        frontier = [ sid ]
+        while len(frontier) > 0 and eid not in parent:
+            nextFrontier = []
+            for x in frontier:
+                for w in neighbors(x):
+                    if w not in parent:
+                        parent[w] = x
+                        nextFrontier.append(w)
+            frontier = nextFrontier
+
+        if eid not in parent:
+            return None
+        path = [ eid ]
+        while parent[path[-1]] is not None:
+            path.append( parent[path[-1]] )
+        path.reverse()
+        return path
+
+    # =========================================================================
+    def stronglyConnectedComponents(self) -> list:
+        """
+        Returns the strongly connected components of this graph, found with
+        an iterative version of Tarjan's algorithm. Vertices are numbered by
+        their position, and the search state is kept in arrays indexed by
+        those numbers.
+
+        Output: list of components, each a list of vertex ids. A component
+        comes after every component reachable from it.
+        """
+        ids = list(self._vertices)
+        position = { vid : i for i, vid in enumerate(ids) }
+        edges = [ self._edges[vid] for vid in ids ]
+        n = len(ids)
+
+        index = array('q', [ -1 ]) * n     # visiting order, -1 if unvisited
+        low = array('q', [ 0 ]) * n        # lowest index reachable
+        onStack = bytearray(n)
+        stack = []
+        components = []
+        counter = 0
+
+        for root in range(n):
+            if index[root] != -1:
+                continue
+            index[root] = low[root] = counter
+            counter += 1
+            stack.append(root)
+            onStack[root] = 1
+
+            # (vertex, index of the next edge to follow) for each vertex on
+            # the current path.
+            work = [ (root, 0) ]
+            while len(work) > 0:
+                v, i = work[-1]
+                if i < len(edges[v]):
+                    work[-1] = (v, i + 1)
+                    w = position[ edges[v][i].id ]
+                    if index[w] == -1:
+                        index[w] = low[w] = counter
+                        counter += 1
+                        stack.append(w)
+                        onStack[w] = 1
+                        work.append( (w, 0) )
+                    elif onStack[w] and index[w] < low[v]:
+                        low[v] = index[w]
+                else:
+                    work.pop()
+                    if len(work) > 0:
+                        u = work[-1][0]
+                        if low[v] < low[u]:
+                            low[u] = low[v]
+                    if low[v] == index[v]:
+                        component = []
+                        while True:
+                            w = stack.pop()
+                            onStack[w] = 0
+                            component.append( ids[w] )
+                            if w == v:
+                                break
+                        components.append(component)
+
+        return components
+
+    # =========================================================================
+    def subgraph(self, vids:list):
+        """
+        Returns a read-only view of the subgraph induced by the given vertex
+        ids: those vertices and every edge between them. Nothing is copied;
+        the view looks through to this graph, and can be used anywhere a Graph
+        is read (search(), edges(), hasEdge(), as a query graph, ...). Ids
+        that aren't in this graph are ignored.
+
+        Inputs: vids - ids of the vertices in the subgraph
+        Output: SubgraphView
+        """
+        from YapyGraph.src.SubgraphView import SubgraphView
+        return SubgraphView(self, vids)
+
+    # =========================================================================
+    def syncLog(self) -> None:
+        """
+        Writes the changes buffered by the write-ahead log to disk now.
+        """
+        if self._log is not None:
+            self._log.sync()
+
+    # =========================================================================
+    @contextlib.contextmanager
+    def transaction(self):
+        """
+        Context manager that makes the changes to the graph inside its block
+        undoable. Every primitive change (adding or removing a vertex or an
+        edge, with the matching degree updates) is recorded in an undo log,
+        so backing out costs as much as the changes themselves rather than a
+        copy of the whole graph. If the block raises an exception, every
+        change is undone and the exception propagates; otherwise the changes
+        are kept. Use savepoint() and rollback() inside the block to back out
+        part or all of the changes explicitly.
+
+            with g.transaction():
+                g.addEdge('v1', 'v2')
+                g.savepoint('s')
+                g.deleteVertex('v3')
+                g.rollback('s')     # v3 is back, v1->v2 is still there
+
+        Undoing keeps the order of every edge list, but a deleted vertex that
+        is brought back goes last in the vertex order, as a newly added one
+        would, so that undoing the deletion costs as little as making it.
+
+        Transactions cannot be nested. With a write-ahead log (see open()),
+        the changes are synced to disk when the block ends, and recovery
+        replays either all of them or none.
+        """
+        if self._undoLog is not None:
+            raise Exception("A transaction is already in progress.")
+
+        self._undoLog = []
+        self._savepoints = {}
+        if self._log is not None:
+            self._log.append(GraphLog.TX_BEGIN)
+        try:
+            yield self
+        except:
+            self.rollback()
+            raise
+        finally:
+            self._undoLog = None
+            self._savepoints = {}
+            if self._log is not None:
+                self._log.append(GraphLog.TX_END)
+
     # =========================================================================
     def vertices(self) -> list:
         """
         Returns a list of Vertex objects in this graph.
         """
         return self._vertices.values()
-    
+
+    # =========================================================================
+    def weaklyConnectedComponents(self) -> list:
+        """
+        Returns the weakly connected components of this graph (those of the
+        graph with edge directions ignored), in the order of their first
+        vertices. Also rebuilds the component index used by search(), if an
+        edge removal had dropped it.
+
+        Output: list of components, each a list of vertex ids
+        """
+        neighbors = self._neighborIds('both')
+        ids = list(self._vertices)
+        position = { vid : i for i, vid in enumerate(ids) }
+        visited = bytearray(len(ids))
+
+        components = []
+        for root in range(len(ids)):
+            if visited[root]:
+                continue
+            visited[root] = 1
+            component = [ ids[root] ]
+            frontier = [ ids[root] ]
+            while len(frontier) > 0:
+                nextFrontier = []
+                for x in frontier:
+                    for w in neighbors(x):
+                        i = position[w]
+                        if not visited[i]:
+                            visited[i] = 1
+                            component.append(w)
+                            nextFrontier.append(w)
+                frontier = nextFrontier
+            components.append(component)
+
+        parent = dict()
+        sizes = dict()
+        for component in components:
+            sizes[component[0]] = len(component)
+            for w in component:
+                parent[w] = component[0]
+        self._componentParent = parent
+        self._componentSize = sizes
+        return components
+
+    # =========================================================================
+    def wlHash(self, iterations:int=3) -> str:
+        """
+        Returns the Weisfeiler-Lehman hash of this graph, built from the
+        vertex labels and the directed, labelled edges. Isomorphic graphs always have
+        the same hash, so different hashes prove two graphs are not
+        isomorphic; equal hashes make it likely (but not certain) that they
+        are. More iterations tell more graphs apart. See canonicalForm() for
+        an exact test.
+
+        Inputs: iterations - number of refinement rounds
+        Output: hash as a hex string
+        """
+        colors = self._wlColors(iterations, True)
+        return Graph._digest(','.join(sorted(colors.values())))
+
+    # =========================================================================
+    def _canonicalOrder(self) -> list:
+        """
+        Returns the vertex ids of this graph in canonical order. See
+        canonicalForm().
+        """
+        out, inn = self._labelledNeighbors()
+
+        keys = { vid : ( Graph._labelSignature(self._vertices[vid].label),
+                         len(out[vid]), len(inn[vid]) ) for vid in out }
+        colors = Graph._refine(Graph._recolor(keys), out, inn)
+
+        state = { 'best' : None, 'first' : None, 'automorphisms' : [], 'jump' : None }
+        Graph._individualize(colors, out, inn, [], state)
+        return state['best'][1] if state['best'] is not None else []
+
+    # =========================================================================
+    def _cacheKey(self) -> tuple:
+        """
+        Returns a hashable key describing this graph as a query: the id,
+        label and degree of every vertex, and the edges out of every vertex
+        with their labels, all in order. Two query graphs with the same key
+        give the same search results.
+        """
+        return ( tuple( (v.id, Graph._labelKey(v.label), self._degree(v))
+                        for v in self.vertices() ),
+                 tuple( (vid, tuple( (w.id, self.edgeLabel(vid, w.id)) for w in endVertices ))
+                        for vid, endVertices in self._edges.items() ) )
+
+    # =========================================================================
+    def _checkpointRecords(self):
+        """
+        Generates the write-ahead log records that build this graph: every
+        vertex, then every edge, then the order of the in-edges of each
+        vertex whose in-edges aren't in the order the edges were added in.
+        """
+        for v in self._vertices.values():
+            yield GraphLog.INSERT_VERTEX, (v.id, v.label, v.number)
+
+        added = { vid : [] for vid in self._vertices }
+        for vid, endVertices in self._edges.items():
+            for w in endVertices:
+                yield GraphLog.LINK_EDGE, (vid, w.id, None, self.edgeLabel(vid, w.id))
+                added[w.id].append(vid)
+
+        for vid, startVIDs in self._inEdges.items():
+            if list(startVIDs) != added[vid]:
+                yield GraphLog.IN_ORDER, (vid, list(startVIDs))
+
+    # =========================================================================
+    def _componentRoot(self, vid:str) -> str:
+        """
+        Returns the id of the root of the component of vertex vid in the
+        component union-find, halving the path to it on the way.
+        """
+        parent = self._componentParent
+        while parent[vid] != vid:
+            parent[vid] = parent[parent[vid]]
+            vid = parent[vid]
+        return vid
+
+    # =========================================================================
+    def _degree(self, v:Vertex) -> int:
+        """
+        Returns the degree of Vertex v in this graph.
+        """
+        return v.degree
+
     # =========================================================================
-    def _filterCandidates(self, u:Vertex) -> list:
+    def _edgeLabelCounts(self, u:Vertex) -> tuple:
+        """
+        Returns the number of out-edges of vertex u with each edge label, as
+        a tuple of (label, count) pairs. Unlabelled edges aren't counted.
+        """
+        counts = dict()
+        for w in self._edges[u.id]:
+            label = self.edgeLabel(u.id, w.id)
+            if label is not None:
+                counts[label] = counts.get(label, 0) + 1
+        return tuple(sorted( counts.items(), key=lambda item: repr(item[0]) ))
+
+    # =========================================================================
+    def _edgeTargets(self, vid:str, label) -> set:
+        """
+        Returns the ids of the ends of the out-edges of vertex vid with the
+        given label, from the edge label index. Callers must not change the
+        set.
+        """
+        return self._outEdgeIndex.get( (vid, label), Graph._NO_TARGETS )
+
+    # =========================================================================
+    @staticmethod
+    def _digest(s:str) -> str:
+        """
+        Returns a short hash of string s that is the same in every run (unlike
+        hash()).
+        """
+        return hashlib.blake2b(s.encode('utf-8'), digest_size=8).hexdigest()
+
+    # =========================================================================
+    def _filterCandidates(self, u:Vertex, degree:int=None) -> list:
         """
         Returns a list of data (g) vertices that have the same label as query
         vertex u and whose degree is >= u's degree.
         This method should be called on the data graph.
 
-        Input: Query vertex u.
+        Input: Query vertex u, and its degree in the query graph (defaults to
+        u.degree).
         Output: List of vertices v from self (g).
         """
-        return [ v for v in self.vertices() if v.hasLabel(u.label) and v.degree >= u.degree ]
+        if degree is None:
+            degree = u.degree
+        if self._columns is not None:
+            return self.selectVertices(u.label, degree)
+        return [ v for v in self.vertices() if v.hasLabel(u.label) and v.degree >= degree ]
         
     # =========================================================================
     def _findCandidates(self, q) -> dict:
@@ -302,7 +1335,13 @@ class Graph(object):
 
             # 3: C(u) := FilterCandidates (q, g, u, . . .);
             #    [[ ∀v ∈ C(u)((v ∈ V(g)) ∧ (L(u) ⊆ L(v))) ]]
-            c_u = self._filterCandidates(u)
+            c_u = self._filterCandidates(u, q._degree(u))
+
+            # Data vertices need at least as many out-edges with each label
+            # as u has.
+            counts = q._edgeLabelCounts(u)
+            if len(counts) > 0:
+                c_u = [ v for v in c_u if self._hasEdgeLabels(v, counts) ]
 
             # 4: if C(u) = ∅ then
             if len(c_u) == 0:
@@ -332,6 +1371,213 @@ class Graph(object):
         
         return [n for n in q._edges[u.id] if q._isMatched(n, M)]
 
+    # =========================================================================
+    def _getExisting(self, vid:str) -> Vertex:
+        """
+        Returns the vertex with the given id, raising an exception if there
+        isn't one.
+        """
+        if vid not in self._vertices:
+            raise Exception("Vertex %s does not exist." % vid)
+        return self._vertices[vid]
+
+    # =========================================================================
+    def _hasEdgeLabels(self, v:Vertex, counts:tuple) -> bool:
+        """
+        Returns True if vertex v has at least `count` out-edges with each
+        label in `counts`, a tuple of (label, count) pairs (see
+        _edgeLabelCounts()).
+        """
+        for label, count in counts:
+            if len(self._edgeTargets(v.id, label)) < count:
+                return False
+        return True
+
+    # =========================================================================
+    def _hasLabelledEdge(self, startVID:str, endVID:str, label) -> bool:
+        """
+        Returns True if there is an edge from startVID to endVID that
+        matches a query edge with the given label: any edge if label is
+        None, or else an edge with that label, looked up in the edge label
+        index.
+        """
+        if label is None:
+            return self.hasEdge(startVID, endVID)
+        return endVID in self._edgeTargets(startVID, label)
+
+    # =========================================================================
+    @staticmethod
+    def _individualize(colors:dict, out:dict, inn:dict, path:list, state:dict) -> None:
+        """
+        Searches the individualization tree below the equitable colouring
+        `colors` for the canonical order (see canonicalForm()), updating
+        state['best'] whenever a leaf gives a smaller certificate.
+
+        Two leaves with the same certificate give an automorphism, mapping
+        the vertex at each position of one leaf's order to the vertex at the
+        same position of the other's. As in nauty, the automorphisms found
+        so far prune the tree: of the vertices of a cell that are in the same
+        orbit of the automorphisms fixing the vertices individualized above,
+        only one is tried, since the others lead to the same certificates.
+        And a leaf with the same certificate as the first leaf shows that
+        the branch it is in repeats the first leaf's branch, so the search
+        goes back to where the two branches split.
+
+        Inputs:
+            colors - vid->colour, refined
+            out, inn - vid->[(vid, edge label)] out- and in-neighbours, see
+                       _labelledNeighbors()
+            path - the vertices individualized above, in order
+            state - the search so far: 'best' and 'first' are the
+                    (certificate, order, path) of the best and first leaves,
+                    'automorphisms' the vid->vid mappings found (moved
+                    vertices only), and 'jump' the depth to go back to, or
+                    None
+        """
+        cells = dict()
+        for vid, color in colors.items():
+            cells.setdefault(color, []).append(vid)
+
+        target = None
+        for color in sorted(cells):
+            if len(cells[color]) > 1:
+                target = cells[color]
+                break
+
+        if target is None:
+            # Every vertex has its own colour, which gives an order.
+            order = sorted(colors, key=colors.get)
+            certificate = tuple(sorted( (colors[vid], colors[w], label)
+                                        for vid in order for w, label in out[vid] ))
+            leaf = ( certificate, order, list(path) )
+            first = state['first']
+            if first is None:
+                state['first'] = leaf
+            else:
+                for other in ( first, state['best'] ):
+                    if certificate == other[0]:
+                        gamma = { v : w for v, w in zip(other[1], order) if v != w }
+                        state['automorphisms'].append(gamma)
+
+                        # Where the branches split, gamma maps the first
+                        # leaf's branch onto this one if it fixes the
+                        # vertices above.
+                        if other is first:
+                            depth = 0
+                            while path[depth] == first[2][depth]:
+                                depth += 1
+                            if gamma.get(first[2][depth]) == path[depth] and \
+                                    not any( p in gamma for p in path[:depth] ):
+                                state['jump'] = depth
+                        break
+            if state['best'] is None or certificate < state['best'][0]:
+                state['best'] = leaf
+            return
+
+        # Orbits of the automorphisms fixing the path, as a union-find over
+        # the vertices they move.
+        parent = dict()
+        def root(vid):
+            while parent.get(vid, vid) != vid:
+                vid = parent[vid]
+            return vid
+        seen = 0
+
+        tried = []
+        for vid in target:
+            automorphisms = state['automorphisms']
+            for gamma in automorphisms[seen:]:
+                if not any( p in gamma for p in path ):
+                    for v, w in gamma.items():
+                        v, w = root(v), root(w)
+                        if v != w:
+                            parent[v] = w
+            seen = len(automorphisms)
+
+            # Swapping twins is an automorphism too, found without going
+            # down to the leaves.
+            if any( root(vid) == root(t) or Graph._twins(vid, t, out, inn) for t in tried ):
+                continue
+            tried.append(vid)
+
+            keys = { w : ( colors[w], 0 if w == vid else 1 ) for w in colors }
+            path.append(vid)
+            Graph._individualize(Graph._refine(Graph._recolor(keys), out, inn),
+                                 out, inn, path, state)
+            path.pop()
+
+            if state['jump'] is not None:
+                if state['jump'] < len(path):
+                    return
+                state['jump'] = None
+
+    # =========================================================================
+    def _inNeighbors(self) -> dict:
+        """
+        Returns a dictionary mapping each vertex id to the list of ids of the
+        vertices with an edge to it. It is the graph's own in-edge storage,
+        so callers must not change it.
+        """
+        return self._inEdges
+
+    # =========================================================================
+    def _insertVertex(self, v:Vertex) -> None:
+        """
+        Primitive that adds Vertex v, with no edges, to the graph. The vertex
+        always goes last in the vertex order, also when it is put back by a
+        rollback: restoring its old position would mean rebuilding the
+        vertex and edge dictionaries.
+
+        Inputs: v - Vertex to add
+        """
+        self._vertices[v.id] = v
+        self._edges[v.id] = []      # no edges yet
+        self._inEdges[v.id] = []
+        if self._ownedVertices is not None:
+            self._ownedVertices.add(v.id)
+            self._ownedEdges.add(v.id)
+            self._ownedInEdges.add(v.id)
+        if self._componentParent is not None:
+            self._componentParent[v.id] = v.id
+            self._componentSize[v.id] = 1
+        if self._columns is not None:
+            self._columns.add(v)
+        if self._log is not None:
+            self._log.append(GraphLog.INSERT_VERTEX, v.id, v.label, v.number)
+        self._touch(v)
+        self._logUndo(self._removeVertex, v.id)
+
+    # =========================================================================
+    def _isFresh(self, version:int, labels:set) -> bool:
+        """
+        Returns True if search results computed at the given version, for a
+        query with the given labels, are still correct: no vertex that one of
+        the labels could match has changed since. Only the labels changed
+        since are looked at, latest first.
+        """
+        if version == self._version:
+            return True
+        if version > self._version:
+            return False    # computed on a later version of a shared cache
+        if version < self._labelVersionsFloor:
+            return False    # the changes since then aren't all known
+
+        # The names a query vertex can match by, as in Vertex.hasLabel().
+        names = set()
+        for label in labels:
+            if isinstance(label, str):
+                names.add(label)
+            elif label is not None:
+                names.update(label)
+
+        for key, changed in reversed(self._labelVersions.items()):
+            if changed <= version:
+                break
+            if key is not None and any( name in key for name in names ):
+                return False
+
+        return True
+
     # =========================================================================
     def _isJoinable(self, u:Vertex, v:Vertex, q, M:dict) -> bool:	
         """
@@ -340,7 +1586,9 @@ class Graph(object):
         
         Iterates through all matched neighbors, n, of u. If n is matched to data
         vertex m, then we check to see if there is an edge from v to m in the data
-        graph.
+        graph. Likewise, for every matched query vertex n with an edge to u,
+        there must be an edge from n's match to v. If the query edge has a
+        label, the data edge must have the same label.
 
         8: [[ ∀(u', v' ∈ M((u, u') ∈ E(q) =⇒ (v, v') ∈ E(g) ∧ L(u, u') = L(v, v)) ]]
 
@@ -359,8 +1607,14 @@ class Graph(object):
             m = self._vertices[M[n.id]]
 
             # We know there's an edge from u to n, so make sure there's
-            # an edge from v to m.
-            if not self.hasEdge(v.id, m.id):
+            # an edge from v to m (with the same label, if it has one).
+            if not self._hasLabelledEdge(v.id, m.id, q.edgeLabel(u.id, n.id)):
+                return False
+
+        # Edges running the other way, from matched query vertices to u.
+        for nid, mid in M.items():
+            if q.hasEdge(nid, u.id) and \
+                    not self._hasLabelledEdge(mid, v.id, q.edgeLabel(nid, u.id)):
                 return False
 
         return True
@@ -373,6 +1627,187 @@ class Graph(object):
         """
         return u.id in M.keys() or u.id in M.values()
 
+    # =========================================================================
+    def _joinComponents(self, uid:str, vid:str) -> None:
+        """
+        Merges the components of two vertices joined by a new edge in the
+        component union-find (union by size).
+        """
+        if self._componentParent is None:
+            return
+        u = self._componentRoot(uid)
+        v = self._componentRoot(vid)
+        if u != v:
+            sizes = self._componentSize
+            if sizes[u] < sizes[v]:
+                u, v = v, u
+            self._componentParent[v] = u
+            sizes[u] += sizes.pop(v)
+
+    # =========================================================================
+    def _labelledNeighbors(self) -> tuple:
+        """
+        Returns (out, inn) dictionaries mapping each vertex id to a list of
+        (neighbour id, edge label) pairs for its out- and in-edges, used by
+        canonicalForm(). Edge labels are given as their repr() strings, so
+        they sort.
+        """
+        out = { vid : [ ( w.id, repr(self.edgeLabel(vid, w.id)) ) for w in self._edges[vid] ]
+                for vid in self._vertices }
+        inn = { vid : [] for vid in self._vertices }
+        for vid, neighbors in out.items():
+            for w, label in neighbors:
+                inn[w].append( (vid, label) )
+        return out, inn
+
+    # =========================================================================
+    @staticmethod
+    def _labelKey(label:str or list):
+        """
+        Returns a hashable version of a vertex label: strings and None are
+        returned as-is, and lists of labels are returned as tuples.
+        """
+        if label is None or isinstance(label, str):
+            return label
+        return tuple(label)
+
+    # =========================================================================
+    @staticmethod
+    def _labelMatches(label:str or tuple, byName:dict) -> list:
+        """
+        Returns the query labels that a vertex with the given label matches,
+        as Vertex.hasLabel() tests them: a query label matches if one of its
+        names is one of the vertex's labels, or, for a vertex with a single
+        string label, is in that string.
+
+        Inputs:
+            label - vertex label, as given by _labelKey()
+            byName - name -> set of query labels with that name in them
+        Output: list of query labels, each once
+        """
+        if label is None:
+            return []
+        if isinstance(label, str):
+            names = [ name for name in byName if name in label ]
+        else:
+            names = [ name for name in label if name in byName ]
+        labels = set()
+        for name in names:
+            labels.update(byName[name])
+        return list(labels)
+
+    # =========================================================================
+    @staticmethod
+    def _labelSignature(label:str or list) -> tuple:
+        """
+        Returns a vertex label as a sorted tuple of label strings, so that a
+        list of labels compares as a set.
+        """
+        if label is None:
+            return ()
+        if isinstance(label, str):
+            return ( label, )
+        return tuple(sorted( str(l) for l in label ))
+
+    # =========================================================================
+    def _linkEdge(self, u:Vertex, v:Vertex, position:int=None, label=None,
+                  inPosition:int=None) -> None:
+        """
+        Primitive that adds the edge u->v, with an optional label, and updates
+        the vertex degrees, the in-edges, the edge label index and the
+        components. The caller makes sure the edge doesn't already exist. If
+        `position` and `inPosition` are given, v is put at that position in
+        u's edge list and u at that position in v's in-edges (used when
+        undoing a deletion); otherwise they go last.
+
+        Inputs:
+            u, v - start and end Vertex of the edge
+            position - index of v in u's edge list, or None
+            label - edge label, or None
+            inPosition - index of u in v's in-edges, or None
+        """
+        if self._ownedVertices is not None:
+            u = self._writableVertex(u.id)
+            v = self._writableVertex(v.id)
+        if position is None:
+            self._writableEdges(u.id).append(v)
+        else:
+            self._writableEdges(u.id).insert(position, v)
+        if inPosition is None:
+            self._writableInEdges(v.id).append(u.id)
+        else:
+            self._writableInEdges(v.id).insert(inPosition, u.id)
+        self._joinComponents(u.id, v.id)
+        if label is not None:
+            self._edgeLabels[(u.id, v.id)] = label
+            self._writableTargets( (u.id, label) ).add(v.id)
+        u.degree += 1
+        v.degree += 1
+        if self._columns is not None:
+            self._columns.link(u.id, v.id)
+        if self._log is not None:
+            self._log.append(GraphLog.LINK_EDGE, u.id, v.id, position, label, inPosition)
+        self._touch(u, v)
+        self._logUndo(self._unlinkEdge, u, v)
+
+    # =========================================================================
+    def _logUndo(self, method, *args) -> None:
+        """
+        Records, in the undo log of the current transaction, the primitive
+        call that reverses a change. Does nothing outside a transaction.
+        """
+        if self._undoLog is not None:
+            self._undoLog.append( (method, args) )
+
+    # =========================================================================
+    def _materialize(self) -> tuple:
+        """
+        Returns a private copy of this graph's storage, as a (vertices, edges)
+        pair built like _vertices and _edges but with new Vertex objects.
+        """
+        vertices = { vid : copy.copy(v) for vid, v in self._vertices.items() }
+        edges = { vid : [ vertices[e.id] for e in endVertices ]
+                  for vid, endVertices in self._edges.items() }
+        return vertices, edges
+
+    # =========================================================================
+    @staticmethod
+    def _measureVertex() -> int:
+        """
+        Returns the bytes taken by a Vertex object with its attribute storage
+        and empty candidates list. sys.getsizeof() can't see the attribute
+        storage (and reading __dict__ to measure it would make it bigger), so
+        the allocations of a batch of new vertices are traced instead.
+        """
+        if Graph._vertexBytes is None:
+            tracing = tracemalloc.is_tracing()
+            if not tracing:
+                tracemalloc.start()
+            before = tracemalloc.get_traced_memory()[0]
+            probes = [ Vertex(None) for i in range(256) ]
+            after = tracemalloc.get_traced_memory()[0]
+            if not tracing:
+                tracemalloc.stop()
+            Graph._vertexBytes = (after - before - sys.getsizeof(probes)) // len(probes)
+        return Graph._vertexBytes
+
+    # =========================================================================
+    def _neighborIds(self, direction:str):
+        """
+        Returns a function giving the ids of the neighbours of a vertex id:
+        the ends of its out-edges ('out'), the starts of its in-edges ('in'),
+        or both ('both').
+        """
+        edges = self._edges
+        if direction == 'out':
+            return lambda vid: ( w.id for w in edges[vid] )
+        if direction == 'in':
+            return self._inNeighbors().__getitem__
+        if direction == 'both':
+            inn = self._inNeighbors()
+            return lambda vid: itertools.chain( ( w.id for w in edges[vid] ), inn[vid] )
+        raise Exception("Unknown direction %s." % direction)
+
     # =========================================================================
     def _nextQueryVertex(self, q, M:dict) -> Vertex:
         """
@@ -389,6 +1824,408 @@ class Graph(object):
             
         return None
 
+    # =========================================================================
+    def _numEdges(self) -> int:
+        """
+        Returns the number of edges in this graph.
+        """
+        return sum( len(endVertices) for endVertices in self._edges.values() )
+
+    # =========================================================================
+    def _prepareWrite(self) -> None:
+        """
+        Called before this graph is changed. While the storage is shared with
+        copies (see copy()), each storage dictionary is changed through an
+        Overlay of its own, which holds only what this graph has changed,
+        and the primitives copy each vertex or list before changing it (see
+        _writableVertex()). An Overlay whose changes have grown past about
+        the square root of its size is flattened into a new dictionary, so
+        that the next copy() and change don't have to copy many changes. Once
+        the copies are gone, the changes are applied to the dictionaries
+        underneath and everything belongs to this graph again.
+        """
+        if self._ownedVertices is None:
+            return      # nothing is shared
+
+        sharers = [ ref for ref in self._sharers if ref() is not None ]
+        self._sharers[:] = sharers
+        if len(sharers) == 1:
+            self._setStorage( storage.absorb() if isinstance(storage, Overlay) else storage
+                              for storage in self._storage() )
+            self._sharedStorage = False
+            self._ownedVertices = self._ownedEdges = None
+            self._ownedInEdges = self._ownedTargets = None
+        elif self._sharedStorage:
+            self._setStorage( Overlay.over(storage) for storage in self._storage() )
+            self._sharedStorage = False
+        else:
+            self._setStorage( Overlay.settle(storage) for storage in self._storage() )
+
+    # =========================================================================
+    def _pruneByComponent(self, q, C:dict) -> dict:
+        """
+        Drops the candidates that lie in weakly connected components of self
+        with fewer vertices than q, if q is connected: every instance of a
+        connected query lies within one component. Returns the pruned
+        candidates, or an empty dictionary if a query vertex has none left.
+
+        The component sizes come from the union-find kept up to date by the
+        primitives, so this never walks the data graph. Nothing is pruned if
+        the union-find has been dropped by an edge removal (until
+        weaklyConnectedComponents() rebuilds it), or if self is a single
+        component.
+
+        Inputs:
+            q - query Graph
+            C - candidate data vertices for each query vertex
+        """
+        n = q.numVertices()
+        if self._componentParent is None or len(self._componentSize) < 2 or \
+                len(C) != n or n < 2 or len(q.weaklyConnectedComponents()) != 1:
+            return C
+
+        sizes = self._componentSize
+        root = self._componentRoot
+        pruned = dict()
+        for uid, candidates in C.items():
+            pruned[uid] = [ v for v in candidates if sizes[root(v.id)] >= n ]
+            if len(pruned[uid]) == 0:
+                return dict()
+        return pruned
+
+    # =========================================================================
+    @staticmethod
+    def _recolor(keys:dict) -> dict:
+        """
+        Turns a vid->key dictionary into a vid->colour dictionary, where the
+        colours are 0, 1, 2, ... in the sorted order of the distinct keys.
+        """
+        index = { key : i for i, key in enumerate(sorted(set(keys.values()))) }
+        return { vid : index[key] for vid, key in keys.items() }
+
+    # =========================================================================
+    @staticmethod
+    def _refine(colors:dict, out:dict, inn:dict) -> dict:
+        """
+        Refines a colouring until it is equitable: vertices of the same colour
+        have the same number of in- and out-neighbours of each colour, along
+        edges with each label.
+
+        Inputs:
+            colors - vid->colour
+            out, inn - vid->[(vid, edge label)] out- and in-neighbours
+        Output: refined vid->colour
+        """
+        count = len(set(colors.values()))
+        while True:
+            keys = { vid : ( color,
+                             tuple(sorted( (colors[w], label) for w, label in out[vid] )),
+                             tuple(sorted( (colors[w], label) for w, label in inn[vid] )) )
+                     for vid, color in colors.items() }
+            colors = Graph._recolor(keys)
+            newCount = len(set(colors.values()))
+            if newCount == count:
+                return colors
+            count = newCount
+
+    # =========================================================================
+    def _removeVertex(self, vid:str) -> Vertex:
+        """
+        Primitive that removes the vertex with the given vid from the graph.
+        The caller must already have removed every edge to and from it.
+
+        Inputs: vid - vertex ID to remove
+        Outputs: the removed Vertex
+        """
+        self._edges.pop(vid)
+        self._inEdges.pop(vid)
+        v = self._vertices.pop(vid)
+        if self._ownedVertices is not None and vid not in self._ownedVertices:
+            v = copy.copy(v)    # so undoing doesn't bring back a shared Vertex
+        if self._componentParent is not None:
+            # With no edges left, the vertex is a component of its own.
+            del self._componentParent[vid]
+            del self._componentSize[vid]
+        if self._columns is not None:
+            self._columns.remove(vid)
+        if self._log is not None:
+            self._log.append(GraphLog.REMOVE_VERTEX, vid)
+        self._touch(v)
+        self._logUndo(self._insertVertex, v)
+        return v
+
+    # =========================================================================
+    def _replay(self, changes) -> None:
+        """
+        Applies write-ahead log records to this (new) graph. The dictionaries
+        are changed directly, without the checks, version bumps and undo
+        logging of the primitives.
+
+        Inputs: changes - iterable of (op, args) pairs
+        """
+        vertices = self._vertices
+        edges = self._edges
+        inEdges = self._inEdges
+        count = 0
+        for op, args in changes:
+            count += 1
+            if op == GraphLog.LINK_EDGE:
+                u = vertices[args[0]]
+                v = vertices[args[1]]
+                if args[2] is None:
+                    edges[u.id].append(v)
+                else:
+                    edges[u.id].insert(args[2], v)
+                if len(args) < 5 or args[4] is None:
+                    inEdges[v.id].append(u.id)
+                else:
+                    inEdges[v.id].insert(args[4], u.id)
+                self._joinComponents(u.id, v.id)
+                label = args[3] if len(args) > 3 else None
+                if label is not None:
+                    self._edgeLabels[(u.id, v.id)] = label
+                    self._outEdgeIndex.setdefault( (u.id, label), set() ).add(v.id)
+                u.degree += 1
+                v.degree += 1
+            elif op == GraphLog.INSERT_VERTEX:
+                vid, label, number = args
+                vertices[vid] = Vertex(vid, label, number)
+                edges[vid] = []
+                inEdges[vid] = []
+                if self._componentParent is not None:
+                    self._componentParent[vid] = vid
+                    self._componentSize[vid] = 1
+            elif op == GraphLog.UNLINK_EDGE:
+                u = vertices[args[0]]
+                v = vertices[args[1]]
+                edges[u.id].remove(v)
+                inEdges[v.id].remove(u.id)
+                if v not in edges[u.id] and u not in edges[v.id]:
+                    self._componentParent = self._componentSize = None
+                label = self._edgeLabels.pop( (u.id, v.id), None )
+                if label is not None:
+                    self._outEdgeIndex[(u.id, label)].discard(v.id)
+                u.degree -= 1
+                v.degree -= 1
+            elif op == GraphLog.IN_ORDER:
+                inEdges[args[0]] = list(args[1])
+            elif op == GraphLog.REMOVE_VERTEX:
+                del edges[args[0]]
+                del inEdges[args[0]]
+                del vertices[args[0]]
+                if self._componentParent is not None:
+                    del self._componentParent[args[0]]
+                    del self._componentSize[args[0]]
+        self._version += count
+
+    #--------------------------------------------------------------------------
+    def _sampleNeighbors(self, mid:str, outward:bool, label, candidates:set) -> list:
+        """
+        Returns the ids of the data vertices in `candidates` with an edge
+        from mid (if outward) or to mid (if not), with the given label if
+        it isn't None.
+
+        Inputs:
+            mid - id of the data vertex matched to the anchor
+            outward - True to follow the out-edges of mid, False its in-edges
+            label - the query edge label, or None
+            candidates - ids of the candidates for the query vertex
+        Output: list of data vids
+        """
+        if outward:
+            ends = [ w.id for w in self._edges[mid] if w.id in candidates ]
+            if label is not None:
+                targets = self._edgeTargets(mid, label)
+                ends = [ wid for wid in ends if wid in targets ]
+        else:
+            ends = [ wid for wid in self._inNeighbors()[mid] if wid in candidates ]
+            if label is not None:
+                ends = [ wid for wid in ends if self._hasLabelledEdge(wid, mid, label) ]
+        return ends
+
+    #--------------------------------------------------------------------------
+    def _samplePlan(self, q, C:dict) -> list:
+        """
+        Works out, for each level of the random walks made by _sampleWalk(),
+        where the joinable candidates can be looked for.
+
+        The query vertices are matched in the order _nextQueryVertex() gives
+        them. At each level, every query neighbour matched at an earlier
+        level is an anchor: the joinable candidates are all data neighbours
+        of its match.
+
+        Inputs:
+            q - query Graph
+            C - candidate data vertices for each query vertex
+        Output: list of (query vertex, candidate ids, anchors) tuples, one
+        per level, where anchors is a list of (anchor id, outward, edge
+        label) tuples; outward is True if the candidates are at the end of
+        an out-edge of the anchor's match.
+        """
+        plan = []
+        matched = []
+        for u in q.vertices():
+            anchors = []
+            for n in matched:
+                # An edge u->n needs an edge into n's match, and n->u an edge
+                # out of it.
+                if q.hasEdge(u.id, n.id):
+                    anchors.append( (n.id, False, q.edgeLabel(u.id, n.id)) )
+                if q.hasEdge(n.id, u.id):
+                    anchors.append( (n.id, True, q.edgeLabel(n.id, u.id)) )
+            plan.append( (u, set( v.id for v in C[u.id] ), anchors) )
+            matched.append(u)
+
+        return plan
+
+    #--------------------------------------------------------------------------
+    def _sampleSearch(self, q, M:dict, C:dict, rng:random.Random) -> dict:
+        """
+        Same as _subgraphSearch(), but visits candidates in random order and
+        stops at the first instance found.
+
+        Inputs:
+            q - query Graph
+            M - dictionary of vertex mappings
+            C - candidate data vertices for each query vertex
+            rng - random number generator
+        Output: a vid->vid mapping, or None if M cannot be completed.
+        """
+        if len(M) == q.numVertices():
+            return dict(M)
+
+        u = self._nextQueryVertex(q, M)
+        candidates = [ c for c in C[u.id] if not self._isMatched(c, M) ]
+        rng.shuffle(candidates)
+        for v in candidates:
+            if self._isJoinable(u, v, q, M):
+                M[u.id] = v.id
+                found = self._sampleSearch(q, M, C, rng)
+                M.pop(u.id)
+                if found is not None:
+                    return found
+
+        return None
+
+    #--------------------------------------------------------------------------
+    def _sampleWalk(self, q, C:dict, plan:list, rng:random.Random) -> tuple:
+        """
+        Makes one random walk down the search tree, as described in
+        sampleMatch().
+
+        Inputs:
+            q - query Graph
+            C - candidate data vertices for each query vertex
+            plan - the levels worked out by _samplePlan()
+            rng - random number generator
+        Output: (vid->vid mapping, weight), or (None, 0) if the walk came to
+        a dead end.
+        """
+        M = dict()
+        weight = 1
+        for u, candidates, anchors in plan:
+            if len(anchors) == 0:
+                # u has no matched neighbours, so every candidate not
+                # matched yet is joinable.
+                matched = set( vid for vid in itertools.chain(M, M.values())
+                               if vid in candidates )
+                if len(matched) == len(candidates):
+                    return None, 0
+                weight *= len(candidates) - len(matched)
+                v = rng.choice(C[u.id])
+                while v.id in matched:
+                    v = rng.choice(C[u.id])
+                M[u.id] = v.id
+                continue
+
+            # The anchors hold every edge between u and the matched query
+            # vertices, so the joinable candidates are the unmatched ones
+            # that are neighbours of every anchor's match (the same test as
+            # _isJoinable()).
+            ends = sorted( ( self._sampleNeighbors(M[n], outward, label, candidates)
+                             for n, outward, label in anchors ), key=len )
+            others = [ set(wids) for wids in ends[1:] ]
+            values = set(M.values())
+            joinable = [ wid for wid in ends[0] if wid not in M and wid not in values
+                         and all( wid in wids for wids in others ) ]
+            if len(joinable) == 0:
+                return None, 0
+            weight *= len(joinable)
+            M[u.id] = rng.choice(joinable)
+
+        return M, weight
+
+    #--------------------------------------------------------------------------
+    def _searchPlan(self, node:tuple, C:dict, matched:list, used:set, results:list):
+        """
+        Extends the partial match `matched` through every step below `node` in
+        the shared plan built by searchMany(). Whenever a step completes a
+        query, the match is added to that query's results.
+
+        Inputs:
+            node - (children, ends) plan node
+            C - candidate data vertices for each candidate key
+            matched - data vids matched so far, by query vertex position
+            used - the data vids in `matched`
+            results - solution lists, one per query
+        """
+        for (key, back, fore), child in node[0].items():
+            for v in C[key]:
+                if v.id in used:
+                    continue
+
+                # Same test as _isJoinable(): the data vertex needs an edge to
+                # the data vertex matched at every position the query vertex
+                # has an edge to, and from those with an edge to it, with the
+                # same labels.
+                if not all( self._hasLabelledEdge(v.id, matched[p], label)
+                            for p, label in back ) or \
+                        not all( self._hasLabelledEdge(matched[p], v.id, label)
+                                 for p, label in fore ):
+                    continue
+
+                matched.append(v.id)
+                used.add(v.id)
+
+                for i, qvids in child[1]:
+                    results[i].append( dict(zip(qvids, matched)) )
+                self._searchPlan(child, C, matched, used, results)
+
+                used.remove(v.id)
+                matched.pop()
+
+    # =========================================================================
+    def _setStorage(self, storage) -> None:
+        """
+        Sets the storage dictionaries from an iterable in the order
+        _storage() returns them.
+        """
+        self._vertices, self._edges, self._inEdges, self._edgeLabels, \
+            self._outEdgeIndex = storage
+
+    # =========================================================================
+    def _storage(self) -> tuple:
+        """
+        Returns the dictionaries holding the vertices and edges, which copies
+        share (see copy()): (_vertices, _edges, _inEdges, _edgeLabels,
+        _outEdgeIndex).
+        """
+        return ( self._vertices, self._edges, self._inEdges, self._edgeLabels,
+                 self._outEdgeIndex )
+
+    # =========================================================================
+    def _structureHash(self) -> str:
+        """
+        Returns the Weisfeiler-Lehman hash of this graph with the labels left
+        out, remembering it until the graph changes.
+        """
+        if self._structureHashCache is None or \
+                self._structureHashCache[0] != self._version:
+            colors = self._wlColors(3, False)
+            self._structureHashCache = ( self._version,
+                                         Graph._digest(','.join(sorted(colors.values()))) )
+        return self._structureHashCache[1]
+
     #--------------------------------------------------------------------------
     def _subgraphSearch(self, q, M: dict, C: list, solutions:list):
         """
@@ -429,3 +2266,157 @@ class Graph(object):
                     # 11: RestoreState (M, u, v, . . .);
                     # [[ (u, v) ∈/ M ]]
                     M.pop(u.id)
+
+    # =========================================================================
+    def _touch(self, *vertices) -> None:
+        """
+        Records a change to the graph that involves the given vertices: bumps
+        the version, and marks their labels as changed at the new version.
+        """
+        self._version += 1
+        versions = self._labelVersions
+        for v in vertices:
+            key = Graph._labelKey(v.label)
+            versions.pop(key, None)
+            versions[key] = self._version
+        while len(versions) > Graph._LABEL_VERSIONS:
+            self._labelVersionsFloor = versions.pop( next(iter(versions)) )
+
+    # =========================================================================
+    @staticmethod
+    def _twins(u:str, v:str, out:dict, inn:dict) -> bool:
+        """
+        Returns True if swapping vertices u and v maps the graph onto itself:
+        apart from each other, they have the same in- and out-neighbours
+        along edges with the same labels, u->v and v->u have the same label
+        (or both don't exist), and so do their self-loops.
+        """
+        outU = dict(out[u])
+        outV = dict(out[v])
+        if outU.get(v) != outV.get(u) or outU.get(u) != outV.get(v):
+            return False
+        others = lambda edges: set( (w, label) for w, label in edges if w != u and w != v )
+        return others(out[u]) == others(out[v]) and others(inn[u]) == others(inn[v])
+
+    # =========================================================================
+    def _unlinkEdge(self, u:Vertex, v:Vertex) -> None:
+        """
+        Primitive that removes the existing edge u->v and updates the vertex
+        degrees, the in-edges, the edge label index and the components.
+
+        Inputs: u, v - start and end Vertex of the edge
+        """
+        if self._ownedVertices is not None:
+            u = self._writableVertex(u.id)
+            v = self._writableVertex(v.id)
+        endVertices = self._writableEdges(u.id)
+        position = endVertices.index(v)
+        endVertices.pop(position)
+        startVIDs = self._writableInEdges(v.id)
+        inPosition = startVIDs.index(u.id)
+        startVIDs.pop(inPosition)
+        if self._componentParent is not None and u not in self._edges[v.id]:
+            # The edge may have been all that held a component together.
+            self._componentParent = self._componentSize = None
+        label = self._edgeLabels.pop( (u.id, v.id), None )
+        if label is not None:
+            targets = self._writableTargets( (u.id, label) )
+            targets.discard(v.id)
+            if len(targets) == 0:
+                del self._outEdgeIndex[(u.id, label)]
+        u.degree -= 1
+        v.degree -= 1
+        if self._columns is not None:
+            self._columns.unlink(u.id, v.id)
+        if self._log is not None:
+            self._log.append(GraphLog.UNLINK_EDGE, u.id, v.id)
+        self._touch(u, v)
+        self._logUndo(self._linkEdge, u, v, position, label, inPosition)
+
+    # =========================================================================
+    def _wlColors(self, iterations:int, labelled:bool) -> dict:
+        """
+        Runs Weisfeiler-Lehman colour refinement on this graph. Each vertex
+        starts out coloured by its labels (or all the same colour if
+        `labelled` is False); each iteration recolours a vertex by hashing its
+        colour together with the sorted colours of its out-neighbours and of
+        its in-neighbours, each tagged with the label of the edge to it if
+        `labelled` is True and the edge has one.
+
+        Inputs:
+            iterations - number of refinement rounds
+            labelled - whether to use the vertex and edge labels
+        Output: dictionary of vid->colour, where colours are hash strings
+        """
+        inn = self._inNeighbors()
+        tag = lambda color, start, end: color if not labelled or \
+            self.edgeLabel(start, end) is None else \
+            '%s/%r' % ( color, self.edgeLabel(start, end) )
+        colors = { vid : Graph._digest(repr(Graph._labelSignature(v.label)) if labelled else '')
+                   for vid, v in self._vertices.items() }
+        for i in range(iterations):
+            colors = { vid : Graph._digest( '%s|%s|%s' % ( color,
+                           ','.join(sorted( tag(colors[w.id], vid, w.id) for w in self._edges[vid] )),
+                           ','.join(sorted( tag(colors[w], w, vid) for w in inn[vid] )) ) )
+                       for vid, color in colors.items() }
+        return colors
+
+    # =========================================================================
+    def _writableEdges(self, vid:str) -> list:
+        """
+        Returns the out-edge list of the vertex with the given id, first
+        replacing it with a copy of its own if it is shared with a copy of
+        the graph (see copy()).
+        """
+        endVertices = self._edges[vid]
+        if self._ownedEdges is not None and vid not in self._ownedEdges:
+            endVertices = self._edges[vid] = list(endVertices)
+            self._ownedEdges.add(vid)
+        return endVertices
+
+    # =========================================================================
+    def _writableInEdges(self, vid:str) -> list:
+        """
+        Same as _writableEdges(), for the in-edges of the vertex.
+        """
+        startVIDs = self._inEdges[vid]
+        if self._ownedInEdges is not None and vid not in self._ownedInEdges:
+            startVIDs = self._inEdges[vid] = list(startVIDs)
+            self._ownedInEdges.add(vid)
+        return startVIDs
+
+    # =========================================================================
+    def _writableTargets(self, key:tuple) -> set:
+        """
+        Same as _writableEdges(), for the set of end vids in the edge label
+        index under the given (start vid, edge label) key. The set is added
+        if there is none.
+        """
+        targets = self._outEdgeIndex.get(key)
+        if targets is None:
+            targets = self._outEdgeIndex[key] = set()
+        elif self._ownedTargets is not None and key not in self._ownedTargets:
+            targets = self._outEdgeIndex[key] = set(targets)
+        else:
+            return targets
+        if self._ownedTargets is not None:
+            self._ownedTargets.add(key)
+        return targets
+
+    # =========================================================================
+    def _writableVertex(self, vid:str) -> Vertex:
+        """
+        Same as _writableEdges(), for the Vertex with the given id. The edge
+        lists that hold the shared Vertex are made to hold the new one, so
+        that every edge list keeps holding the graph's own Vertex objects.
+        """
+        v = self._vertices[vid]
+        if self._ownedVertices is None or vid in self._ownedVertices:
+            return v
+        w = copy.copy(v)
+        self._vertices[vid] = w
+        self._ownedVertices.add(vid)
+        for startVID in self._inEdges[vid]:
+            endVertices = self._writableEdges(startVID)
+            endVertices[endVertices.index(v)] = w
+        return w
@@ -0,0 +1,385 @@
+"""
+GraphLog.py - Write-ahead log of the changes made to a Graph.
+"""
+
+import os
+import pickle
+import struct
+import zlib
+
+class GraphLog(object):
+    """
+    An append-only log of the primitive changes made to a Graph, with
+    periodic checkpoints, so the graph can be rebuilt after a crash (see
+    Graph.open()).
+
+    Files: the log itself at `path`, and the latest checkpoint at
+    `path + '.ckpt'`. A checkpoint holds the whole graph, written as the
+    records that would build it; writing one empties the log, so recovery
+    replays the checkpoint plus only the changes made since. Besides the
+    primitives' records, a checkpoint holds IN_ORDER records, which put a
+    vertex's in-edges back in order where adding the edges one after the
+    other wouldn't.
+
+    Records: a header of payload length and CRC-32 ('<II'), then the payload:
+    one op code byte and the op's arguments, each a tag byte followed by the
+    value. Records are buffered and written to disk with a single fsync every
+    `syncEvery` records, so a crash can lose up to the last syncEvery - 1
+    changes (outside transactions). A record cut short by a crash, or failing
+    its CRC, ends the log; recovery drops it and everything after it.
+
+    Transactions: the records of a transaction sit between TX_BEGIN and
+    TX_END, and are synced at TX_END. Recovery only replays transactions
+    that reached TX_END, so a crash never leaves half a transaction behind.
+    A rolled back transaction is logged with the changes that undid it.
+
+    Generations: each checkpoint gets the next generation number, and the
+    log emptied after it starts with a GENERATION record with that number.
+    If a crash comes between writing a checkpoint and emptying the log, the
+    log's older generation shows that its records are already in the
+    checkpoint, and they are skipped.
+    """
+
+    # Op codes. The argument lists are those of the Graph primitives.
+    INSERT_VERTEX = 1   # vid, label, number
+    REMOVE_VERTEX = 2   # vid
+    LINK_EDGE     = 3   # start vid, end vid, position, edge label, in-position
+    UNLINK_EDGE   = 4   # start vid, end vid
+    TX_BEGIN      = 5
+    TX_END        = 6
+    GENERATION    = 7   # generation number
+    IN_ORDER      = 8   # end vid, start vids of its in-edges in order
+
+    # Value tags.
+    _NONE, _INT, _STR, _LIST, _PICKLE = range(5)
+
+    _HEADER = struct.Struct('<II')
+    _LENGTH = struct.Struct('<I')
+    _INT64  = struct.Struct('<q')
+
+    # Bytes read from or written to a file at a time.
+    _CHUNK = 1 << 20
+
+    # =========================================================================
+    def __init__(self, path:str, syncEvery:int=64):
+        """
+        Opens the log at `path`, creating it if needed. A torn record or an
+        unfinished transaction at the end of an existing log is cut off.
+        Only the first record of the checkpoint is read; call recover() to
+        read back what the log and checkpoint hold.
+
+        Inputs:
+            path - path of the log file
+            syncEvery - number of records to buffer between fsyncs
+        """
+        self.path = path
+        self.syncEvery = max(1, syncEvery)
+
+        # Encoded records not yet written to the file.
+        self._buffer = bytearray()
+        self._pending = 0
+
+        # How deep in transactions the records being appended are.
+        self._txDepth = 0
+
+        self._generation = GraphLog._readGeneration(self.path + '.ckpt')
+        logGeneration = GraphLog._readGeneration(self.path)
+        end = GraphLog._scan(self.path)
+        self._file = open(self.path, 'ab')
+        if end < self._file.tell():
+            self._file.truncate(end)
+        if end == 0 or logGeneration < self._generation:
+            # A new log, or one whose records are already in the checkpoint.
+            self._file.truncate(0)
+            self.append(GraphLog.GENERATION, self._generation)
+            self.sync()
+
+    # =========================================================================
+    def append(self, op:int, *args) -> None:
+        """
+        Adds a record to the log, syncing it to disk with the records before
+        it if syncEvery records are waiting (or a transaction ends).
+
+        Inputs:
+            op - op code
+            args - the op's arguments
+        """
+        GraphLog._record(op, args, self._buffer)
+        self._pending += 1
+
+        if op == GraphLog.TX_BEGIN:
+            self._txDepth += 1
+        elif op == GraphLog.TX_END:
+            self._txDepth -= 1
+            if self._txDepth == 0:
+                self.sync()
+                return
+        if self._pending >= self.syncEvery and self._txDepth == 0:
+            self.sync()
+
+    # =========================================================================
+    def checkpoint(self, records) -> None:
+        """
+        Writes a new checkpoint holding the given records, then empties the
+        log. The checkpoint is written to a temporary file and renamed into
+        place, so a crash leaves either the old checkpoint or the new one.
+
+        Inputs: records - iterable of (op, args) pairs that build the graph
+        """
+        if self._txDepth > 0:
+            raise Exception("Cannot checkpoint during a transaction.")
+        self.sync()
+
+        generation = self._generation + 1
+        tmp = self.path + '.ckpt.tmp'
+        with open(tmp, 'wb') as f:
+            chunk = bytearray()
+            GraphLog._record(GraphLog.GENERATION, (generation,), chunk)
+            for op, args in records:
+                GraphLog._record(op, args, chunk)
+                if len(chunk) > GraphLog._CHUNK:
+                    f.write(chunk)
+                    chunk.clear()
+            f.write(chunk)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, self.path + '.ckpt')
+        GraphLog._syncDirectory(self.path)
+        self._generation = generation
+
+        self._file.truncate(0)
+        self.append(GraphLog.GENERATION, generation)
+        self.sync()
+
+    # =========================================================================
+    def close(self) -> None:
+        """
+        Syncs any buffered records and closes the log.
+        """
+        if self._file is not None:
+            self.sync()
+            self._file.close()
+            self._file = None
+
+    # =========================================================================
+    def recover(self):
+        """
+        Generates the (op, args) pairs of every change held by the checkpoint
+        and then the log, leaving out transactions that never ended and the
+        GENERATION and transaction marks themselves. Buffered records that
+        haven't been synced yet are not included.
+        """
+        yield from GraphLog._changes(self.path + '.ckpt')
+        yield from GraphLog._changes(self.path)
+
+    # =========================================================================
+    def sync(self) -> None:
+        """
+        Writes the buffered records to the file and fsyncs it.
+        """
+        if len(self._buffer) > 0:
+            self._file.write(self._buffer)
+            self._file.flush()
+            os.fsync(self._file.fileno())
+            self._buffer.clear()
+        self._pending = 0
+
+    # =========================================================================
+    @staticmethod
+    def _changes(path:str):
+        """
+        Generates the (op, args) pairs of the changes in a log or checkpoint
+        file, dropping transactions that never ended.
+        """
+        tx = None
+        for op, args in GraphLog._records(path):
+            if op == GraphLog.TX_BEGIN:
+                tx = []
+            elif op == GraphLog.TX_END:
+                yield from tx
+                tx = None
+            elif op == GraphLog.GENERATION:
+                pass
+            elif tx is not None:
+                tx.append( (op, args) )
+            else:
+                yield op, args
+
+    # =========================================================================
+    @staticmethod
+    def _decode(data:bytes, offset:int) -> tuple:
+        """
+        Decodes the value starting at `offset`. Returns (value, next offset).
+        """
+        tag = data[offset]
+        offset += 1
+        if tag == GraphLog._NONE:
+            return None, offset
+        if tag == GraphLog._INT:
+            return GraphLog._INT64.unpack_from(data, offset)[0], offset + 8
+        if tag == GraphLog._STR or tag == GraphLog._PICKLE:
+            n = GraphLog._LENGTH.unpack_from(data, offset)[0]
+            offset += 4
+            raw = bytes(data[offset:offset+n])
+            value = raw.decode('utf-8') if tag == GraphLog._STR else pickle.loads(raw)
+            return value, offset + n
+        if tag == GraphLog._LIST:
+            n = GraphLog._LENGTH.unpack_from(data, offset)[0]
+            offset += 4
+            values = []
+            for i in range(n):
+                value, offset = GraphLog._decode(data, offset)
+                values.append(value)
+            return values, offset
+        raise Exception("Unknown value tag %d in graph log." % tag)
+
+    # =========================================================================
+    @staticmethod
+    def _encode(value, out:bytearray) -> None:
+        """
+        Appends the encoding of `value` to `out`. Values other than None,
+        64-bit ints, strings and lists of these are pickled.
+        """
+        if value is None:
+            out.append(GraphLog._NONE)
+        elif type(value) is int and -2**63 <= value < 2**63:
+            out.append(GraphLog._INT)
+            out += GraphLog._INT64.pack(value)
+        elif type(value) is str:
+            raw = value.encode('utf-8')
+            out.append(GraphLog._STR)
+            out += GraphLog._LENGTH.pack(len(raw))
+            out += raw
+        elif type(value) is list:
+            out.append(GraphLog._LIST)
+            out += GraphLog._LENGTH.pack(len(value))
+            for element in value:
+                GraphLog._encode(element, out)
+        else:
+            raw = pickle.dumps(value)
+            out.append(GraphLog._PICKLE)
+            out += GraphLog._LENGTH.pack(len(raw))
+            out += raw
+
+    # =========================================================================
+    @staticmethod
+    def _record(op:int, args:tuple, out:bytearray) -> None:
+        """
+        Appends the encoded record of op(args) to `out`.
+        """
+        payload = bytearray( (op,) )
+        for arg in args:
+            GraphLog._encode(arg, payload)
+        out += GraphLog._HEADER.pack( len(payload), zlib.crc32(payload) )
+        out += payload
+
+    # =========================================================================
+    @staticmethod
+    def _payloads(path:str):
+        """
+        Generates (payload, end offset) for each record in a file, stopping at
+        the end of the file or the first torn or corrupt record. The file is
+        read a chunk at a time, so only the records in the current chunk are
+        held in memory.
+        """
+        if not os.path.exists(path):
+            return
+
+        header = GraphLog._HEADER
+        with open(path, 'rb') as f:
+            # The bytes read but not yet parsed start at data[offset], which
+            # is at `end` in the file.
+            data = b''
+            offset = 0
+            end = 0
+            while True:
+                if len(data) - offset < header.size:
+                    data = data[offset:] + f.read(GraphLog._CHUNK)
+                    offset = 0
+                    if len(data) < header.size:
+                        return
+                n, crc = header.unpack_from(data, offset)
+                if len(data) - offset < header.size + n:
+                    data = data[offset:] + f.read( max(GraphLog._CHUNK, header.size + n) )
+                    offset = 0
+                start = offset + header.size
+                payload = data[start:start+n]
+                if n == 0 or len(payload) < n or zlib.crc32(payload) != crc:
+                    return
+                offset = start + n
+                end += header.size + n
+                yield payload, end
+
+    # =========================================================================
+    @staticmethod
+    def _readGeneration(path:str) -> int:
+        """
+        Returns the generation of a log or checkpoint file, held by its
+        first record, or 0 if it is missing or empty. Reads no further.
+        """
+        if not os.path.exists(path):
+            return 0
+
+        header = GraphLog._HEADER
+        with open(path, 'rb') as f:
+            data = f.read(header.size)
+            if len(data) < header.size:
+                return 0
+            n, crc = header.unpack(data)
+            payload = f.read(n)
+        if n == 0 or len(payload) < n or zlib.crc32(payload) != crc or \
+                payload[0] != GraphLog.GENERATION:
+            return 0
+        return GraphLog._decode(payload, 1)[0]
+
+    # =========================================================================
+    @staticmethod
+    def _records(path:str):
+        """
+        Generates the (op, args) pairs of the good records in a file.
+        """
+        for payload, end in GraphLog._payloads(path):
+            args = []
+            i = 1
+            while i < len(payload):
+                value, i = GraphLog._decode(payload, i)
+                args.append(value)
+            yield payload[0], tuple(args)
+
+    # =========================================================================
+    @staticmethod
+    def _scan(path:str) -> int:
+        """
+        Returns the offset just past the last good record of a log file that
+        isn't part of an unfinished transaction (0 if it is missing or
+        empty).
+        """
+        end = 0
+        inTransaction = False
+        for payload, offset in GraphLog._payloads(path):
+            op = payload[0]
+            if op == GraphLog.TX_BEGIN:
+                inTransaction = True
+            elif op == GraphLog.TX_END:
+                inTransaction = False
+            if not inTransaction:
+                end = offset
+        return end
+
+    # =========================================================================
+    @staticmethod
+    def _syncDirectory(path:str) -> None:
+        """
+        Fsyncs the directory holding `path`, so a rename in it is durable.
+        Not every platform can open directories; there it does nothing.
+        """
+        try:
+            fd = os.open(os.path.dirname(os.path.abspath(path)), os.O_RDONLY)
+        except OSError:
+            return
+        try:
+            os.fsync(fd)
+        except OSError:
+            pass
+        finally:
+            os.close(fd)
@@ -0,0 +1,176 @@
+"""
+Overlay.py - A dictionary made of a shared base dictionary and private changes.
+"""
+
+import math
+import sys
+from collections.abc import MutableMapping
+
+class Overlay(MutableMapping):
+    """
+    A dictionary that reads through to a base dictionary it shares with
+    others, and keeps its own changes on the side: the keys it has set, and
+    the base keys it has deleted. The base is never changed, so making an
+    overlay, or a copy of one, costs as much as its changes and not as much
+    as the base. Graph.copy() uses overlays to share the storage of large
+    graphs.
+
+    The keys are in the order a dict would have them in: the base keys that
+    are left, then the keys added (or deleted and added again) since, in the
+    order they were added.
+    """
+
+    # =========================================================================
+    def __init__(self, base:dict, changes:dict=None, removed:set=None):
+        """
+        Builds an overlay of `base` with the given changes.
+
+        Inputs:
+            base - the shared dictionary; never changed by the overlay
+            changes - key -> value set on top of the base, or None
+            removed - base keys deleted from the overlay, or None. A key
+                      that is in both was deleted and then set again.
+        """
+        self.base = base
+        self.changes = {} if changes is None else changes
+        self.removed = set() if removed is None else removed
+
+        # Number of keys, kept so that len() doesn't have to go through the
+        # changes.
+        self._size = len(base) - len(self.removed) + \
+            sum( 1 for key in self.changes if key not in base or key in self.removed )
+
+    # =========================================================================
+    def __contains__(self, key) -> bool:
+        return key in self.changes or (key not in self.removed and key in self.base)
+
+    # =========================================================================
+    def __delitem__(self, key) -> None:
+        if key in self.changes:
+            del self.changes[key]
+            if key in self.base:
+                self.removed.add(key)
+        elif key in self.base and key not in self.removed:
+            self.removed.add(key)
+        else:
+            raise KeyError(key)
+        self._size -= 1
+
+    # =========================================================================
+    def __getitem__(self, key):
+        changes = self.changes
+        if key in changes:
+            return changes[key]
+        if key in self.removed:
+            raise KeyError(key)
+        return self.base[key]
+
+    # =========================================================================
+    def __iter__(self):
+        changes = self.changes
+        removed = self.removed
+        base = self.base
+        if len(removed) == 0:
+            yield from base
+        else:
+            for key in base:
+                if key not in removed:
+                    yield key
+        for key in changes:
+            if key not in base or key in removed:
+                yield key
+
+    # =========================================================================
+    def __len__(self) -> int:
+        return self._size
+
+    # =========================================================================
+    def __setitem__(self, key, value) -> None:
+        if key not in self:
+            self._size += 1
+        self.changes[key] = value
+
+    # =========================================================================
+    def absorb(self) -> dict:
+        """
+        Applies the changes to the base dictionary itself and returns it.
+        Only safe once nothing else reads the base. Costs as much as the
+        changes.
+        """
+        base = self.base
+        for key in self.removed:
+            del base[key]
+        base.update(self.changes)
+        self.changes = {}
+        self.removed = set()
+        return base
+
+    # =========================================================================
+    def copy(self):
+        """
+        Returns a new Overlay of the same base with a copy of the changes.
+        """
+        return Overlay(self.base, dict(self.changes), set(self.removed))
+
+    # =========================================================================
+    def delta(self) -> int:
+        """
+        Returns the number of changes held on top of the base.
+        """
+        return len(self.changes) + len(self.removed)
+
+    # =========================================================================
+    def flatten(self) -> dict:
+        """
+        Returns a new dictionary with the same items, in the same order.
+        Costs as much as the base.
+        """
+        d = dict(self.base)
+        for key in self.removed:
+            del d[key]
+        d.update(self.changes)
+        return d
+
+    # =========================================================================
+    def get(self, key, default=None):
+        """
+        Same as dict.get(), without going through a KeyError.
+        """
+        changes = self.changes
+        if key in changes:
+            return changes[key]
+        if key in self.removed:
+            return default
+        return self.base.get(key, default)
+
+    # =========================================================================
+    def memoryUsage(self) -> int:
+        """
+        Returns an estimate of the bytes used by the overlay and its base,
+        not counting the keys and values.
+        """
+        return sys.getsizeof(self) + sys.getsizeof(self.base) + \
+            sys.getsizeof(self.changes) + sys.getsizeof(self.removed)
+
+    # =========================================================================
+    @staticmethod
+    def over(d):
+        """
+        Returns a new Overlay that reads the same as the dictionary (or
+        Overlay) d and can be changed without changing d. Costs as much as
+        the changes of d, if it is an Overlay.
+        """
+        return d.copy() if isinstance(d, Overlay) else Overlay(d)
+
+    # =========================================================================
+    @staticmethod
+    def settle(d):
+        """
+        Returns d, or a flattened copy of d if it is an Overlay whose changes
+        have grown past about the square root of its size. Settling after
+        every change keeps both the cost of over() and the flattening cost
+        per change to about the square root of the size.
+        """
+        if isinstance(d, Overlay) and d.delta() > max(64, 4 * math.isqrt(len(d.base))):
+            return d.flatten()
+        return d
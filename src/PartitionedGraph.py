@@ -0,0 +1,397 @@
+"""
+PartitionedGraph.py - A graph split into shards searched by worker processes.
+"""
+
+import multiprocessing
+import zlib
+
+from YapyGraph.src.Graph import Graph
+from YapyGraph.src.Vertex import Vertex
+
+class PartitionedGraph(object):
+    """
+    A Graph whose vertices are split across shards, each held by its own
+    worker process, and searched by all of them together.
+
+    Each shard owns some of the vertices, with their full lists of out- and
+    in-neighbours and the labels of the edges to them. The neighbours of
+    owned vertices that belong to other shards are copied into the shard as
+    its halo (label, degree and owning shard only), so a shard can find and
+    filter the neighbours of its own vertices without asking anyone.
+
+    search() matches the query vertices one at a time, in the order of
+    q.vertices(), in rounds (bulk synchronous). Each partial match is sent to
+    the shard that owns the data vertex matched to an earlier query vertex
+    joined to the next one (its anchor). That shard proposes the anchor's
+    neighbours that pass the label and degree tests. It checks the ones it
+    owns itself; the others are sent, with the partial match, to the shard
+    that owns them, which has every edge needed to check them, edge labels
+    included. A query vertex not joined to any earlier one is proposed by
+    every shard from its own vertices. The solutions are the same as
+    Graph.search()'s, in no particular order.
+
+    The shards are built from a Graph, and don't follow later changes to it.
+    Call close() (or use a with block) to stop the workers.
+
+    Build one with Graph.partition().
+    """
+
+    # =========================================================================
+    def __init__(self, graph:Graph, numShards:int=2, by:str='hash'):
+        """
+        Splits `graph` into `numShards` shards and starts a worker process
+        for each.
+
+        Inputs:
+            graph - the Graph to split
+            numShards - number of shards (and worker processes)
+            by - 'hash' to spread the vertices by a hash of their ids, or
+                 'label' to keep vertices with the same label together,
+                 balancing the number of vertices per shard
+        """
+        if numShards < 1:
+            raise Exception("A PartitionedGraph needs at least one shard.")
+        if by not in ( 'hash', 'label' ):
+            raise Exception("Unknown partitioning %s." % by)
+
+        self.numShards = numShards
+
+        shardOf = PartitionedGraph._assign(graph, numShards, by)
+        shards = [ PartitionedGraph._shardData(graph, shardOf, s)
+                   for s in range(numShards) ]
+
+        # One (process, connection) pair per shard.
+        self._workers = []
+        for s in range(numShards):
+            conn, child = multiprocessing.Pipe()
+            process = multiprocessing.Process(target=_serveShard, args=(child, s),
+                                              daemon=True)
+            process.start()
+            child.close()
+            conn.send(shards[s])
+            self._workers.append( (process, conn) )
+
+        # Number of vertices owned by each shard.
+        self._sizes = [ len(shard[0]) for shard in shards ]
+
+    # =========================================================================
+    def close(self) -> None:
+        """
+        Stops the worker processes.
+        """
+        for process, conn in self._workers:
+            try:
+                conn.send( ('close', None) )
+                conn.close()
+            except OSError:
+                pass
+        for process, conn in self._workers:
+            process.join()
+        self._workers = []
+
+    # =========================================================================
+    def numVertices(self) -> int:
+        """
+        Returns the number of vertices in all the shards.
+        """
+        return sum(self._sizes)
+
+    # =========================================================================
+    def search(self, q:Graph) -> list:
+        """
+        Searches for every instance of Graph q, as Graph.search() does, with
+        the work spread over the shards.
+
+        Inputs: query Graph q
+        Output: list of vid->vid mappings from q to the partitioned graph
+        """
+        if len(self._workers) == 0:
+            raise Exception("The PartitionedGraph is closed.")
+
+        plan = PartitionedGraph._queryPlan(q)
+        if len(plan) == 0:
+            return []
+        self._exchange( [ ('query', plan) ] * self.numShards )
+
+        # Partial matches, as tuples of (data vid, shard) pairs in query
+        # vertex order.
+        partials = [ () ]
+        for k in range(len(plan)):
+            anchor = plan[k][4]
+
+            # Route each partial match to the shard owning its anchor, or to
+            # every shard.
+            routed = [ [] for s in range(self.numShards) ]
+            for P in partials:
+                if anchor is None:
+                    for s in range(self.numShards):
+                        routed[s].append(P)
+                else:
+                    routed[ P[anchor][1] ].append(P)
+            replies = self._exchange( [ ('propose', (k, P)) for P in routed ] )
+
+            # Send the candidates other shards own on to their owners.
+            partials = []
+            remote = [ [] for s in range(self.numShards) ]
+            for extended, proposed in replies:
+                partials.extend(extended)
+                for P, vid, s in proposed:
+                    remote[s].append( (P, vid) )
+            for extended in self._exchange( [ ('verify', (k, R)) for R in remote ] ):
+                partials.extend(extended)
+
+            if len(partials) == 0:
+                return []
+
+        qids = [ step[0] for step in plan ]
+        return [ { qids[k] : P[k][0] for k in range(len(qids)) } for P in partials ]
+
+    # =========================================================================
+    def shardSizes(self) -> list:
+        """
+        Returns the number of vertices owned by each shard.
+        """
+        return list(self._sizes)
+
+    # =========================================================================
+    def __enter__(self):
+        return self
+
+    # =========================================================================
+    def __exit__(self, *exc) -> None:
+        self.close()
+
+    # =========================================================================
+    @staticmethod
+    def _assign(graph:Graph, numShards:int, by:str) -> dict:
+        """
+        Returns the shard of every vertex, as a vid->shard dictionary.
+        """
+        if by == 'hash':
+            return { vid : zlib.crc32(str(vid).encode('utf-8')) % numShards
+                     for vid in graph._vertices }
+
+        # Whole label groups go to the least loaded shard, largest first.
+        groups = dict()
+        for v in graph.vertices():
+            groups.setdefault(Graph._labelKey(v.label), []).append(v.id)
+        loads = [ 0 ] * numShards
+        shardOf = dict()
+        for key in sorted(groups, key=lambda key: (-len(groups[key]), repr(key))):
+            s = loads.index(min(loads))
+            for vid in groups[key]:
+                shardOf[vid] = s
+            loads[s] += len(groups[key])
+        return shardOf
+
+    # =========================================================================
+    def _exchange(self, messages:list) -> list:
+        """
+        Sends one (command, payload) message to each shard, then waits for
+        every reply. Returns the replies in shard order. If a shard replies
+        with an exception, the first one is raised, but only once every
+        reply has been read, so none is left behind for the next exchange.
+        """
+        for (process, conn), message in zip(self._workers, messages):
+            conn.send(message)
+        replies = [ conn.recv() for process, conn in self._workers ]
+        for reply in replies:
+            if isinstance(reply, Exception):
+                raise reply
+        return replies
+
+    # =========================================================================
+    @staticmethod
+    def _queryPlan(q:Graph) -> list:
+        """
+        Returns what the shards need to know about each query vertex, in
+        order: (id, label, degree, [(j, direction, edge label)], anchor,
+        labelled out-edge counts), where the list holds the earlier query
+        vertices j joined to this one, by an edge out of it ('out') or into
+        it ('in'), and anchor is the first such j, or None.
+        """
+        order = list(q.vertices())
+        index = { u.id : k for k, u in enumerate(order) }
+
+        plan = []
+        for k, u in enumerate(order):
+            joins = []
+            for w in q._edges[u.id]:
+                if index[w.id] < k:
+                    joins.append( (index[w.id], 'out', q.edgeLabel(u.id, w.id)) )
+            for j in range(k):
+                if q.hasEdge(order[j].id, u.id):
+                    joins.append( (j, 'in', q.edgeLabel(order[j].id, u.id)) )
+            anchor = min(j for j, direction, label in joins) if len(joins) > 0 else None
+            plan.append( (u.id, u.label, q._degree(u), joins, anchor, q._edgeLabelCounts(u)) )
+        return plan
+
+    # =========================================================================
+    @staticmethod
+    def _shardData(graph:Graph, shardOf:dict, s:int) -> tuple:
+        """
+        Returns the data sent to the worker of shard s: its owned vertices as
+        (vid, label, number, degree) tuples in graph order, its halo as a
+        vid->(label, degree, shard) dictionary, and the out- and in-neighbours
+        of every owned vertex, as lists of (vid, edge label) pairs.
+        """
+        owned = [ vid for vid in graph._vertices if shardOf[vid] == s ]
+        ownedSet = set(owned)
+
+        out = { vid : [ (w.id, graph.edgeLabel(vid, w.id)) for w in graph._edges[vid] ]
+                for vid in owned }
+        inn = { vid : [] for vid in owned }
+        for vid, endVertices in graph._edges.items():
+            for w in endVertices:
+                if w.id in ownedSet:
+                    inn[w.id].append( (vid, graph.edgeLabel(vid, w.id)) )
+
+        halo = dict()
+        for neighbors in list(out.values()) + list(inn.values()):
+            for wid, label in neighbors:
+                if wid not in ownedSet and wid not in halo:
+                    w = graph._vertices[wid]
+                    halo[wid] = ( w.label, w.degree, shardOf[wid] )
+
+        vertices = [ (vid, graph._vertices[vid].label, graph._vertices[vid].number,
+                      graph._vertices[vid].degree) for vid in owned ]
+        return vertices, halo, out, inn
+
+# =============================================================================
+class _Shard(object):
+    """
+    The part of a PartitionedGraph held by one worker process.
+    """
+
+    def __init__(self, s:int, data:tuple):
+        vertices, halo, out, inn = data
+        self.s = s
+
+        # Vertex objects of the owned and halo vertices, with their degrees
+        # in the whole graph, and the shard of each.
+        self.vertices = dict()
+        self.shardOf = dict()
+        for vid, label, number, degree in vertices:
+            self.vertices[vid] = _Shard._vertex(vid, label, number, degree)
+            self.shardOf[vid] = s
+        for vid, (label, degree, shard) in halo.items():
+            self.vertices[vid] = _Shard._vertex(vid, label, None, degree)
+            self.shardOf[vid] = shard
+
+        # Neighbours of the owned vertices, as neighbour vid -> edge label
+        # dictionaries, and the number of labelled out-edges with each label.
+        self.owned = [ vid for vid, label, number, degree in vertices ]
+        self.out = { vid : dict(neighbors) for vid, neighbors in out.items() }
+        self.inn = { vid : dict(neighbors) for vid, neighbors in inn.items() }
+        self.labelCounts = dict()
+        for vid, neighbors in out.items():
+            counts = dict()
+            for wid, label in neighbors:
+                if label is not None:
+                    counts[label] = counts.get(label, 0) + 1
+            self.labelCounts[vid] = counts
+
+        # The plan of the query being searched for.
+        self.plan = None
+
+    @staticmethod
+    def _vertex(vid, label, number, degree:int) -> Vertex:
+        v = Vertex(vid, label, number)
+        v.degree = degree
+        return v
+
+    def passes(self, k:int, vid) -> bool:
+        """
+        Returns True if data vertex vid passes the label and degree tests for
+        query vertex k.
+        """
+        qid, label, degree, joins, anchor, counts = self.plan[k]
+        v = self.vertices[vid]
+        return v.hasLabel(label) and v.degree >= degree
+
+    def joinable(self, k:int, P:tuple, vid) -> bool:
+        """
+        Returns True if owned data vertex vid can extend the partial match P
+        to query vertex k. Like Graph._isMatched(), a data vertex counts as
+        matched if its id is in the match on either side.
+        """
+        for j in range(k):
+            if P[j][0] == vid or self.plan[j][0] == vid:
+                return False
+        for j, direction, label in self.plan[k][3]:
+            neighbors = self.out[vid] if direction == 'out' else self.inn[vid]
+            if P[j][0] not in neighbors or \
+                    (label is not None and neighbors[P[j][0]] != label):
+                return False
+        counts = self.labelCounts[vid]
+        for label, count in self.plan[k][5]:
+            if counts.get(label, 0) < count:
+                return False
+        return True
+
+    def propose(self, k:int, partials:list) -> tuple:
+        """
+        Proposes candidates for query vertex k for each partial match.
+        Returns the extended matches for the candidates owned here, and
+        (partial match, vid, owner) for the others.
+        """
+        qid, label, degree, joins, anchor, counts = self.plan[k]
+        extended = []
+        proposed = []
+        for P in partials:
+            if anchor is None:
+                candidates = self.owned
+                edgeLabel = None
+            else:
+                direction, edgeLabel = [ (d, l) for j, d, l in joins if j == anchor ][0]
+                m = P[anchor][0]
+                # u -> anchor means the candidate has an edge into m.
+                candidates = self.inn[m] if direction == 'out' else self.out[m]
+
+            for vid in candidates:
+                if edgeLabel is not None and candidates[vid] != edgeLabel:
+                    continue
+                if not self.passes(k, vid):
+                    continue
+                owner = self.shardOf[vid]
+                if owner != self.s:
+                    proposed.append( (P, vid, owner) )
+                elif self.joinable(k, P, vid):
+                    extended.append( P + ((vid, self.s),) )
+        return extended, proposed
+
+    def verify(self, k:int, pairs:list) -> list:
+        """
+        Checks candidates proposed by other shards. Returns the extended
+        matches.
+        """
+        return [ P + ((vid, self.s),) for P, vid in pairs if self.joinable(k, P, vid) ]
+
+# =============================================================================
+def _serveShard(conn, s:int) -> None:
+    """
+    Main loop of a worker process: receives the shard data, then answers
+    (command, payload) messages until told to close.
+    """
+    shard = _Shard(s, conn.recv())
+    while True:
+        try:
+            command, payload = conn.recv()
+        except EOFError:
+            break
+        if command == 'close':
+            break
+        try:
+            if command == 'query':
+                shard.plan = payload
+                reply = None
+            elif command == 'propose':
+                reply = shard.propose(*payload)
+            elif command == 'verify':
+                reply = shard.verify(*payload)
+            else:
+                reply = Exception("Unknown shard command %s." % command)
+        except Exception as e:
+            reply = e
+        conn.send(reply)
+    conn.close()
@@ -0,0 +1,151 @@
+"""
+SearchCache.py - A bounded cache of Graph.search() results.
+"""
+
+import sys
+import threading
+from collections import OrderedDict
+
+class SearchCache(object):
+    """
+    A least-recently-used cache of search results, bounded by an estimate of
+    the memory the results take up. Each entry remembers the graph version it
+    was computed at and the query labels it depends on; the Graph decides
+    whether an entry is still fresh (see Graph.enableSearchCache()).
+
+    `hits` and `misses` count lookups; a stale entry counts as a miss.
+    The cache can be used from several threads at once.
+    """
+
+    # =========================================================================
+    def __init__(self, maxBytes:int):
+        """
+        Builds an empty cache.
+
+        Inputs: maxBytes - the most memory the cached results may use
+        """
+        self.maxBytes = maxBytes
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+
+        # key -> (version, labels, solutions, size), least recently used first.
+        self._entries = OrderedDict()
+
+        # Guards _entries and the counters.
+        self._lock = threading.Lock()
+
+    # =========================================================================
+    def clear(self) -> None:
+        """
+        Removes every entry. The hit and miss counts are kept.
+        """
+        with self._lock:
+            self._entries.clear()
+            self.bytes = 0
+
+    # =========================================================================
+    def lookup(self, key, isFresh, version:int=None) -> list:
+        """
+        Returns the solutions cached under `key`, or None if there are none
+        or if `isFresh(version, labels)` says they are out of date (in which
+        case they are dropped).
+
+        Inputs:
+            key - cache key of the query
+            isFresh - function of (version, labels) -> bool
+            version - the graph's current version, or None. An entry found
+                      fresh is stamped with it, so the next lookups don't
+                      check the same changes again.
+        Output: list of solutions, or None
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] != version:
+                if not isFresh(entry[0], entry[1]):
+                    self._discard(key)
+                    entry = None
+                elif version is not None:
+                    entry = ( version, ) + entry[1:]
+                    self._entries[key] = entry
+
+            if entry is None:
+                self.misses += 1
+                return None
+
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[2]
+
+    # =========================================================================
+    def store(self, key, version:int, labels:set, solutions:list) -> None:
+        """
+        Caches `solutions` under `key`, evicting the least recently used
+        entries until the cache fits in maxBytes again. Results too big to
+        ever fit are not cached.
+
+        Inputs:
+            key - cache key of the query
+            version - graph version the solutions were computed at
+            labels - query labels the solutions depend on
+            solutions - list of vid->vid mappings
+        """
+        size = SearchCache._sizeOf(key, solutions)
+        with self._lock:
+            self._discard(key)
+            if size > self.maxBytes:
+                return
+
+            self._entries[key] = ( version, labels, solutions, size )
+            self.bytes += size
+            while self.bytes > self.maxBytes:
+                self._discard( next(iter(self._entries)) )
+
+    # =========================================================================
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    # =========================================================================
+    def _discard(self, key) -> None:
+        """
+        Removes the entry for `key`, if there is one. The caller holds the
+        lock.
+        """
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self.bytes -= entry[3]
+
+    # =========================================================================
+    @staticmethod
+    def _keySize(key, seen:set) -> int:
+        """
+        Returns the bytes used by a key: the key itself and, for tuples and
+        frozensets, everything in them, counting each object once. The key
+        outlives the query graph it describes, so its ids and labels are
+        counted too.
+
+        Inputs:
+            key - cache key, or part of one
+            seen - ids of the objects counted so far
+        """
+        if id(key) in seen:
+            return 0
+        seen.add(id(key))
+        size = sys.getsizeof(key)
+        if isinstance(key, (tuple, frozenset)):
+            for element in key:
+                size += SearchCache._keySize(element, seen)
+        return size
+
+    # =========================================================================
+    @staticmethod
+    def _sizeOf(key, solutions:list) -> int:
+        """
+        Estimates the bytes used by an entry: the whole key (see _keySize()),
+        and the containers of the solutions. The vertex ids in the solutions
+        are shared with the key and the data graph, so they aren't counted.
+        """
+        size = SearchCache._keySize(key, set()) + sys.getsizeof(solutions)
+        for M in solutions:
+            size += sys.getsizeof(M)
+        return size
@@ -0,0 +1,264 @@
+"""
+SubgraphView.py - A read-only view of an induced subgraph of a Graph.
+"""
+
+import sys
+from collections.abc import Mapping
+
+from YapyGraph.src.Graph import Graph
+from YapyGraph.src.Vertex import Vertex
+
+class SubgraphView(Graph):
+    """
+    A read-only view of the subgraph of a Graph induced by a set of vertex
+    ids: those vertices and every edge between them. Nothing is copied; the
+    view looks through to the base graph whenever it is read, so it can be
+    searched, used as a query graph, or viewed again with subgraph(), just
+    like a Graph. Vertex degrees are the degrees within the view.
+
+    A view has no version of its own: its version and label versions are
+    the base graph's, so the search cache and the degrees the view works out
+    follow changes to the base graph.
+
+    Build views with Graph.subgraph().
+    """
+
+    # =========================================================================
+    def __init__(self, base:Graph, vids:list):
+        """
+        Builds a view of `base` restricted to the vertices with the given ids.
+
+        Inputs:
+            base - the Graph being viewed
+            vids - ids of the vertices in the view
+        """
+        super().__init__()
+
+        # The graph being viewed.
+        self._base = base
+
+        # The ids in the view, in the order given. Used as an ordered set.
+        self._ids = dict.fromkeys(vids)
+
+        # Stand-ins for the dictionaries a Graph keeps, restricted to the view.
+        self._vertices = _ViewVertices(base, self._ids)
+        self._edges = _ViewEdges(base, self._ids)
+
+        # Degrees within the view, keyed by vertex id, and the base graph
+        # version they were worked out at. Filled in by _degree().
+        self._degrees = None
+        self._degreesVersion = None
+
+        # In-edges within the view, keyed by vertex id, and the base graph
+        # version they were worked out at. Filled in by _inNeighbors().
+        self._inEdges = None
+        self._inEdgesVersion = None
+
+    # =========================================================================
+    @property
+    def _componentParent(self) -> dict:
+        return None     # the base graph's changes would not reach a view's own
+
+    @_componentParent.setter
+    def _componentParent(self, componentParent:dict) -> None:
+        pass    # set by Graph.__init__(); a view keeps no component index
+
+    # =========================================================================
+    @property
+    def _version(self) -> int:
+        return self._base._version
+
+    @_version.setter
+    def _version(self, version:int) -> None:
+        pass    # set by Graph.__init__(); a view uses its base graph's version
+
+    # =========================================================================
+    @property
+    def _labelVersions(self) -> dict:
+        return self._base._labelVersions
+
+    @_labelVersions.setter
+    def _labelVersions(self, labelVersions:dict) -> None:
+        pass    # set by Graph.__init__(); a view uses its base graph's
+
+    # =========================================================================
+    @property
+    def _labelVersionsFloor(self) -> int:
+        return self._base._labelVersionsFloor
+
+    @_labelVersionsFloor.setter
+    def _labelVersionsFloor(self, floor:int) -> None:
+        pass    # set by Graph.__init__(); a view uses its base graph's
+
+    # =========================================================================
+    def addEdge(self, u:str or Vertex, v:str or Vertex, bi:bool=False, label=None) -> None:
+        raise Exception("A SubgraphView is read-only.")
+
+    # =========================================================================
+    def addVertex(self, v:Vertex) -> Vertex:
+        raise Exception("A SubgraphView is read-only.")
+
+    # =========================================================================
+    def copy(self) -> Graph:
+        """
+        Returns a new Graph holding the vertices and edges in this view. The
+        vertices are new Vertex objects, so the copy is independent of the
+        base graph.
+        """
+        g = Graph()
+        vertices, edges = self._materialize()
+        for v in vertices.values():
+            v.degree = 0
+            g.addVertex(v)
+        for vid, endVertices in edges.items():
+            for w in endVertices:
+                g.addEdge(vid, w.id, label=self.edgeLabel(vid, w.id))
+        return g
+
+    # =========================================================================
+    def deleteEdge(self, sid:str, eid:str) -> bool:
+        raise Exception("A SubgraphView is read-only.")
+
+    # =========================================================================
+    def deleteVertex(self, vid:str) -> Vertex:
+        raise Exception("A SubgraphView is read-only.")
+
+    # =========================================================================
+    def edgeLabel(self, startVID:str, endVID:str):
+        """
+        Returns the label of the edge from startVID to endVID within this
+        view, or None.
+        """
+        if startVID not in self._ids or endVID not in self._ids:
+            return None
+        return self._base.edgeLabel(startVID, endVID)
+
+    # =========================================================================
+    def hasEdge(self, startVID:str, endVID:str) -> bool:
+        """
+        Checks to see if an edge exists between the given start and end vid
+        within this view.
+        """
+        return startVID in self._ids and endVID in self._ids and \
+            self._base.hasEdge(startVID, endVID)
+
+    # =========================================================================
+    def memoryUsage(self) -> dict:
+        """
+        Returns the memory used by the view itself (see Graph.memoryUsage()):
+        only its set of ids and the degrees and in-edges it has worked out.
+        The vertices and edges it looks at belong to the base graph.
+        """
+        indexes = sys.getsizeof(self._ids)
+        if self._degrees is not None:
+            indexes += sys.getsizeof(self._degrees)
+        if self._inEdges is not None:
+            indexes += sys.getsizeof(self._inEdges)
+            for startVIDs in self._inEdges.values():
+                indexes += sys.getsizeof(startVIDs)
+        return { 'vertices' : 0, 'labels' : 0, 'adjacency' : 0,
+                 'indexes' : indexes, 'total' : indexes }
+
+    # =========================================================================
+    def _degree(self, v:Vertex) -> int:
+        """
+        Returns the degree of Vertex v within this view.
+        """
+        if self._degrees is None or self._degreesVersion != self._version:
+            degrees = dict.fromkeys(self._vertices, 0)
+            for vid in degrees:
+                for w in self._edges[vid]:
+                    degrees[vid] += 1
+                    degrees[w.id] += 1
+            self._degrees = degrees
+            self._degreesVersion = self._version
+        return self._degrees[v.id]
+
+    # =========================================================================
+    def _edgeTargets(self, vid:str, label) -> set:
+        """
+        Same as Graph._edgeTargets(), keeping only the ends in this view.
+        """
+        if vid not in self._ids:
+            return Graph._NO_TARGETS
+        return set( w for w in self._base._edgeTargets(vid, label) if w in self._ids )
+
+    # =========================================================================
+    def _filterCandidates(self, u:Vertex, degree:int=None) -> list:
+        """
+        Same as Graph._filterCandidates(), but compares against the degrees
+        within this view.
+        """
+        if degree is None:
+            degree = u.degree
+        return [ v for v in self.vertices()
+                 if v.hasLabel(u.label) and self._degree(v) >= degree ]
+
+    # =========================================================================
+    def _inNeighbors(self) -> dict:
+        """
+        Same as Graph._inNeighbors(), for the edges within this view. Worked
+        out again after the base graph changes.
+        """
+        if self._inEdges is None or self._inEdgesVersion != self._version:
+            inEdges = { vid : [] for vid in self._vertices }
+            for vid in inEdges:
+                for w in self._edges[vid]:
+                    inEdges[w.id].append(vid)
+            self._inEdges = inEdges
+            self._inEdgesVersion = self._version
+        return self._inEdges
+
+# =============================================================================
+class _ViewVertices(Mapping):
+    """
+    Read-only vid->Vertex dictionary of the base graph's vertices whose ids
+    are in the view.
+    """
+
+    def __init__(self, base:Graph, ids:dict):
+        self._base = base
+        self._ids = ids
+
+    def __getitem__(self, vid:str) -> Vertex:
+        if vid not in self._ids:
+            raise KeyError(vid)
+        return self._base._vertices[vid]
+
+    def __iter__(self):
+        for vid in self._ids:
+            if vid in self._base._vertices:
+                yield vid
+
+    def __len__(self) -> int:
+        return sum(1 for vid in self)
+
+    def __contains__(self, vid:str) -> bool:
+        return vid in self._ids and vid in self._base._vertices
+
+# =============================================================================
+class _ViewEdges(Mapping):
+    """
+    Read-only vid->[Vertex] dictionary of the base graph's edges, keeping only
+    the vertices and edges in the view.
+    """
+
+    def __init__(self, base:Graph, ids:dict):
+        self._base = base
+        self._ids = ids
+
+    def __getitem__(self, vid:str) -> list:
+        if vid not in self._ids:
+            raise KeyError(vid)
+        return [ w for w in self._base._edges[vid] if w.id in self._ids ]
+
+    def __iter__(self):
+        for vid in self._ids:
+            if vid in self._base._vertices:
+                yield vid
+
+    def __len__(self) -> int:
+        return sum(1 for vid in self)
+
+    def __contains__(self, vid:str) -> bool:
+        return vid in self._ids and vid in self._base._vertices
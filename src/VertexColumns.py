@@ -0,0 +1,358 @@
+"""
+VertexColumns.py - Column store of vertex attributes for fast filtering.
+"""
+
+import sys
+from array import array
+
+try:
+    import numpy
+except ImportError:     # filtering falls back to plain Python
+    numpy = None
+
+from YapyGraph.src.Overlay import Overlay
+from YapyGraph.src.Vertex import Vertex
+
+class VertexColumns(object):
+    """
+    Keeps the attributes of a graph's vertices in parallel arrays, one row
+    per vertex: degree, in-degree, out-degree, a label bitmask and number.
+    Graph keeps the rows up to date as vertices and edges come and go (see
+    Graph.enableColumns()), and select() filters all the rows at once with
+    NumPy when it is installed.
+
+    Label bits: every distinct label seen gets a bit (mod 64). A query label
+    is turned into the mask of the bits of every label it matches under
+    Vertex.hasLabel(), so a row matches if it shares a bit with the mask.
+    With more than 64 distinct labels, bits are shared and matches are
+    checked again with hasLabel().
+
+    Numbers: rows hold the vertex number if it is an int, or NO_NUMBER.
+
+    The rows are kept in pages of PAGE_ROWS rows, so that copy() can share
+    them: a page is copied the first time one of the stores sharing it
+    changes it, and the row and label dictionaries are changed through an
+    Overlay. Deleted rows are only marked dead; the pages are compacted once
+    more than half of the rows are dead.
+    """
+
+    # Number column value for vertices whose number isn't an int.
+    NO_NUMBER = -2**63
+
+    # Rows per page.
+    PAGE_ROWS = 8192
+
+    # =========================================================================
+    def __init__(self):
+        """
+        Builds an empty column store.
+        """
+        # The pages of rows, each a _Page, and the number of rows in them.
+        self._pages = []
+        self._rows = 0
+
+        # The row of each (live) vertex id.
+        self._rowOf = {}
+
+        # Number of dead rows.
+        self._dead = 0
+
+        # The bit of every label seen. Keys are ('s', label) for vertices
+        # with a single string label and ('e', label) for each element of a
+        # list of labels, since hasLabel() treats the two differently.
+        self._bits = {}
+
+        # Query label masks already worked out, by Graph._labelKey().
+        self._masks = {}
+
+        # While the pages are shared with copies (see copy()), the indexes of
+        # the pages that belong to this store alone; any other page is
+        # copied before it is changed. None while all of them belong to it.
+        self._ownedPages = None
+
+        # Whether _rowOf and _bits are shared with a copy, so that they must
+        # be overlaid before they are changed.
+        self._sharedTables = False
+
+    # =========================================================================
+    def add(self, v:Vertex, inDegree:int=0, outDegree:int=0) -> None:
+        """
+        Adds a row for Vertex v.
+        """
+        if self._rows % VertexColumns.PAGE_ROWS == 0:
+            self._pages.append( _Page() )
+            if self._ownedPages is not None:
+                self._ownedPages.add( len(self._pages) - 1 )
+        page = self._writablePage( len(self._pages) - 1 )
+        self._writableRowOf()[v.id] = self._rows
+        self._rows += 1
+
+        page.vids.append(v.id)
+        page.degree.append(inDegree + outDegree)
+        page.inDegree.append(inDegree)
+        page.outDegree.append(outDegree)
+        page.labels.append(self._labelBits(v.label))
+        page.number.append(v.number if isinstance(v.number, int) and
+                           -2**63 < v.number < 2**63 else VertexColumns.NO_NUMBER)
+        page.alive.append(1)
+
+    # =========================================================================
+    def copy(self):
+        """
+        Returns a copy of this column store that shares its pages and
+        dictionaries until one of the two changes them. Costs as much as the
+        number of pages.
+        """
+        clone = VertexColumns()
+        clone._pages = list(self._pages)
+        clone._rows = self._rows
+        clone._rowOf = self._rowOf
+        clone._dead = self._dead
+        clone._bits = self._bits
+        for columns in ( self, clone ):
+            columns._ownedPages = set()
+            columns._sharedTables = True
+        return clone
+
+    # =========================================================================
+    def exact(self) -> bool:
+        """
+        Returns True if label masks match exactly (no more than 64 distinct
+        labels), so select() results need no further label checks.
+        """
+        return len(self._bits) <= 64
+
+    # =========================================================================
+    def link(self, uid:str, vid:str) -> None:
+        """
+        Records a new edge uid->vid.
+        """
+        page, row = self._writableRow(uid)
+        page.outDegree[row] += 1
+        page.degree[row] += 1
+        page, row = self._writableRow(vid)
+        page.inDegree[row] += 1
+        page.degree[row] += 1
+
+    # =========================================================================
+    def memoryUsage(self) -> int:
+        """
+        Returns an estimate of the bytes used by the column store, counting
+        pages shared with copies as well.
+        """
+        size = sys.getsizeof
+        table = lambda d: d.memoryUsage() if isinstance(d, Overlay) else size(d)
+        return sum( page.memoryUsage() for page in self._pages ) + size(self._pages) + \
+            table(self._rowOf) + table(self._bits) + size(self._masks)
+
+    # =========================================================================
+    def remove(self, vid:str) -> None:
+        """
+        Removes the row for the vertex with the given id.
+        """
+        page, row = self._writableRow(vid)
+        page.alive[row] = 0
+        del self._writableRowOf()[vid]
+        self._dead += 1
+        if self._dead > self._rows // 2:
+            self._compact()
+
+    # =========================================================================
+    def select(self, label:str or list=None, minDegree:int=0,
+               minInDegree:int=0, minOutDegree:int=0, number:int=None) -> list:
+        """
+        Returns the ids of the vertices whose rows pass every given test, in
+        row order. When there are more than 64 distinct labels, the label
+        test may let through vertices that don't have the label (see
+        exact()).
+
+        Inputs:
+            label - label (or list of labels) the vertex must match, or None
+            minDegree, minInDegree, minOutDegree - lower bounds on degrees
+            number - number the vertex must have, or None
+        Output: list of vertex ids
+        """
+        if self._rows == 0:
+            return []
+
+        mask = self._labelMask(label) if label is not None else None
+        if mask == 0:
+            return []
+        if number is not None and not isinstance(number, int):
+            return []
+
+        vids = []
+        for page in self._pages:
+            if numpy is not None:
+                keep = numpy.frombuffer(page.alive, dtype=numpy.int8) != 0
+                if mask is not None:
+                    keep &= (numpy.frombuffer(page.labels, dtype=numpy.uint64) &
+                             numpy.uint64(mask)) != 0
+                if minDegree > 0:
+                    keep &= numpy.frombuffer(page.degree, dtype=numpy.int64) >= minDegree
+                if minInDegree > 0:
+                    keep &= numpy.frombuffer(page.inDegree, dtype=numpy.int64) >= minInDegree
+                if minOutDegree > 0:
+                    keep &= numpy.frombuffer(page.outDegree, dtype=numpy.int64) >= minOutDegree
+                if number is not None:
+                    keep &= numpy.frombuffer(page.number, dtype=numpy.int64) == number
+                vids.extend( page.vids[row] for row in numpy.flatnonzero(keep).tolist() )
+            else:
+                vids.extend( page.vids[row] for row in range(len(page.vids))
+                             if page.alive[row]
+                             and (mask is None or page.labels[row] & mask)
+                             and page.degree[row] >= minDegree
+                             and page.inDegree[row] >= minInDegree
+                             and page.outDegree[row] >= minOutDegree
+                             and (number is None or page.number[row] == number) )
+        return vids
+
+    # =========================================================================
+    def unlink(self, uid:str, vid:str) -> None:
+        """
+        Records the removal of the edge uid->vid.
+        """
+        page, row = self._writableRow(uid)
+        page.outDegree[row] -= 1
+        page.degree[row] -= 1
+        page, row = self._writableRow(vid)
+        page.inDegree[row] -= 1
+        page.degree[row] -= 1
+
+    # =========================================================================
+    def _compact(self) -> None:
+        """
+        Drops the dead rows, keeping the live ones in order. The new pages
+        and row dictionary belong to this store alone.
+        """
+        pages = []
+        rowOf = {}
+        for page in self._pages:
+            for row in range(len(page.vids)):
+                if page.alive[row]:
+                    if len(rowOf) % VertexColumns.PAGE_ROWS == 0:
+                        pages.append( _Page() )
+                    pages[-1].appendRow(page, row)
+                    rowOf[page.vids[row]] = len(rowOf)
+        self._writableTables()
+        self._pages = pages
+        self._rows = len(rowOf)
+        self._rowOf = rowOf
+        self._dead = 0
+        self._ownedPages = None
+
+    # =========================================================================
+    def _labelBits(self, label:str or list) -> int:
+        """
+        Returns the label bitmask of a vertex with the given label, giving
+        new labels a bit.
+        """
+        if label is None:
+            return 0
+        keys = [ ('s', label) ] if isinstance(label, str) else [ ('e', l) for l in label ]
+
+        mask = 0
+        for key in keys:
+            if key not in self._bits:
+                self._writableTables()
+                self._bits[key] = len(self._bits) % 64
+                self._bits = Overlay.settle(self._bits)
+                self._masks.clear()     # query masks may need the new bit
+            mask |= 1 << self._bits[key]
+        return mask
+
+    # =========================================================================
+    def _labelMask(self, label:str or list) -> int:
+        """
+        Returns the mask of the bits of every known label that a query vertex
+        with the given label matches.
+        """
+        key = label if isinstance(label, str) else tuple(label)
+        if key not in self._masks:
+            mask = 0
+            for (kind, known), bit in self._bits.items():
+                probe = Vertex(None, known if kind == 's' else [ known ])
+                if probe.hasLabel(label):
+                    mask |= 1 << bit
+            self._masks[key] = mask
+        return self._masks[key]
+
+    # =========================================================================
+    def _writablePage(self, index:int):
+        """
+        Returns the page with the given index, first replacing it with a copy
+        of its own if it is shared with a copy of the store.
+        """
+        page = self._pages[index]
+        if self._ownedPages is not None and index not in self._ownedPages:
+            page = self._pages[index] = page.copy()
+            self._ownedPages.add(index)
+        return page
+
+    # =========================================================================
+    def _writableRow(self, vid:str) -> tuple:
+        """
+        Returns the (page, row in the page) of the vertex with the given id,
+        with the page made writable by _writablePage().
+        """
+        index, row = divmod(self._rowOf[vid], VertexColumns.PAGE_ROWS)
+        return self._writablePage(index), row
+
+    # =========================================================================
+    def _writableRowOf(self) -> dict:
+        """
+        Returns the row dictionary, ready to be changed (see
+        _writableTables()), and flattened if its overlay has grown large.
+        """
+        self._writableTables()
+        self._rowOf = Overlay.settle(self._rowOf)
+        return self._rowOf
+
+    # =========================================================================
+    def _writableTables(self) -> None:
+        """
+        Gives this store overlays of its own of the row dictionary and the
+        label bits, if they are shared with a copy of the store.
+        """
+        if self._sharedTables:
+            self._rowOf = Overlay.over(self._rowOf)
+            self._bits = Overlay.over(self._bits)
+            self._sharedTables = False
+
+# =============================================================================
+class _Page(object):
+    """
+    Up to VertexColumns.PAGE_ROWS rows of a column store: one array per
+    column, and the vertex id of each row.
+    """
+
+    # The names of the array attributes.
+    COLUMNS = ( 'degree', 'inDegree', 'outDegree', 'labels', 'number', 'alive' )
+
+    def __init__(self):
+        self.degree    = array('q')
+        self.inDegree  = array('q')
+        self.outDegree = array('q')
+        self.labels    = array('Q')
+        self.number    = array('q')
+        self.alive     = array('b')
+        self.vids = []
+
+    def appendRow(self, page, row:int) -> None:
+        """
+        Appends a copy of a row of another page.
+        """
+        for name in _Page.COLUMNS:
+            getattr(self, name).append( getattr(page, name)[row] )
+        self.vids.append(page.vids[row])
+
+    def copy(self):
+        copy = _Page()
+        for name in _Page.COLUMNS:
+            setattr(copy, name, getattr(self, name)[:])
+        copy.vids = list(self.vids)
+        return copy
+
+    def memoryUsage(self) -> int:
+        return sum( sys.getsizeof(getattr(self, name)) for name in _Page.COLUMNS ) + \
+            sys.getsizeof(self.vids)
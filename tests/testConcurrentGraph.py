@@ -0,0 +1,101 @@
+import threading
+import unittest
+
+from src.ConcurrentGraph import ConcurrentGraph
+from src.Graph import Graph
+from src.Vertex import Vertex
+
+class TestConcurrentGraphClass(unittest.TestCase):
+
+    # =========================================================================
+    def setUp(self):
+        # Query: A -> B
+        self.q = Graph()
+        self.q.addEdge( Vertex('q1', 'A'), Vertex('q2', 'B') )
+
+        self.cg = ConcurrentGraph()
+        self.cg.addEdge( Vertex('a0', 'A'), Vertex('b0', 'B') )
+        self.cg.commit()
+
+    # =========================================================================
+    def testSnapshotIsolation(self):
+        before = self.cg.snapshot()
+
+        # Changes aren't seen until they're committed.
+        self.cg.addEdge( Vertex('a1', 'A'), Vertex('b1', 'B') )
+        self.assertEqual( len(self.cg.search(self.q)), 1 )
+        self.cg.commit()
+        self.assertEqual( len(self.cg.search(self.q)), 2 )
+
+        # The old snapshot is unchanged, and older than the new one.
+        self.assertEqual( before.numVertices(), 2 )
+        self.assertEqual( len(before.search(self.q)), 1 )
+        self.assertLess( before._version, self.cg.snapshot()._version )
+
+        # abort() throws changes away.
+        self.cg.deleteVertex('a0')
+        self.cg.abort()
+        self.assertEqual( len(self.cg.search(self.q)), 2 )
+
+    # =========================================================================
+    def testWriter(self):
+        with self.cg.writer() as g:
+            g.addEdge( Vertex('a1', 'A'), Vertex('b1', 'B') )
+            g.deleteEdge('a0', 'b0')
+        self.assertEqual( [ M['q1'] for M in self.cg.search(self.q) ], ['a1'] )
+
+        with self.assertRaises(ValueError):
+            with self.cg.writer() as g:
+                g.deleteVertex('a1')
+                raise ValueError()
+        self.assertEqual( len(self.cg.search(self.q)), 1 )
+
+    # =========================================================================
+    def testSearchCache(self):
+        self.cg.enableSearchCache()
+        self.cg.search(self.q)
+        self.assertEqual( self.cg.search(self.q), [ {'q1':'a0', 'q2':'b0'} ] )
+        self.assertEqual( self.cg.searchCacheStats()['hits'], 1 )
+
+        # A change the query can't see keeps the result cached...
+        self.cg.addVertex( Vertex('c0', 'C') )
+        self.cg.commit()
+        self.cg.search(self.q)
+        self.assertEqual( self.cg.searchCacheStats()['hits'], 2 )
+
+        # ...but one it can see doesn't.
+        self.cg.addEdge( Vertex('a1', 'A'), 'b0' )
+        self.cg.commit()
+        self.assertEqual( len(self.cg.search(self.q)), 2 )
+        self.assertEqual( self.cg.searchCacheStats()['hits'], 2 )
+
+    # =========================================================================
+    def testThreads(self):
+        # A writer adds A->B pairs in batches while readers search. Every
+        # search must see a whole number of committed batches.
+        errors = []
+        done = threading.Event()
+
+        def write():
+            for i in range(1, 31):
+                with self.cg.writer() as g:
+                    g.addEdge( Vertex('a%d' % i, 'A'), Vertex('b%d' % i, 'B') )
+                    g.addEdge( Vertex('x%d' % i, 'A'), Vertex('y%d' % i, 'B') )
+            done.set()
+
+        def read():
+            while not done.is_set():
+                snapshot = self.cg.snapshot()
+                n = len(snapshot.search(self.q))
+                if n != snapshot.numVertices() // 2 or n % 2 != 1:
+                    errors.append(n)
+
+        threads = [ threading.Thread(target=read) for i in range(4) ]
+        threads.append( threading.Thread(target=write) )
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+
+        self.assertEqual( errors, [] )
+        self.assertEqual( len(self.cg.search(self.q)), 61 )
@@ -1,3 +1,5 @@
+import random
+import time
 import unittest
 
 from src.Graph import Graph
@@ -112,6 +114,221 @@ class TestGraphClass(unittest.TestCase):
         # self.assertTrue(u12 in self.g._neighbors['u11'])  # u1 and u2 are neighbors?
         # self.assertTrue(u11 in self.g._neighbors['u12'])  # u2 and u1 are neighbors?
 
+    # =========================================================================
+    def testBfsDfs(self):
+        # v1 -> v2 -> v4, v1 -> v3 -> v4, v5 -> v1
+        self.g.addEdge( Vertex('v1', 'A'), Vertex('v2', 'B') )
+        self.g.addEdge( 'v1', Vertex('v3', 'C') )
+        self.g.addEdge( 'v2', Vertex('v4', 'D') )
+        self.g.addEdge( 'v3', 'v4' )
+        self.g.addEdge( Vertex('v5', 'E'), 'v1' )
+
+        ids = lambda vertices: [ v.id for v in vertices ]
+        self.assertEqual( ids(self.g.bfs('v1')), ['v1', 'v2', 'v3', 'v4'] )
+        self.assertEqual( ids(self.g.bfs('v1', maxDepth=1)), ['v1', 'v2', 'v3'] )
+        self.assertEqual( ids(self.g.bfs('v4', 'in')), ['v4', 'v2', 'v3', 'v1', 'v5'] )
+        self.assertEqual( ids(self.g.dfs('v1')), ['v1', 'v2', 'v4', 'v3'] )
+        self.assertEqual( ids(self.g.dfs('v2', 'both')), ['v2', 'v4', 'v3', 'v1', 'v5'] )
+
+        self.assertEqual( ids(self.g.kHopNeighborhood('v2', 1)), ['v2', 'v4', 'v1'] )
+        self.assertEqual( ids(self.g.kHopNeighborhood('v2', 1, 'out')), ['v2', 'v4'] )
+        self.assertEqual( len(self.g.kHopNeighborhood('v2', 0)), 1 )
+
+        with self.assertRaises(Exception):
+            list(self.g.bfs('XX'))
+        with self.assertRaises(Exception):
+            list(self.g.dfs('v1', 'sideways'))
+
+        # Deep graphs don't hit the recursion limit.
+        g = Graph()
+        g.addVertex( Vertex('c0') )
+        for i in range(1, 5000):
+            g.addEdge( 'c%d' % (i-1), Vertex('c%d' % i) )
+        self.assertEqual( len(list(g.dfs('c0'))), 5000 )
+        self.assertEqual( len(g.stronglyConnectedComponents()), 5000 )
+
+    # =========================================================================
+    def testCanonicalForm(self):
+        # The empty graph.
+        self.assertEqual( self.g.canonicalForm(), ( (), () ) )
+
+        # q2 built again with other ids, in another order.
+        q = Graph()
+        q.addVertex( Vertex('x4', 'A') )
+        q.addVertex( Vertex('x3', 'C') )
+        q.addVertex( Vertex('x2', 'B') )
+        q.addVertex( Vertex('x1', 'A') )
+        q.addEdge('x3', 'x2', True)
+        q.addEdge('x2', 'x4', True)
+        q.addEdge('x4', 'x1', True)
+        q.addEdge('x2', 'x1', True)
+        self.assertEqual( q.canonicalForm(), self.q2.canonicalForm() )
+        self.assertEqual( q.wlHash(), self.q2.wlHash() )
+
+        # Directions count: A -> B -> C is not A <- B -> C.
+        q1 = Graph()
+        q1.addEdge( Vertex('x1', 'A'), Vertex('x2', 'B') )
+        q1.addEdge( 'x2', Vertex('x3', 'C') )
+        q2 = Graph()
+        q2.addEdge( Vertex('x2', 'B'), Vertex('x1', 'A') )
+        q2.addEdge( 'x2', Vertex('x3', 'C') )
+        self.assertNotEqual( q1.canonicalForm(), q2.canonicalForm() )
+
+        # So do labels, but a list of labels is a set.
+        q1 = Graph()
+        q1.addEdge( Vertex('x1', ['A', 'B']), Vertex('x2', 'C') )
+        q2 = Graph()
+        q2.addEdge( Vertex('y1', ['B', 'A']), Vertex('y2', 'C') )
+        self.assertEqual( q1.canonicalForm(), q2.canonicalForm() )
+        q2._vertices['y2'].label = 'D'
+        self.assertNotEqual( q1.canonicalForm(), q2.canonicalForm() )
+
+        # Two directed 3-cycles vs a directed 6-cycle: colour refinement
+        # alone can't tell them apart, individualization can.
+        q1 = Graph()
+        q2 = Graph()
+        for i in range(6):
+            q1.addVertex( Vertex('v%d' % i, 'A') )
+            q2.addVertex( Vertex('v%d' % i, 'A') )
+        for i in range(6):
+            q1.addEdge( 'v%d' % i, 'v%d' % (3 * (i // 3) + (i + 1) % 3) )
+            q2.addEdge( 'v%d' % i, 'v%d' % ((i + 1) % 6) )
+        self.assertEqual( q1.wlHash(), q2.wlHash() )
+        self.assertNotEqual( q1.canonicalForm(), q2.canonicalForm() )
+
+        # Highly symmetric graphs stay quick.
+        q = Graph()
+        for i in range(30):
+            q.addVertex( Vertex('v%d' % i, 'A') )
+        self.assertEqual( q.canonicalForm(), ( (('A',),) * 30, () ) )
+
+        # So do vertex-transitive ones, thanks to the automorphisms found
+        # along the way: the 5-cube, and the same with its ids shuffled.
+        rng = random.Random(5)
+        ids = [ 'v%d' % i for i in range(32) ]
+        shuffled = ids[:]
+        rng.shuffle(shuffled)
+        cubes = []
+        for names in ( ids, shuffled ):
+            q = Graph()
+            for name in names:
+                q.addVertex( Vertex(name, 'A') )
+            for i in range(32):
+                for k in range(5):
+                    if i < i ^ (1 << k):
+                        q.addEdge( names[i], names[i ^ (1 << k)], True )
+            cubes.append(q)
+        start = time.perf_counter()
+        self.assertEqual( cubes[0].canonicalForm(), cubes[1].canonicalForm() )
+        self.assertLess( time.perf_counter() - start, 2.0 )
+
+    # =========================================================================
+    def testComponents(self):
+        # v1 <-> v2 -> v3 -> v4 -> v3, and v5 alone
+        self.g.addEdge( Vertex('v1', 'A'), Vertex('v2', 'B'), True )
+        self.g.addEdge( 'v2', Vertex('v3', 'C') )
+        self.g.addEdge( 'v3', Vertex('v4', 'D'), True )
+        self.g.addVertex( Vertex('v5', 'E') )
+
+        self.assertEqual( self.g.weaklyConnectedComponents(),
+                          [ ['v1', 'v2', 'v3', 'v4'], ['v5'] ] )
+        self.assertEqual( [ sorted(c) for c in self.g.stronglyConnectedComponents() ],
+                          [ ['v3', 'v4'], ['v1', 'v2'], ['v5'] ] )
+        self.assertEqual( Graph().weaklyConnectedComponents(), [] )
+
+        # Components follow changes. Removing an edge drops the component
+        # index search() uses until the components are worked out again;
+        # adding vertices and edges keeps it up to date.
+        self.g.deleteEdge('v2', 'v3')
+        self.assertIsNone( self.g._componentParent )
+        self.assertEqual( len(self.g.weaklyConnectedComponents()), 3 )
+
+        # Search leaves out candidates in components too small for a
+        # connected query.
+        q = Graph()
+        q.addEdge( Vertex('u1', 'A'), Vertex('u2', 'B') )
+        q.addEdge( Vertex('u3', 'C'), 'u1' )
+        self.g.addEdge( Vertex('v6', 'C'), Vertex('v7', 'A') )
+        self.g.addEdge( 'v7', Vertex('v8', 'B') )
+        self.assertEqual( self.g._componentSize[self.g._componentRoot('v8')], 3 )
+        C = self.g._pruneByComponent(q, self.g._findCandidates(q))
+        self.assertEqual( [ v.id for v in C['u1'] ], ['v7'] )
+        self.assertEqual( self.g.search(q), [ {'u1':'v7', 'u2':'v8', 'u3':'v6'} ] )
+
+    # =========================================================================
+    def testCopy(self):
+        before = repr(self.g2)
+        v1 = self.g2._vertices['v1']
+
+        # Copies share storage until they are written.
+        c1 = self.g2.copy()
+        c2 = self.g2.copy()
+        self.assertIs( c1._vertices, self.g2._vertices )
+        self.assertEqual( repr(c1), before )
+        self.assertEqual( c1.search(self.q2), self.g2.search(self.q2) )
+
+        # Writing to a copy only changes that copy.
+        c1.deleteVertex('v9')
+        self.assertEqual( c1.numVertices(), 8 )
+        self.assertEqual( repr(self.g2), before )
+        self.assertEqual( c1._vertices['v5'].degree, 8 )
+        self.assertEqual( self.g2._vertices['v5'].degree, 10 )
+        self.assertIs( c2._vertices, self.g2._vertices )
+
+        # Writing to the original works the same way: it gets its own copies
+        # of the vertices it changes, and the other copy keeps the old ones.
+        self.g2.addEdge('v1', 'v9')
+        self.assertIsNot( self.g2._vertices['v1'], v1 )
+        self.assertEqual( self.g2._vertices['v1'].degree, 3 )
+        self.assertIs( c2._vertices['v1'], v1 )
+        self.assertEqual( v1.degree, 2 )
+        self.assertIs( c2._vertices['v2'], self.g2._vertices['v2'] )
+        self.assertEqual( repr(c2), before )
+        self.assertFalse( c2.hasEdge('v1', 'v9') )
+
+        # Every edge list holds its own graph's Vertex objects.
+        for g in ( self.g2, c1, c2 ):
+            for endVertices in g._edges.values():
+                for w in endVertices:
+                    self.assertIs( w, g._vertices[w.id] )
+
+        # Changes are undone without touching the other graphs.
+        with self.assertRaises(KeyError):
+            with c2.transaction():
+                c2.deleteVertex('v5')
+                c2.addEdge('v1', 'XX')
+        self.assertEqual( sorted(repr(c2).splitlines()), sorted(before.splitlines()) )
+        self.assertEqual( c1._vertices['v5'].degree, 8 )
+
+        # A small change to a copy of a large graph copies only what it
+        # touches.
+        g = Graph()
+        g.addVertex( Vertex('c0', 'A') )
+        for i in range(1, 10000):
+            g.addEdge( 'c%d' % (i-1), Vertex('c%d' % i, 'A'), label='x' )
+        c = g.copy()
+        c.addEdge( 'c5000', Vertex('new', 'B'), label='y' )
+        c.deleteEdge( 'c10', 'c11' )
+        self.assertEqual( sorted(c._vertices.changes), ['c10', 'c11', 'c5000', 'new'] )
+        self.assertLessEqual( len(c._edges.changes), 5 )
+        self.assertLessEqual( c._outEdgeIndex.delta(), 3 )
+        self.assertEqual( (g.numVertices(), c.numVertices()), (10000, 10001) )
+        self.assertTrue( g.hasEdge('c10', 'c11') )
+        self.assertEqual( g._vertices['c5000'].degree, 2 )
+        self.assertEqual( c._vertices['c5000'].degree, 3 )
+
+        # Once the other graphs are gone, the changes go into the shared
+        # dictionaries and the copy owns everything again.
+        del g
+        c.deleteVertex('new')
+        self.assertIs( type(c._vertices), dict )
+        self.assertIsNone( c._ownedVertices )
+        self.assertEqual( c.numVertices(), 10000 )
+
+        # Copies can't be made during a transaction.
+        with self.g2.transaction():
+            self.assertRaises( Exception, self.g2.copy )
+
     # =========================================================================
     def testDeleteEdge(self):
         # Referencing non-existing vertices should return False
@@ -171,6 +388,63 @@ class TestGraphClass(unittest.TestCase):
         # u1 isn't a vertex anymore.
         self.assertTrue('u1' not in self.g._vertices)
 
+        # Every edge to and from a vertex goes, and the neighbors' degrees
+        # follow.
+        self.g2.deleteVertex('v5')
+        self.assertEqual(self.g2._vertices['v9'].degree, 0)
+        self.assertEqual(self.g2._vertices['v2'].degree, 2)
+
+        # The in-edges kept along with the edges follow too.
+        self.assertTrue(all('v5' not in startVIDs for startVIDs in self.g2._inNeighbors().values()))
+        self.assertEqual(sorted(self.g2._inNeighbors()['v4']), ['v1', 'v2', 'v8'])
+
+    # =========================================================================
+    def testEdgeLabels(self):
+        # v1 -knows-> v2 -likes-> v3, v1 -> v3 (unlabelled)
+        self.g.addEdge( Vertex('v1', 'A'), Vertex('v2', 'A'), label='knows' )
+        self.g.addEdge( 'v2', Vertex('v3', 'A'), label='likes' )
+        self.g.addEdge( 'v1', 'v3' )
+        self.assertEqual( self.g.edgeLabel('v1', 'v2'), 'knows' )
+        self.assertIsNone( self.g.edgeLabel('v1', 'v3') )
+        self.assertIsNone( self.g.edgeLabel('v2', 'v1') )
+        self.assertEqual( self.g._edgeTargets('v1', 'knows'), {'v2'} )
+        self.assertEqual( repr(self.g).count('[label="knows"]'), 1 )
+
+        # Adding an edge that is already there changes nothing.
+        self.g.addEdge( 'v1', 'v2', label='likes' )
+        self.assertEqual( self.g.edgeLabel('v1', 'v2'), 'knows' )
+
+        # Labelled query edges only match edges with the same label;
+        # unlabelled ones match any edge.
+        q = Graph()
+        q.addEdge( Vertex('u1', 'A'), Vertex('u2', 'A'), label='knows' )
+        self.assertEqual( self.g.search(q), [ {'u1':'v1', 'u2':'v2'} ] )
+        q2 = Graph()
+        q2.addEdge( Vertex('u1', 'A'), Vertex('u2', 'A') )
+        self.assertEqual( len(self.g.search(q2)), 3 )
+        self.assertEqual( self.g.searchMany([q, q2]), [ self.g.search(q), self.g.search(q2) ] )
+
+        # Labels tell otherwise isomorphic graphs apart.
+        q3 = Graph()
+        q3.addEdge( Vertex('w1', 'A'), Vertex('w2', 'A'), label='likes' )
+        self.assertNotEqual( q.canonicalForm(), q3.canonicalForm() )
+        self.assertNotEqual( q.wlHash(), q3.wlHash() )
+        self.assertNotEqual( q.canonicalForm(), q2.canonicalForm() )
+
+        # Copies don't share labels, and deleting an edge drops its label,
+        # also when a transaction is rolled back.
+        c = self.g.copy()
+        self.g.deleteEdge('v1', 'v2')
+        self.assertEqual( self.g._edgeTargets('v1', 'knows'), set() )
+        self.assertEqual( c.edgeLabel('v1', 'v2'), 'knows' )
+        with self.assertRaises(ValueError):
+            with c.transaction():
+                c.deleteEdge('v2', 'v3')
+                raise ValueError()
+        self.assertEqual( c.edgeLabel('v2', 'v3'), 'likes' )
+        self.assertEqual( c.search(q), [ {'u1':'v1', 'u2':'v2'} ] )
+        self.assertEqual( self.g.search(q), [] )
+
     # =========================================================================
     def testEdgesProperty(self):
         # Build u1->u2, u2->u3
@@ -242,6 +516,357 @@ class TestGraphClass(unittest.TestCase):
         self.g.addEdge('u1', Vertex('u4', 'D'))
         self.assertEquals(self.g.__repr__(), 'digraph {\n"u1,A,"->"u2,B,";\n"u1,A,"->"u4,D,";\n"u2,B,"->"u3,C,";\n\n}')
 
+    # =========================================================================
+    def testMemoryUsage(self):
+        empty = self.g.memoryUsage()
+        self.assertEqual( sorted(empty), ['adjacency', 'indexes', 'labels', 'total', 'vertices'] )
+
+        for i in range(100):
+            self.g.addVertex( Vertex('v%d' % i, ['A', 'B%d' % i], i) )
+        vertices = self.g.memoryUsage()
+        for i in range(99):
+            self.g.addEdge( 'v%d' % i, 'v%d' % (i+1) )
+        usage = self.g.memoryUsage()
+
+        self.assertGreater( vertices['vertices'], empty['vertices'] + 100 * Graph._measureVertex() )
+        self.assertGreater( vertices['labels'], empty['labels'] )
+        self.assertGreater( usage['adjacency'], vertices['adjacency'] )
+        self.assertGreater( usage['indexes'], vertices['indexes'] )     # in-edges
+        self.assertEqual( usage['total'], sum( usage[key] for key in usage if key != 'total' ) )
+
+        # Indexes count the column store, and views only count themselves.
+        self.g.enableColumns()
+        self.assertGreater( self.g.memoryUsage()['indexes'], usage['indexes'] )
+        view = self.g.subgraph( [ 'v1', 'v2' ] )
+        self.assertLess( view.memoryUsage()['total'], 1000 )
+
+        # A changed copy counts the storage it shares as well as its changes.
+        c = self.g.copy()
+        c.addVertex( Vertex('new', 'A') )
+        self.assertGreater( c.memoryUsage()['adjacency'], usage['adjacency'] )
+
+    # =========================================================================
+    def testSampleMatch(self):
+        rng = random.Random(1)
+
+        # Nothing to find in an empty data graph, or with an empty query.
+        self.assertIsNone( self.g.sampleMatch(self.q2, rng) )
+        self.assertIsNone( self.g2.sampleMatch(self.q, rng) )
+
+        # A query with no instances.
+        q = Graph()
+        q.addEdge( Vertex('x1', 'C'), Vertex('x2', 'E') )
+        self.assertIsNone( self.g2.sampleMatch(q, rng) )
+
+        # A query whose vertices all have candidates, but no instances.
+        q5 = Graph()
+        q5.addEdge( Vertex('x1', 'A'), Vertex('x2', 'C'), True )
+        self.assertIsNone( self.g2.sampleMatch(q5, rng) )
+
+        # Every sample must be one of the two solutions, and both should
+        # show up over enough samples.
+        solutions = self.g2.search(self.q2)
+        seen = []
+        for M in self.g2.sampleMatches(self.q2, 50, rng):
+            self.assertIn(M, solutions)
+            if M not in seen:
+                seen.append(M)
+        self.assertEqual( len(seen), 2 )
+
+        # With no random walks allowed, there is no sample to give, unless
+        # the backtracking fallback is asked for, which says so.
+        with self.assertRaises(Exception):
+            self.g2.sampleMatch(self.q2, rng, tries=0)
+        with self.assertLogs(level='WARNING'):
+            self.assertIn( self.g2.sampleMatch(self.q2, rng, tries=0, fallback=True),
+                           solutions )
+
+        # Asking for several samples of something that isn't there.
+        self.assertEqual( self.g2.sampleMatches(q, 3, rng), [] )
+
+    # =========================================================================
+    def hubGraph(self, numVertices:int, numEdges:int, hubEdges:int, seed:int) -> Graph:
+        """
+        Returns a random graph whose vertex v0 is a hub with about hubEdges
+        edges, in and out.
+        """
+        rng = random.Random(seed)
+        g = Graph()
+        for i in range(numVertices):
+            g.addVertex( Vertex('v%d' % i, 'A') )
+        ends = [ (rng.randrange(numVertices), rng.randrange(numVertices))
+                 for i in range(numEdges) ]
+        ends += [ (0, rng.randrange(numVertices)) if i % 2 else (rng.randrange(numVertices), 0)
+                  for i in range(hubEdges) ]
+        for a, b in ends:
+            if a != b and not g.hasEdge('v%d' % a, 'v%d' % b):
+                g.addEdge( 'v%d' % a, 'v%d' % b )
+        return g
+
+    # =========================================================================
+    def testSampleMatchHub(self):
+        q = Graph()
+        q.addEdge( Vertex('a', 'A'), Vertex('b', 'A') )
+        q.addEdge( 'b', Vertex('c', 'A') )
+
+        # Every instance is drawn about as often, with or without the hub in
+        # it: the chi-squared statistic has a mean of one less than the number
+        # of instances, and a standard deviation of about the square root of
+        # twice that.
+        g = self.hubGraph(40, 60, 20, 4)
+        solutions = [ tuple(sorted(M.items())) for M in g.search(q) ]
+        self.assertGreater( len(solutions), 100 )
+        rng = random.Random(1)
+        expected = 5
+        counts = dict.fromkeys(solutions, 0)
+        for M in g.sampleMatches(q, expected * len(solutions), rng):
+            counts[tuple(sorted(M.items()))] += 1
+        chi2 = sum( (n - expected)**2 / expected for n in counts.values() )
+        df = len(solutions) - 1
+        self.assertLess( chi2, df + 5 * (2 * df)**0.5 )
+
+        # A hub with half of the edges of a larger graph doesn't keep the
+        # walks from completing.
+        g = self.hubGraph(3000, 4500, 1500, 1)
+        q.addEdge( 'c', Vertex('d', 'A') )
+        C = g._findCandidates(q)
+        plan = g._samplePlan(q, C)
+        completed = sum( 1 for i in range(200)
+                         if g._sampleWalk(q, C, plan, rng)[0] is not None )
+        self.assertGreater( completed, 100 )
+        for M in g.sampleMatches(q, 10, rng):
+            self.assertTrue( g.hasEdge(M['a'], M['b']) and g.hasEdge(M['b'], M['c'])
+                             and g.hasEdge(M['c'], M['d']) )
+
+    # =========================================================================
+    def testSelectVertices(self):
+        # Without and with the column store, including after changes.
+        for columns in ( False, True ):
+            g = self.g2.copy()
+            if columns:
+                g.enableColumns()
+            ids = lambda vertices: [ v.id for v in vertices ]
+            self.assertEqual( ids(g.selectVertices('B', minOutDegree=3)), ['v5'] )
+            self.assertEqual( ids(g.selectVertices('C')), ['v7', 'v9'] )
+            self.assertEqual( ids(g.selectVertices(minInDegree=4)), ['v4', 'v5'] )
+
+            g.addEdge( Vertex('v10', 'B', 10), 'v4' )
+            g.addEdge( 'v10', 'v1' )
+            g.addEdge( 'v10', 'v9' )
+            g.deleteVertex('v2')
+            self.assertEqual( ids(g.selectVertices('B', minOutDegree=3)), ['v5', 'v10'] )
+            self.assertEqual( ids(g.selectVertices(number=10)), ['v10'] )
+            with g.transaction():
+                g.deleteVertex('v10')
+                g.rollback()
+            self.assertEqual( ids(g.selectVertices('B', minOutDegree=3)), ['v5', 'v10'] )
+
+            # Searches give the same answers.
+            self.assertEqual( g.search(self.q2), self.g2.search(self.q2) )
+            self.assertEqual( g.searchMany([self.q2])[0], self.g2.search(self.q2) )
+
+            # Copies keep the column store, and changing them doesn't change
+            # the original's.
+            c = g.copy()
+            self.assertEqual( c._columns is not None, columns )
+            c.deleteVertex('v10')
+            self.assertEqual( ids(c.selectVertices('B', minOutDegree=3)), ['v5'] )
+            self.assertEqual( ids(g.selectVertices('B', minOutDegree=3)), ['v5', 'v10'] )
+
+    # =========================================================================
+    def testSearchCache(self):
+        self.assertIsNone( self.g2.searchCacheStats() )
+        self.g2.enableSearchCache()
+
+        # The second search is answered from the cache.
+        first = self.g2.search(self.q2)
+        self.assertEqual( self.g2.search(self.q2), first )
+        self.assertEqual( self.g2.searchCacheStats()['hits'], 1 )
+        self.assertEqual( self.g2.searchCacheStats()['misses'], 1 )
+        self.assertEqual( self.g2.searchCacheStats()['entries'], 1 )
+
+        # Changing the result doesn't change the cache.
+        self.g2.search(self.q2).pop()
+        self.assertEqual( self.g2.search(self.q2), first )
+
+        # Every change bumps the version.
+        version = self.g2._version
+        self.g2.addVertex( Vertex('v10', 'E') )
+        self.g2.addEdge('v10', Vertex('v11', 'F'))
+        self.g2.deleteEdge('v10', 'v11')
+        self.g2.deleteVertex('v11')
+        self.assertEqual( self.g2._version, version + 5 )
+
+        # None of those vertices can match q2 (labels A, B, C), so the
+        # cached result is still used, and stamped with the new version so
+        # the same changes aren't checked again.
+        hits = self.g2.searchCacheStats()['hits']
+        self.assertEqual( self.g2.search(self.q2), first )
+        self.assertEqual( self.g2.searchCacheStats()['hits'], hits + 1 )
+        self.assertEqual( [ entry[0] for entry in self.g2._searchCache._entries.values() ],
+                          [ self.g2._version ] )
+
+        # A change to a vertex q2 could match makes the result stale.
+        self.g2.deleteEdge('v5', 'v9')
+        self.assertEqual( len(self.g2.search(self.q2)), 0 )
+        self.assertEqual( self.g2.searchCacheStats()['hits'], hits + 1 )
+
+        # Rolling back is a change too.
+        with self.g2.transaction():
+            self.g2.addEdge('v5', 'v9')
+            self.assertEqual( len(self.g2.search(self.q2)), 2 )
+            self.g2.rollback()
+            self.assertEqual( len(self.g2.search(self.q2)), 0 )
+
+        # A different query with the same ids is a different entry.
+        q = Graph()
+        q.addVertex( Vertex('u1', 'B') )
+        self.assertEqual( len(self.g2.search(q)), 4 )
+
+        self.g2.disableSearchCache()
+        self.assertIsNone( self.g2.searchCacheStats() )
+
+    # =========================================================================
+    def testLabelVersions(self):
+        # Only the latest changed labels are kept. Results from before a
+        # dropped change count as stale, even for queries it can't touch.
+        limit = Graph._LABEL_VERSIONS
+        Graph._LABEL_VERSIONS = 3
+        try:
+            self.g2.enableSearchCache()
+            self.g2.search(self.q2)
+            for label in ( 'D', 'E', 'F', 'G' ):
+                self.g2.addVertex( Vertex('v' + label, label) )
+            self.assertEqual( list(self.g2._labelVersions), [ 'E', 'F', 'G' ] )
+            self.assertEqual( len(self.g2.search(self.q2)), 2 )
+            self.assertEqual( self.g2.searchCacheStats()['hits'], 0 )
+
+            # Results from after it are still used. Deleted vertices' labels
+            # age out too.
+            self.g2.deleteVertex('vE')
+            self.g2.addVertex( Vertex('vH', 'H') )
+            self.assertEqual( list(self.g2._labelVersions), [ 'G', 'E', 'H' ] )
+            self.assertEqual( len(self.g2.search(self.q2)), 2 )
+            self.assertEqual( self.g2.searchCacheStats()['hits'], 1 )
+        finally:
+            Graph._LABEL_VERSIONS = limit
+
+    # =========================================================================
+    def testSearchMany(self):
+        # No queries, no results.
+        self.assertEqual( self.g2.searchMany([]), [] )
+
+        # A -> B, which shares its first two steps with q2.
+        q3 = Graph()
+        q3.addVertex( Vertex('x1', 'A') )
+        q3.addVertex( Vertex('x2', 'B') )
+        q3.addEdge('x1', 'x2', True)
+
+        # B -> C, which shares nothing with the others.
+        q4 = Graph()
+        q4.addEdge( Vertex('y1', 'B'), Vertex('y2', 'C') )
+
+        # Every query should get exactly what search() would give it,
+        # including the empty query graph.
+        queries = [ self.q2, q3, self.q, q4, self.q2 ]
+        results = self.g2.searchMany(queries)
+        self.assertEqual( len(results), len(queries) )
+        for q, r in zip(queries, results):
+            self.assertEqual( r, self.g2.search(q) )
+        self.assertEqual( len(results[0]), 2 )
+
+        # An empty data graph has no results for anything.
+        self.assertEqual( self.g.searchMany([self.q2, q3]), [ [], [] ] )
+
+        # Labels match the way hasLabel() matches them: a name within a
+        # string label, any one of a list of names.
+        g = Graph()
+        g.addEdge( Vertex('d1', 'AB'), Vertex('d2', ['C', 'D']) )
+        g.addEdge( 'd2', Vertex('d3', 'C') )
+        g.addEdge( 'd3', Vertex('d4', ['AB', 'E']) )
+        queries = []
+        for start, end in [ ('A', 'C'), ('B', ['D', 'E']), (['E', 'C'], 'C'),
+                            ('AB', 'C'), ('X', 'C') ]:
+            q = Graph()
+            q.addEdge( Vertex('z1', start), Vertex('z2', end) )
+            queries.append(q)
+        results = g.searchMany(queries)
+        for q, r in zip(queries, results):
+            self.assertEqual( r, g.search(q) )
+        self.assertEqual( [ len(r) for r in results ], [ 1, 1, 1, 1, 0 ] )
+
+    # =========================================================================
+    def testShortestPath(self):
+        # v1 -> v2 -> v3 -> v4, v1 -> v5 -> v4
+        self.g.addEdge( Vertex('v1', 'A'), Vertex('v2', 'B') )
+        self.g.addEdge( 'v2', Vertex('v3', 'C') )
+        self.g.addEdge( 'v3', Vertex('v4', 'D') )
+        self.g.addEdge( 'v1', Vertex('v5', 'E') )
+        self.g.addEdge( 'v5', 'v4' )
+
+        self.assertEqual( self.g.shortestPath('v1', 'v4'), ['v1', 'v5', 'v4'] )
+        self.assertEqual( self.g.shortestPath('v3', 'v3'), ['v3'] )
+        self.assertIsNone( self.g.shortestPath('v4', 'v1') )
+        self.assertEqual( self.g.shortestPath('v4', 'v1', 'in'), ['v4', 'v5', 'v1'] )
+        self.assertEqual( self.g.shortestPath('v2', 'v5', 'both'), ['v2', 'v1', 'v5'] )
+
+    # =========================================================================
+    def testTransaction(self):
+        before = repr(self.g2)
+        degrees = { v.id : v.degree for v in self.g2.vertices() }
+        edges = [ w.id for w in self.g2._edges['v5'] ]
+        inEdges = { vid : list(startVIDs) for vid, startVIDs in self.g2._inNeighbors().items() }
+
+        # An exception inside the transaction undoes everything.
+        with self.assertRaises(KeyError):
+            with self.g2.transaction():
+                self.g2.addEdge('v1', Vertex('v10', 'C'))
+                self.g2.deleteEdge('v2', 'v4')
+                self.g2.deleteVertex('v5')
+                self.g2.deleteVertex('v1')
+                self.g2.addEdge('v2', 'XX')     # doesn't exist
+        self.assertEqual( sorted(repr(self.g2).splitlines()), sorted(before.splitlines()) )
+        self.assertEqual( { v.id : v.degree for v in self.g2.vertices() }, degrees )
+
+        # The deleted vertices are back, last in the vertex order; the edge
+        # lists keep their order.
+        self.assertEqual( list(self.g2._vertices), [ 'v2', 'v3', 'v4', 'v6', 'v7', 'v8',
+                                                     'v9', 'v1', 'v5' ] )
+        self.assertEqual( [ w.id for w in self.g2._edges['v5'] ], edges )
+        self.assertEqual( self.g2._inNeighbors(), inEdges )
+        self.assertEqual( len(self.g2.search(self.q2)), 2 )
+
+        # Without an exception, the changes are kept.
+        with self.g2.transaction():
+            self.g2.deleteVertex('v9')
+        self.assertIsNone( self.g2.getVertex('C') )
+        self.assertEqual( self.g2._vertices['v5'].degree, 8 )
+
+        # Savepoints and explicit rollbacks.
+        with self.g2.transaction():
+            self.g2.addVertex( Vertex('v10', 'E') )
+            self.g2.savepoint('s1')
+            self.g2.addEdge('v10', 'v1')
+            self.g2.savepoint('s2')
+            self.g2.deleteVertex('v1')
+            self.g2.rollback('s2')
+            self.assertTrue( self.g2.hasEdge('v10', 'v1') )
+            self.g2.rollback('s1')
+            self.assertFalse( self.g2.hasEdge('v10', 'v1') )
+            self.assertEqual( self.g2._vertices['v1'].degree, 2 )
+            self.assertRaises( Exception, self.g2.rollback, 's2' )  # forgotten
+            self.g2.rollback()
+            self.assertEqual( self.g2.numVertices(), 8 )
+
+            # Transactions don't nest.
+            with self.assertRaises(Exception):
+                with self.g2.transaction():
+                    pass
+
+        # Savepoints and rollbacks need a transaction.
+        self.assertRaises( Exception, self.g2.savepoint, 's' )
+        self.assertRaises( Exception, self.g2.rollback )
+
     # =========================================================================
     def testVertices(self):
         self.assertEquals( len(self.g.vertices()), 0 ) # empty graph has no vertices
@@ -259,6 +884,29 @@ class TestGraphClass(unittest.TestCase):
         self.assertTrue(u2 in vertices)		
         self.assertTrue(u3 in vertices)			
         
+    # =========================================================================
+    def testWlHash(self):
+        # Hashes don't depend on ids or on the order vertices were added.
+        q = Graph()
+        q.addVertex( Vertex('x2', 'B') )
+        q.addEdge( Vertex('x1', 'A'), 'x2' )
+        q2 = Graph()
+        q2.addEdge( Vertex('y1', 'A'), Vertex('y2', 'B') )
+        self.assertEqual( q.wlHash(), q2.wlHash() )
+        self.assertEqual( q.wlHash(1), q2.wlHash(1) )
+
+        # But they do depend on labels and directions.
+        q2.addEdge('y2', 'y1')
+        self.assertNotEqual( q.wlHash(), q2.wlHash() )
+        q2.deleteEdge('y1', 'y2')
+        self.assertNotEqual( q.wlHash(), q2.wlHash() )
+        q2.deleteEdge('y2', 'y1')
+        q2.addEdge('y1', 'y2')
+        q2._vertices['y1'].label = 'C'
+        self.assertNotEqual( q.wlHash(), q2.wlHash() )
+
+        self.assertEqual( self.g.wlHash(), Graph().wlHash() )
+
     # =========================================================================
     def test_filterCandidates(self):
         # Empty graph produces no results.
@@ -327,6 +975,16 @@ class TestGraphClass(unittest.TestCase):
         # Joining u1 and v3 is true because nothing has been matched yet.
         self.assertTrue( self.g2._isJoinable(u1, v3, self.q2, {}) )
 
+        # Edges from matched query vertices count too. Data: A1 -> B1, A2.
+        self.g.addEdge( Vertex('a1', 'A'), Vertex('b1', 'B') )
+        self.g.addVertex( Vertex('a2', 'A') )
+        self.q.addEdge( Vertex('u1', 'A'), Vertex('u2', 'B') )
+        u2 = self.q._vertices['u2']
+        b1 = self.g._vertices['b1']
+        self.assertTrue( self.g._isJoinable(u2, b1, self.q, {'u1':'a1'}) )
+        self.assertFalse( self.g._isJoinable(u2, b1, self.q, {'u1':'a2'}) )
+        self.assertEqual( self.g.search(self.q), [ {'u1':'a1', 'u2':'b1'} ] )
+
     # =========================================================================
     def test_isMatched(self):
         v = Vertex('v4')
@@ -372,5 +1030,20 @@ class TestGraphClass(unittest.TestCase):
         # Test our pre-defined problem, which has two solutions.
         self.assertEquals( len(self.g2.search(self.q2)), 2 )
 
+        # A query as big as the data graph is a test for isomorphism, which
+        # is rejected without searching when the structures differ.
+        q = Graph()
+        q.addEdge( Vertex('u1', 'A'), Vertex('u2', 'A') )
+        q.addEdge( 'u2', Vertex('u3', 'A') )
+        self.g.addEdge( Vertex('v1', 'A'), Vertex('v2', 'A') )
+        self.g.addEdge( 'v1', Vertex('v3', 'A') )
+        self.assertNotEqual( q._structureHash(), self.g._structureHash() )
+        self.assertEqual( self.g.search(q), [] )
+
+        # Same structure: the search goes ahead.
+        self.g.deleteEdge('v1', 'v3')
+        self.g.addEdge('v2', 'v3')
+        self.assertEqual( self.g.search(q), [ {'u1':'v1', 'u2':'v2', 'u3':'v3'} ] )
+
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,143 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+from src.Graph import Graph
+from src.GraphLog import GraphLog
+from src.Vertex import Vertex
+
+class TestGraphLogClass(unittest.TestCase):
+
+    # =========================================================================
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.dir, 'graph.log')
+
+    # =========================================================================
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    # =========================================================================
+    def build(self, g):
+        g.addEdge( Vertex('v1', 'A', 1), Vertex('v2', ['B', 'C']) )
+        g.addEdge( 'v2', Vertex('v3', 'C', 3), True )
+        g.addVertex( Vertex('v4', None, 2**70) )
+        g.addEdge( 'v4', 'v1', label='knows' )
+        g.deleteEdge('v3', 'v2')
+
+    # =========================================================================
+    def assertSameGraph(self, g, h):
+        self.assertEqual( [ (v.id, v.label, v.number, v.degree) for v in g.vertices() ],
+                          [ (v.id, v.label, v.number, v.degree) for v in h.vertices() ] )
+        self.assertEqual( [ (u.id, v.id, g.edgeLabel(u.id, v.id)) for u, v in g.edges() ],
+                          [ (u.id, v.id, h.edgeLabel(u.id, v.id)) for u, v in h.edges() ] )
+        self.assertEqual( { vid : list(startVIDs) for vid, startVIDs in g._inNeighbors().items() },
+                          { vid : list(startVIDs) for vid, startVIDs in h._inNeighbors().items() } )
+
+    # =========================================================================
+    def testReplay(self):
+        g = Graph.open(self.path, syncEvery=2)
+        self.build(g)
+        g.closeLog()
+
+        expected = Graph()
+        self.build(expected)
+        h = Graph.open(self.path)
+        self.assertSameGraph(h, expected)
+
+        # Changes after reopening are logged too.
+        h.deleteVertex('v2')
+        h.closeLog()
+        expected.deleteVertex('v2')
+        self.assertSameGraph(Graph.open(self.path), expected)
+
+    # =========================================================================
+    def testCheckpoint(self):
+        g = Graph.open(self.path)
+        self.build(g)
+        g.syncLog()
+        oldLog = open(self.path, 'rb').read()
+
+        # v1's in-edges (v4, then v3) aren't in the order the checkpoint
+        # adds the edges in (v3's before v4's), and are still read back in
+        # their own order.
+        g.addEdge( 'v3', 'v1' )
+        g.checkpoint()
+        self.assertLess( os.path.getsize(self.path), len(oldLog) )
+
+        g.addEdge( 'v4', 'v1' )
+        g.closeLog()
+        self.assertSameGraph(Graph.open(self.path), g)
+
+        # A crash between writing the checkpoint and emptying the log leaves
+        # the old log behind; its changes are already in the checkpoint.
+        with open(self.path, 'wb') as f:
+            f.write(oldLog)
+        expected = Graph()
+        self.build(expected)
+        expected.addEdge( 'v3', 'v1' )
+        self.assertSameGraph(Graph.open(self.path), expected)
+
+    # =========================================================================
+    def testChunks(self):
+        # Records are read back a chunk at a time, including those that
+        # straddle chunks or are bigger than one.
+        chunk = GraphLog._CHUNK
+        GraphLog._CHUNK = 64
+        try:
+            log = GraphLog(self.path)
+            records = [ (GraphLog.INSERT_VERTEX, ('v%d' % i, 'x' * i, i)) for i in range(100) ]
+            log.checkpoint(records)
+            log.append( GraphLog.REMOVE_VERTEX, 'v5' )
+            log.close()
+
+            log = GraphLog(self.path)
+            self.assertEqual( log._generation, 1 )
+            self.assertEqual( list(log.recover()),
+                              records + [ (GraphLog.REMOVE_VERTEX, ('v5',)) ] )
+            log.close()
+        finally:
+            GraphLog._CHUNK = chunk
+
+    # =========================================================================
+    def testTornTail(self):
+        g = Graph.open(self.path)
+        self.build(g)
+        g.closeLog()
+        size = os.path.getsize(self.path)
+
+        # Cut the last record (the edge deletion) short.
+        with open(self.path, 'r+b') as f:
+            f.truncate(size - 3)
+        h = Graph.open(self.path)
+        self.assertTrue( h.hasEdge('v3', 'v2') )
+
+        # The torn record was cut off, so new records are read back.
+        h.addVertex( Vertex('v5', 'E') )
+        h.closeLog()
+        self.assertIsNotNone( Graph.open(self.path).getVertex('E') )
+
+    # =========================================================================
+    def testTransaction(self):
+        g = Graph.open(self.path, syncEvery=1000)
+        self.build(g)
+        with self.assertRaises(ValueError):
+            with g.transaction():
+                g.deleteVertex('v1')
+                raise ValueError()
+        with g.transaction():
+            g.deleteVertex('v4')
+
+        # The transactions were synced when they ended, and the rolled back
+        # deletion was replayed with the vertex put back last, as in g.
+        self.assertEqual( [ v.id for v in g.vertices() ], ['v2', 'v3', 'v1'] )
+        self.assertSameGraph(Graph.open(self.path), g)
+
+        # A transaction that never ended isn't replayed.
+        expected = g.copy()
+        g._log.append( g._log.TX_BEGIN )
+        g.deleteVertex('v1')
+        g.syncLog()
+        self.assertSameGraph(Graph.open(self.path), expected)
+        g._log.close()
@@ -0,0 +1,67 @@
+import unittest
+
+from src.Overlay import Overlay
+
+class TestOverlayClass(unittest.TestCase):
+
+    # =========================================================================
+    def setUp(self):
+        self.base = { 'a' : 1, 'b' : 2, 'c' : 3 }
+        self.o = Overlay(self.base)
+
+    # =========================================================================
+    def testReadThrough(self):
+        self.assertEqual( dict(self.o), self.base )
+        self.assertEqual( len(self.o), 3 )
+        self.assertTrue( 'b' in self.o )
+        self.assertEqual( self.o.get('x', 0), 0 )
+        with self.assertRaises(KeyError):
+            self.o['x']
+
+    # =========================================================================
+    def testChanges(self):
+        self.o['b'] = 20        # changed in place
+        self.o['d'] = 4         # added
+        del self.o['a']         # removed
+        self.assertEqual( list(self.o.items()), [ ('b', 20), ('c', 3), ('d', 4) ] )
+        self.assertEqual( len(self.o), 3 )
+        self.assertFalse( 'a' in self.o )
+        self.assertEqual( self.o.delta(), 3 )
+        with self.assertRaises(KeyError):
+            del self.o['a']
+
+        # The base is never changed.
+        self.assertEqual( self.base, { 'a' : 1, 'b' : 2, 'c' : 3 } )
+
+        # A key removed and set again goes last, as in a dict.
+        self.o['a'] = 10
+        del self.o['d']
+        self.assertEqual( list(self.o), [ 'b', 'c', 'a' ] )
+        self.assertEqual( len(self.o), 3 )
+        self.assertEqual( self.o.pop('b'), 20 )
+        self.assertEqual( list(self.o), [ 'c', 'a' ] )
+
+    # =========================================================================
+    def testCopyFlattenAbsorb(self):
+        self.o['d'] = 4
+        del self.o['a']
+        c = self.o.copy()
+        c['e'] = 5
+        self.assertFalse( 'e' in self.o )
+        self.assertIs( c.base, self.base )
+        self.assertEqual( len(c), 4 )
+
+        # Flattening makes a new dictionary with the same order.
+        flat = c.flatten()
+        self.assertEqual( list(flat.items()), list(c.items()) )
+        self.assertEqual( len(self.base), 3 )
+
+        # Absorbing applies the changes to the base itself.
+        items = list(c.items())
+        self.assertIs( c.absorb(), self.base )
+        self.assertEqual( list(self.base.items()), items )
+        self.assertEqual( c.delta(), 0 )
+        self.assertEqual( list(c.items()), items )
+
+if __name__ == '__main__':
+    unittest.main()
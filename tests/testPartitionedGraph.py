@@ -0,0 +1,104 @@
+import random
+import unittest
+
+from src.Graph import Graph
+from src.PartitionedGraph import PartitionedGraph
+from src.Vertex import Vertex
+
+class TestPartitionedGraphClass(unittest.TestCase):
+
+    # =========================================================================
+    def setUp(self):
+        # A random data graph, some of whose edges are labelled, and a few
+        # queries drawn from it, connected or not, with edges both ways.
+        rng = random.Random(7)
+        edgeLabels = random.Random(8)
+        self.g = Graph()
+        for i in range(40):
+            label = rng.choice([ 'A', 'B', 'C', ['A', 'C'] ])
+            self.g.addVertex( Vertex('v%d' % i, label) )
+        for n in range(90):
+            u, v = rng.sample(range(40), 2)
+            if not self.g.hasEdge('v%d' % u, 'v%d' % v):
+                self.g.addEdge( 'v%d' % u, 'v%d' % v,
+                                label=edgeLabels.choice([ None, 'x', 'y' ]) )
+
+        self.queries = []
+
+        # A -> B -> C
+        q = Graph()
+        q.addEdge( Vertex('q1', 'A'), Vertex('q2', 'B') )
+        q.addEdge( 'q2', Vertex('q3', 'C') )
+        self.queries.append(q)
+
+        # A <-> C, with a B -> A edge in
+        q = Graph()
+        q.addEdge( Vertex('q1', 'A'), Vertex('q2', 'C'), True )
+        q.addEdge( Vertex('q3', 'B'), 'q1' )
+        self.queries.append(q)
+
+        # C -> A and a lone B
+        q = Graph()
+        q.addEdge( Vertex('q1', 'C'), Vertex('q2', 'A') )
+        q.addVertex( Vertex('q3', 'B') )
+        self.queries.append(q)
+
+        # A -x-> B <-y- C
+        q = Graph()
+        q.addEdge( Vertex('q1', 'A'), Vertex('q2', 'B'), label='x' )
+        q.addEdge( Vertex('q3', 'C'), 'q2', label='y' )
+        self.queries.append(q)
+
+        # A label no vertex has
+        q = Graph()
+        q.addVertex( Vertex('q1', 'Z') )
+        self.queries.append(q)
+
+    # =========================================================================
+    @staticmethod
+    def normalize(solutions:list) -> list:
+        return sorted( sorted(M.items()) for M in solutions )
+
+    # =========================================================================
+    def testSearch(self):
+        expected = [ self.normalize(self.g.search(q)) for q in self.queries ]
+        self.assertGreater( len(expected[0]), 0 )
+
+        for by in ( 'hash', 'label' ):
+            for numShards in ( 1, 3 ):
+                with self.g.partition(numShards, by) as pg:
+                    self.assertEqual( pg.numVertices(), self.g.numVertices() )
+                    self.assertEqual( len(pg.shardSizes()), numShards )
+                    for q, solutions in zip(self.queries, expected):
+                        self.assertEqual( self.normalize(pg.search(q)), solutions )
+
+    # =========================================================================
+    def testLabelPartition(self):
+        # Vertices with the same label share a shard.
+        shardOf = PartitionedGraph._assign(self.g, 3, 'label')
+        shards = dict()
+        for v in self.g.vertices():
+            shards.setdefault(Graph._labelKey(v.label), set()).add(shardOf[v.id])
+        self.assertTrue( all(len(s) == 1 for s in shards.values()) )
+
+        with self.assertRaises(Exception):
+            self.g.partition(2, 'random')
+
+    # =========================================================================
+    def testFailedSearch(self):
+        # A query the shards fail on doesn't leave replies behind that would
+        # spoil the next search.
+        q = Graph()
+        q.addEdge( Vertex('q1', None), Vertex('q2', 'B') )
+        expected = self.normalize(self.g.search(self.queries[0]))
+        with self.g.partition(3) as pg:
+            with self.assertRaises(Exception):
+                pg.search(q)
+            self.assertEqual( self.normalize(pg.search(self.queries[0])), expected )
+
+    # =========================================================================
+    def testClose(self):
+        pg = self.g.partition(2)
+        pg.close()
+        with self.assertRaises(Exception):
+            pg.search(self.queries[0])
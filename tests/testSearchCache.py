@@ -0,0 +1,75 @@
+import unittest
+
+from src.SearchCache import SearchCache
+
+class TestSearchCacheClass(unittest.TestCase):
+
+    # =========================================================================
+    def testLookup(self):
+        cache = SearchCache(10000)
+        fresh = lambda version, labels: True
+
+        # Nothing cached yet.
+        self.assertIsNone( cache.lookup('q', fresh) )
+        self.assertEqual( (cache.hits, cache.misses), (0, 1) )
+
+        cache.store('q', 1, {'A'}, [ {'u1':'v1'} ])
+        self.assertEqual( cache.lookup('q', fresh), [ {'u1':'v1'} ] )
+        self.assertEqual( (cache.hits, cache.misses), (1, 1) )
+        self.assertEqual( len(cache), 1 )
+        self.assertTrue( cache.bytes > 0 )
+
+        # The freshness test gets the entry's version and labels, and stale
+        # entries are dropped.
+        seen = []
+        stale = lambda version, labels: seen.append( (version, labels) ) and False
+        self.assertIsNone( cache.lookup('q', stale) )
+        self.assertEqual( seen, [ (1, {'A'}) ] )
+        self.assertEqual( (len(cache), cache.bytes), (0, 0) )
+        self.assertEqual( (cache.hits, cache.misses), (1, 2) )
+
+        # An entry found fresh at a later version is stamped with it, and
+        # isn't checked again at that version.
+        cache.store('q', 1, {'A'}, [ {'u1':'v1'} ])
+        checks = []
+        counted = lambda version, labels: checks.append(version) or True
+        cache.lookup('q', counted, 5)
+        cache.lookup('q', counted, 5)
+        self.assertEqual( checks, [ 1 ] )
+
+    # =========================================================================
+    def testEviction(self):
+        fresh = lambda version, labels: True
+        solutions = [ {'u1':'v%d' % i} for i in range(10) ]
+        size = SearchCache._sizeOf('q1', solutions)
+
+        # Room for two entries.
+        cache = SearchCache(2 * size)
+        cache.store('q1', 0, set(), solutions)
+        cache.store('q2', 0, set(), solutions)
+        cache.lookup('q1', fresh)               # q2 is now least recently used
+        cache.store('q3', 0, set(), solutions)
+        self.assertIsNone( cache.lookup('q2', fresh) )
+        self.assertIsNotNone( cache.lookup('q1', fresh) )
+        self.assertIsNotNone( cache.lookup('q3', fresh) )
+        self.assertTrue( cache.bytes <= cache.maxBytes )
+
+        # Results that can never fit aren't cached.
+        cache.store('q4', 0, set(), solutions * 10)
+        self.assertIsNone( cache.lookup('q4', fresh) )
+        self.assertEqual( len(cache), 2 )
+
+        cache.clear()
+        self.assertEqual( (len(cache), cache.bytes), (0, 0) )
+
+    # =========================================================================
+    def testKeySize(self):
+        # Everything nested in a key is counted, each object once.
+        vid = 'u' * 1000
+        key = ( ( (vid, 'A', 1), ), ( (vid, ( ('u2', None), )), ) )
+        size = SearchCache._sizeOf(key, [])
+        self.assertGreater( size, 1000 )
+        self.assertLess( size, 2000 )
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,98 @@
+import unittest
+
+from src.Graph import Graph
+from src.Vertex import Vertex
+
+class TestSubgraphViewClass(unittest.TestCase):
+
+    # =========================================================================
+    def setUp(self):
+        # A -> B -> C -> A, plus C -> D
+        self.g = Graph()
+        self.g.addEdge( Vertex('v1', 'A'), Vertex('v2', 'B') )
+        self.g.addEdge( 'v2', Vertex('v3', 'C') )
+        self.g.addEdge( 'v3', 'v1' )
+        self.g.addEdge( 'v3', Vertex('v4', 'D') )
+
+        # The view holds A, B, C (and an id that doesn't exist).
+        self.view = self.g.subgraph(['v1', 'v2', 'v3', 'XX'])
+
+    # =========================================================================
+    def testVertices(self):
+        self.assertEqual( self.view.numVertices(), 3 )
+        self.assertEqual( [ v.id for v in self.view.vertices() ], ['v1', 'v2', 'v3'] )
+
+        # The view shares the base graph's Vertex objects.
+        self.assertIs( self.view._vertices['v1'], self.g._vertices['v1'] )
+        self.assertIsNone( self.view.getVertex('D') )
+
+    # =========================================================================
+    def testEdges(self):
+        edges = [ (u.id, v.id) for u, v in self.view.edges() ]
+        self.assertEqual( edges, [ ('v1','v2'), ('v2','v3'), ('v3','v1') ] )
+
+        self.assertTrue( self.view.hasEdge('v3', 'v1') )
+        self.assertFalse( self.view.hasEdge('v3', 'v4') )   # v4 isn't in the view
+        self.assertTrue( self.g.hasEdge('v3', 'v4') )
+
+        # Edges added to the base graph show up in the view.
+        self.g.addEdge('v1', 'v3')
+        self.assertTrue( self.view.hasEdge('v1', 'v3') )
+
+        # ... and so do the degrees that come with them.
+        self.assertEqual( self.view._degree(self.g._vertices['v1']), 3 )
+        self.assertEqual( self.view._version, self.g._version )
+
+        # Edge labels too, for edges within the view.
+        self.g.addEdge('v4', 'v2', label='x')
+        self.g.addEdge('v2', 'v1', label='x')
+        self.assertEqual( self.view.edgeLabel('v2', 'v1'), 'x' )
+        self.assertIsNone( self.view.edgeLabel('v4', 'v2') )
+        self.assertEqual( self.view._edgeTargets('v2', 'x'), {'v1'} )
+        self.assertEqual( self.view.copy().edgeLabel('v2', 'v1'), 'x' )
+
+    # =========================================================================
+    def testReadOnly(self):
+        self.assertRaises( Exception, self.view.addVertex, Vertex('v5') )
+        self.assertRaises( Exception, self.view.addEdge, 'v1', 'v3' )
+        self.assertRaises( Exception, self.view.deleteEdge, 'v1', 'v2' )
+        self.assertRaises( Exception, self.view.deleteVertex, 'v1' )
+        self.assertEqual( self.g.numVertices(), 4 )
+
+    # =========================================================================
+    def testSearch(self):
+        # C -> X, where X has degree 2 in the base graph but 1 in the view.
+        q = Graph()
+        q.addEdge( Vertex('u1', 'C'), Vertex('u2', 'A') )
+        self.assertEqual( self.view.search(q), [ {'u1':'v3', 'u2':'v1'} ] )
+
+        # C with degree 3 is in the base graph but not in the view.
+        q = Graph()
+        q.addEdge( Vertex('u1', 'B'), Vertex('u2', 'C') )
+        q.addEdge( 'u2', Vertex('u3', 'A') )
+        q.addEdge( 'u2', Vertex('u4', 'D') )
+        self.assertEqual( len(self.g.search(q)), 1 )
+        self.assertEqual( len(self.view.search(q)), 0 )
+
+        # A view can be a query graph too; its degrees are the view's own.
+        self.assertEqual( len(self.g.search(self.g.subgraph(['v3', 'v4']))), 1 )
+        self.assertEqual( len(self.g.search(self.view)), 1 )
+
+        # Views of views.
+        inner = self.view.subgraph(['v1', 'v2'])
+        self.assertEqual( inner.numVertices(), 2 )
+        self.assertEqual( inner.search(self.view), [] )
+
+    # =========================================================================
+    def testCopy(self):
+        g = self.view.copy()
+        self.assertEqual( repr(g), repr(self.view) )
+        self.assertEqual( g._vertices['v3'].degree, 2 )
+        self.assertEqual( self.g._vertices['v3'].degree, 3 )
+
+        # The copy is independent of the base graph.
+        g.deleteVertex('v1')
+        self.assertEqual( self.view.numVertices(), 3 )
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,125 @@
+import unittest
+
+import src.VertexColumns
+from src.VertexColumns import VertexColumns
+from src.Vertex import Vertex
+
+class TestVertexColumnsClass(unittest.TestCase):
+
+    # =========================================================================
+    def setUp(self):
+        # A(1) -> B(2), A(1) -> BD(3), C -> B(2); vertex 'e' has no label.
+        self.c = VertexColumns()
+        self.c.add( Vertex('a', 'A', 1) )
+        self.c.add( Vertex('b', 'B', 2) )
+        self.c.add( Vertex('bd', ['B', 'D'], 3) )
+        self.c.add( Vertex('c', 'C', 'x') )
+        self.c.add( Vertex('e') )
+        self.c.link('a', 'b')
+        self.c.link('a', 'bd')
+        self.c.link('c', 'b')
+
+    # =========================================================================
+    def checkSelect(self):
+        c = self.c
+        self.assertEqual( c.select(), ['a', 'b', 'bd', 'c', 'e'] )
+        self.assertEqual( c.select('B'), ['b', 'bd'] )
+        self.assertEqual( c.select(['D', 'C']), ['bd', 'c'] )
+        self.assertEqual( c.select('X'), [] )
+        self.assertEqual( c.select(minDegree=2), ['a', 'b'] )
+        self.assertEqual( c.select(minOutDegree=1), ['a', 'c'] )
+        self.assertEqual( c.select('B', minInDegree=2), ['b'] )
+        self.assertEqual( c.select(number=3), ['bd'] )
+        self.assertEqual( c.select(number='x'), [] )    # only ints are kept
+
+        # Removing edges and vertices.
+        c.unlink('c', 'b')
+        self.assertEqual( c.select('B', minInDegree=1), ['b', 'bd'] )
+        c.unlink('a', 'b')      # Graph removes a vertex's edges first
+        c.unlink('a', 'bd')
+        c.remove('a')
+        self.assertEqual( c.select('B', minInDegree=1), [] )
+        self.assertEqual( c.select(), ['b', 'bd', 'c', 'e'] )
+
+    # =========================================================================
+    def testSelect(self):
+        self.checkSelect()
+
+    # =========================================================================
+    def testSelectWithoutNumpy(self):
+        numpy = src.VertexColumns.numpy
+        src.VertexColumns.numpy = None
+        try:
+            self.checkSelect()
+        finally:
+            src.VertexColumns.numpy = numpy
+
+    # =========================================================================
+    def testLabelSemantics(self):
+        # Same as Vertex.hasLabel(): a single string label matches any part
+        # of it, a list of labels has to contain the label.
+        c = VertexColumns()
+        c.add( Vertex('ab', 'AB') )
+        c.add( Vertex('l', ['AB']) )
+        self.assertEqual( c.select('A'), ['ab'] )
+        self.assertEqual( c.select('AB'), ['ab', 'l'] )
+
+        # A label seen after a query is still found by the same query.
+        c.add( Vertex('xa', 'XA') )
+        self.assertEqual( c.select('A'), ['ab', 'xa'] )
+        self.assertTrue( c.exact() )
+
+        # More than 64 labels share bits, so results are a superset.
+        for i in range(100):
+            c.add( Vertex('v%d' % i, 'L%d' % i) )
+        self.assertFalse( c.exact() )
+        self.assertIn( 'v7', c.select('L7') )
+
+    # =========================================================================
+    def testCompact(self):
+        c = VertexColumns()
+        for i in range(10):
+            c.add( Vertex('v%d' % i, 'A') )
+        for i in range(0, 10, 2):
+            c.remove('v%d' % i)
+        c.remove('v1')          # more than half dead now
+        self.assertEqual( (c._rows, len(c._pages[0].vids)), (4, 4) )
+        self.assertEqual( c.select('A'), ['v3', 'v5', 'v7', 'v9'] )
+        c.link('v3', 'v9')
+        self.assertEqual( c.select(minInDegree=1), ['v9'] )
+
+    # =========================================================================
+    def testCopy(self):
+        # Copies share pages until one of them changes a page.
+        c = VertexColumns()
+        for i in range(20000):
+            c.add( Vertex('v%d' % i, 'A' if i % 2 else 'B') )
+        copy = c.copy()
+        self.assertEqual( len(c._pages), 3 )
+        self.assertTrue( all( p is q for p, q in zip(c._pages, copy._pages) ) )
+
+        copy.link('v1', 'v3')
+        copy.add( Vertex('new', 'C') )
+        copy.remove('v10')
+        self.assertIs( copy._pages[1], c._pages[1] )
+        self.assertIsNot( copy._pages[0], c._pages[0] )
+        self.assertEqual( copy.select(minDegree=1), ['v1', 'v3'] )
+        self.assertEqual( c.select(minDegree=1), [] )
+        self.assertEqual( copy.select('C'), ['new'] )
+        self.assertEqual( c.select('C'), [] )
+        self.assertEqual( len(c.select('B')), 10000 )
+        self.assertEqual( len(copy.select('B')), 9999 )
+
+        # The original can change too, and compacting gives a store of its own.
+        c.link('v2', 'v4')
+        self.assertEqual( copy.select(minDegree=1), ['v1', 'v3'] )
+        for i in range(12000):
+            if i != 10:
+                copy.remove('v%d' % i)
+        self.assertEqual( len(copy.select()), 8001 )
+        self.assertIsNone( copy._ownedPages )
+        self.assertEqual( c.select(minDegree=1), ['v2', 'v4'] )
+        self.assertEqual( copy.select('C'), ['new'] )
+
+if __name__ == '__main__':
+    unittest.main()